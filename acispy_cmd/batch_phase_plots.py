@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import matplotlib
+matplotlib.use("agg")
+import matplotlib.pyplot as plt
+import argparse
+import os
+import numpy as np
+import acispy
+from acispy.utils import state_labels, mylog
+from acispy_cmd.telemetry import cached_telemetry
+from acispy_cmd.phase import PhaseHistogram, RasterPhasePlot, get_common_fields
+
+
+def read_plots(args):
+    plots = list(args.plots)
+    if args.plot_file is not None:
+        with open(args.plot_file) as f:
+            for line in f:
+                line = line.split("#")[0].strip()
+                if line:
+                    plots.append(line)
+    return [tuple(p.split(",")) for p in plots]
+
+
+def make_scatter_plot(data, x_field, y_field, c_field, args):
+    x, x_label = data[x_field]
+    y, y_label = data[y_field]
+    c, c_label = (None, None) if c_field is None else data[c_field]
+    if args.raster:
+        pp = RasterPhasePlot(x, y, c=c, how=args.raster_color, cmap=args.cmap,
+                             x_label=x_label, y_label=y_label, c_label=c_label)
+        return pp.fig
+    fig, ax = plt.subplots(figsize=(10, 8))
+    sc = ax.scatter(x, y, c=c, cmap=args.cmap if c is not None else None, s=5)
+    if c is not None:
+        fig.colorbar(sc, ax=ax, label=c_label)
+    ax.set_xlabel(x_label)
+    ax.set_ylabel(y_label)
+    return fig
+
+
+def get_range(values):
+    vmin, vmax = values.min(), values.max()
+    if vmin == vmax:
+        vmin, vmax = vmin-0.5, vmax+0.5
+    return vmin, vmax
+
+
+def make_histogram_plot(data, x_field, y_field, args):
+    x, x_label = data[x_field]
+    y, y_label = data[y_field]
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    good = np.isfinite(x) & np.isfinite(y)
+    if not good.any():
+        raise ValueError("There are no samples with finite values to plot.")
+    hist = PhaseHistogram.from_range(x_field, y_field, get_range(x[good]),
+                                     get_range(y[good]), args.bins, args.bins)
+    hist.x_label = x_label
+    hist.y_label = y_label
+    hist.add(x, y)
+    fig, _ = hist.plot(scale=args.scale, cmap=args.cmap)
+    return fig
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Make many phase plots of MSIDs or states versus each other within a certain time frame from one fetch of the telemetry, saving them to files.')
+    parser.add_argument("tstart", type=str, help='The start time in YYYY:DOY:HH:MM:SS format')
+    parser.add_argument("tstop", type=str, help='The stop time in YYYY:DOY:HH:MM:SS format')
+    parser.add_argument("plots", type=str, nargs="*", help="The plots to make, each the x-axis and y-axis fields and optionally the color field, comma-separated")
+    parser.add_argument("--plot-file", type=str, help="A file with a plot to make on each line, in the same form as the plots argument.")
+    parser.add_argument("--kind", type=str, default="scatter", choices=["scatter", "histogram", "both"], help="Whether to make scatter plots, histograms or both. Default: scatter")
+    parser.add_argument("--outdir", type=str, default=os.getcwd(), help="The directory to write the plots to. Default: the current directory")
+    parser.add_argument("--bins", type=int, default=40, help="The number of bins on each axis of the histograms. Default: 40")
+    parser.add_argument("--scale", type=str, default="linear", help="Use linear or log scaling for the histograms, default 'linear'")
+    parser.add_argument("--cmap", type=str, help='The colormap to use for colors and histograms')
+    parser.add_argument("--raster", action="store_true", help="Draw the scatter plots as images binned at the resolution of the plot.")
+    parser.add_argument("--raster-color", type=str, default="mean", choices=["mean", "max", "last"], help="How to combine the colors of the samples in each pixel with --raster. Default: mean")
+    parser.add_argument("--full-res", action="store_true", help="Use full resolution data instead of 5-minute statistics.")
+    parser.add_argument("--maude", action="store_true", help="Use MAUDE to get telemetry data.")
+    parser.add_argument("--maude-concurrency", type=int, default=4, help="The number of requests to make to MAUDE at once. Default: 4")
+    parser.add_argument("--no-cache", action="store_true", help="Fetch all of the telemetry instead of using the cache of telemetry from earlier runs.")
+    parser.add_argument("--verbose", action="store_true", help="Report how much of the telemetry came from the cache.")
+    args = parser.parse_args()
+
+    plots = read_plots(args)
+    if len(plots) == 0:
+        parser.error("No plots were given.")
+    for p in plots:
+        if len(p) not in [2, 3]:
+            parser.error("Each plot must be two or three comma-separated fields, "
+                         "not '%s'." % ",".join(p))
+
+    fields = []
+    for p in plots:
+        for field in p:
+            if field not in fields:
+                fields.append(field)
+    msids = [field for field in fields if field not in state_labels]
+    if len(msids) == 0:
+        parser.error("At least one of the fields must be an MSID.")
+
+    maude_concurrency = args.maude_concurrency if args.maude else None
+    with cached_telemetry(enabled=not args.no_cache,
+                          maude_concurrency=maude_concurrency) as cache:
+        if args.maude:
+            mylog.info("Using MAUDE to retrieve MSID data.")
+            ds = acispy.MaudeData(args.tstart, args.tstop, msids)
+        else:
+            ds = acispy.EngArchiveData(args.tstart, args.tstop, msids,
+                                       stat=None if args.full_res else '5min',
+                                       filter_bad=True)
+    if args.verbose and cache is not None:
+        mylog.info(cache.get_stats())
+
+    _, data = get_common_fields(ds, fields)
+
+    kinds = ["scatter", "histogram"] if args.kind == "both" else [args.kind]
+    for p in plots:
+        for kind in kinds:
+            name = "_".join(p if kind == "scatter" else p[:2])
+            try:
+                if kind == "scatter":
+                    fig = make_scatter_plot(data, p[0], p[1], p[2] if len(p) > 2 else None,
+                                            args)
+                else:
+                    fig = make_histogram_plot(data, p[0], p[1], args)
+            except ValueError as e:
+                mylog.warning("Skipping the %s plot of %s: %s" % (kind, name, e))
+                continue
+            filename = os.path.join(args.outdir, "%s_%s.png" % (name, kind))
+            fig.savefig(filename, bbox_inches='tight')
+            plt.close(fig)
+            mylog.info("Wrote %s." % filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+On-disk caches shared by the command-line tools.
+"""
+import os
+import shutil
+
+# The default limit on the size of each cache, in bytes
+default_cache_size = 2*1024**3
+
+
+def get_cache_dir(name):
+    """
+    Return the directory of the cache *name*, creating it if needed. The
+    caches are kept under $ACISPY_CMD_CACHE, or ~/.cache/acispy_cmd if
+    it is not set.
+    """
+    base = os.environ.get("ACISPY_CMD_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "acispy_cmd"))
+    path = os.path.join(base, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_entry_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                size += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return size
+
+
+def touch_entry(path):
+    """
+    Mark a cache entry as used, for the least-recently-used eviction.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict_lru(cache_dir, max_size, keep=None):
+    """
+    Remove the least recently used entries of *cache_dir* until its size
+    is no more than *max_size* bytes, never removing *keep*.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        entries.append((mtime, path, get_entry_size(path)))
+    total = sum(entry[2] for entry in entries)
+    for _, path, size in sorted(entries):
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
@@ -2,25 +2,43 @@
 
 from datetime import datetime, timedelta, timezone
 import os
+import time
+import traceback
 import matplotlib
 matplotlib.use("agg")
 import acispy
+import xija
 from acispy.utils import cti_simodes, mylog
 from acispy.thermal_models import short_name
 import matplotlib.pyplot as plt
+from matplotlib.dates import DateFormatter
 from cxotime import CxoTime
 import argparse
 import numpy as np
 from Ska.Matplotlib import cxctime2plotdate
-import bisect
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pickle
+import shutil
+import tempfile
+from pickle import PicklingError
+from collections import namedtuple
+from operator import itemgetter
 import logging
 from kadi.commands.states import decode_power, get_states, DEFAULT_STATE_KEYS
 from kadi.commands import get_cmds
 from kadi.events import load_segments, rad_zones, dsn_comms, scs107s
 from pathlib import Path
+from astropy.table import Table, vstack
 import warnings
 import astropy.units as u
 import chandra_limits as cl
+from acispy_cmd.tracelog import TracelogSet, ten_day_tracelog_files
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
 
 
 state_keys = DEFAULT_STATE_KEYS + ("hrc_15v", "hrc_24v", "hrc_i", "hrc_s",)
@@ -32,6 +50,14 @@ warnings.filterwarnings("ignore", "redundantly")
 
 chandra_models_path = Path(f"{os.environ['SKA']}/data/chandra_models/chandra_models/xija")
 
+# Seconds to wait after inotify reports a tracelog change before reading it
+tracelog_settle_time = 5.0
+
+plot_fontsize = 18
+
+# Seconds the page is kept up to date before the script exits
+run_duration = 21600.0
+
 date2secs = lambda t: CxoTime(t).secs
 
 header = '''
@@ -96,6 +122,14 @@ script = '''
 temps = ["fptemp_11", "1dpamzt", "1deamzt", "1pdeaat", "tmp_fep1_mong",
          "tmp_fep1_actel", "tmp_bep_pcb"]
 
+plot_names = ["fptemp_11", "1dpamzt", "1deamzt", "1pdeaat", "ccd", "roll",
+              "tmp_fep1_mong", "tmp_fep1_actel", "tmp_bep_pcb"]
+
+# The fields of each model which are plotted over the whole window
+model_plot_fields = {temp: [("model", temp), "pitch"] for temp in temps}
+model_plot_fields["fptemp_11"] += ["off_nom_roll", "earth_solid_angle"]
+model_plot_fields[temps[-1]] += ["ccd_count", "fep_count", ("states", "simpos")]
+
 plot_limits = {"fptemp_11": (-120.0, -95.0),
                "1deamzt": (5.0, 44.0),
                "1dpamzt": (5.0, 44.0),
@@ -187,119 +221,146 @@ def get_radzones(begin_time, last_time):
     return radzones
 
 
-def process_commands(now_time_utc, cmds):
-
-    now_time_secs = CxoTime(now_time_utc).secs
-    end_time_secs = now_time_secs + 86400.0
-    start_time_secs = now_time_secs - 2.0*86400.0
-
-    cmdlines = []
-    cmdtimes = []
-    simtrans = []
-
-    in_science = False
-
-    duration = None
+class CommandTimeline:
+    """
+    The filtered and formatted command lines for the page, built once
+    from the commands fetched on a reload. The lines for any time window
+    are then selected by searching the sorted array of command times.
+    """
+    def __init__(self, cmds):
+        if len(cmds) > 0:
+            cmd_times = CxoTime(cmds["date"]).secs
+        else:
+            cmd_times = []
 
-    for cmd in cmds:
+        times = []
+        lines = []
+        # An integration time line is only shown if the integration
+        # started within the window, so keep track of when it started
+        valid_from = []
+        sim_times = []
+        self.simtrans = []
 
-        the_time = CxoTime(cmd["date"]).secs
+        in_science = False
+        science_start = None
+        duration = None
 
-        if the_time < start_time_secs or the_time > end_time_secs:
-            continue
+        for cmd, the_time in zip(cmds, cmd_times):
 
-        if cmd["type"] == "LOAD_EVENT":
-            continue
-        if cmd["type"] == "COMMAND_SW":
-            if "msid" not in cmd["params"]:
+            if cmd["type"] == "LOAD_EVENT":
                 continue
-            if "OORM" not in cmd["params"]["msid"] and "ETG" not in cmd["params"]["msid"]:
+            if cmd["type"] == "COMMAND_SW":
+                if "msid" not in cmd["params"]:
+                    continue
+                if "OORM" not in cmd["params"]["msid"] and "ETG" not in cmd["params"]["msid"]:
+                    continue
+            if cmd["type"] == "COMMAND_HW" and "CSELFMT" not in cmd["tlmsid"]:
                 continue
-        if cmd["type"] == "COMMAND_HW" and "CSELFMT" not in cmd["tlmsid"]:
-            continue
-        if cmd["type"].startswith("MP_") and not cmd["type"].endswith("OBSID"):
-            continue
-        if cmd["type"] == "ORBPOINT":
-            if "EF100" not in cmd["params"]["event_type"] and \
-               "GEE" not in cmd["params"]["event_type"]:
+            if cmd["type"].startswith("MP_") and not cmd["type"].endswith("OBSID"):
+                continue
+            if cmd["type"] == "ORBPOINT":
+                if "EF100" not in cmd["params"]["event_type"] and \
+                   "GEE" not in cmd["params"]["event_type"]:
+                    continue
+            if cmd["type"] == "SIMFOCUS":
                 continue
-        if cmd["type"] == "SIMFOCUS":
-            continue
-
-        highlight = None
-        param = None
-
-        if cmd["type"] == "ACISPKT":
-            param = f"\t<a href=\"{mit_link_base}{cmd['tlmsid']}\" target=\"_blank\" rel=\"noopener noreferrer\"><font color=\"blue\">{cmd['tlmsid']}</font></a>"
-            if cmd["tlmsid"].startswith("XCZ") or cmd["tlmsid"].startswith("XTZ"):
-                in_science = True
-                duration = the_time
-            if cmd["tlmsid"].startswith("AA000") and in_science:
-                in_science = False
-                duration -= the_time
-        elif cmd["type"] == "SIMTRANS":
-            simpos = int(cmd["params"]['pos'])
-            instr = get_instr(simpos)
-            param = "%d  (%s)" % (simpos, instr)
-            highlight = "<mechline>%s</mechline>"
-            simtrans.append((cmd["date"], instr))
-        elif cmd["type"] == "COMMAND_SW" and "ETG" in cmd["params"]["msid"]:
-            param = cmd["params"]["msid"]
-            highlight = "<mechline>%s</mechline>"
-        elif cmd["type"] == "COMMAND_SW" and "OORM" in cmd["params"]["msid"]:
-            # Assuming that this is radmon commanding
-            param = cmd["params"]['msid']
-            highlight = "<padtime>%s</padtime>"
-        elif cmd["type"] == "COMMAND_HW":
-            # Assuming that this is a format change
-            param = cmd["tlmsid"]
-        elif cmd["type"] == "MP_OBSID":
-            param = cmd["params"]['id']
-            highlight = "<obsidline>%s</obsidline>"
-        elif cmd["type"] == "ORBPOINT":
-            param = cmd["event_type"]
-            
-        line = f"{cmd['date']}\t{cmd['type']}\t{param}"
-
-        if highlight is not None:
-            # Pad lines so highlighting happens across the page
-            if len(line) < 74:
-                line += ' ' * (74 - len(line))
-            line = highlight % line
-
-        if cmd["type"] == "MP_OBSID":
-            if param < 40000:
-                line = line.replace(str(param),
-                                    f"<a href=\"{obsid_link_base}?obsid={param}\" target=\"_blank\" rel=\"noopener noreferrer\"><font color=\"blue\">{param}</font></a>")
-
-        cmdlines.append(line+"\n")
-        cmdtimes.append(the_time)
-
-        if duration is not None and not in_science:
-            line = "==> ACIS integration time is %.2f ks.\n" % (-duration*1.0e-3)
-            cmdlines.append(line)
-            cmdtimes.append(the_time)
-            duration = None
-
-        if cmd["type"] == "ACISPKT" and (cmd["tlmsid"].startswith("WSPOW") or cmd["tlmsid"] == "WSVIDALLDN"):
-            if cmd["tlmsid"].startswith("WSPOW"):
-                pow_dict = decode_power(cmd["tlmsid"])
-                if pow_dict["fep_count"] == 0:
-                    feps = "All FEPs down"
-                else:
-                    feps = "FEPs: %s" % pow_dict["feps"]
-                if pow_dict["ccd_count"] == 0:
-                    vids = "All vids down"
-                else:
-                    vids = "CCDs: %s" % pow_dict["ccds"]
-                outcome = "%s; %s" % (feps, vids)
-            elif cmd["tlmsid"] == "WSVIDALLDN":
-                outcome = "All vids down"
-            line = f"==> WSPOW COMMAND LOADS: {outcome}\n"
-            cmdlines.append(line)
-            cmdtimes.append(the_time)
 
-    return cmdtimes, cmdlines, simtrans
+            highlight = None
+            param = None
+
+            if cmd["type"] == "ACISPKT":
+                param = f"\t<a href=\"{mit_link_base}{cmd['tlmsid']}\" target=\"_blank\" rel=\"noopener noreferrer\"><font color=\"blue\">{cmd['tlmsid']}</font></a>"
+                if cmd["tlmsid"].startswith("XCZ") or cmd["tlmsid"].startswith("XTZ"):
+                    in_science = True
+                    science_start = the_time
+                if cmd["tlmsid"].startswith("AA000") and in_science:
+                    in_science = False
+                    duration = the_time - science_start
+            elif cmd["type"] == "SIMTRANS":
+                simpos = int(cmd["params"]['pos'])
+                instr = get_instr(simpos)
+                param = "%d  (%s)" % (simpos, instr)
+                highlight = "<mechline>%s</mechline>"
+                sim_times.append(the_time)
+                self.simtrans.append((cmd["date"], instr))
+            elif cmd["type"] == "COMMAND_SW" and "ETG" in cmd["params"]["msid"]:
+                param = cmd["params"]["msid"]
+                highlight = "<mechline>%s</mechline>"
+            elif cmd["type"] == "COMMAND_SW" and "OORM" in cmd["params"]["msid"]:
+                # Assuming that this is radmon commanding
+                param = cmd["params"]['msid']
+                highlight = "<padtime>%s</padtime>"
+            elif cmd["type"] == "COMMAND_HW":
+                # Assuming that this is a format change
+                param = cmd["tlmsid"]
+            elif cmd["type"] == "MP_OBSID":
+                param = cmd["params"]['id']
+                highlight = "<obsidline>%s</obsidline>"
+            elif cmd["type"] == "ORBPOINT":
+                param = cmd["event_type"]
+
+            line = f"{cmd['date']}\t{cmd['type']}\t{param}"
+
+            if highlight is not None:
+                # Pad lines so highlighting happens across the page
+                if len(line) < 74:
+                    line += ' ' * (74 - len(line))
+                line = highlight % line
+
+            if cmd["type"] == "MP_OBSID":
+                if param < 40000:
+                    line = line.replace(str(param),
+                                        f"<a href=\"{obsid_link_base}?obsid={param}\" target=\"_blank\" rel=\"noopener noreferrer\"><font color=\"blue\">{param}</font></a>")
+
+            lines.append(line+"\n")
+            times.append(the_time)
+            valid_from.append(the_time)
+
+            if duration is not None:
+                line = "==> ACIS integration time is %.2f ks.\n" % (duration*1.0e-3)
+                lines.append(line)
+                times.append(the_time)
+                valid_from.append(science_start)
+                duration = None
+
+            if cmd["type"] == "ACISPKT" and (cmd["tlmsid"].startswith("WSPOW") or cmd["tlmsid"] == "WSVIDALLDN"):
+                if cmd["tlmsid"].startswith("WSPOW"):
+                    pow_dict = decode_power(cmd["tlmsid"])
+                    if pow_dict["fep_count"] == 0:
+                        feps = "All FEPs down"
+                    else:
+                        feps = "FEPs: %s" % pow_dict["feps"]
+                    if pow_dict["ccd_count"] == 0:
+                        vids = "All vids down"
+                    else:
+                        vids = "CCDs: %s" % pow_dict["ccds"]
+                    outcome = "%s; %s" % (feps, vids)
+                elif cmd["tlmsid"] == "WSVIDALLDN":
+                    outcome = "All vids down"
+                line = f"==> WSPOW COMMAND LOADS: {outcome}\n"
+                lines.append(line)
+                times.append(the_time)
+                valid_from.append(the_time)
+
+        self.times = np.array(times, dtype="float64")
+        self.lines = lines
+        self.valid_from = np.array(valid_from, dtype="float64")
+        self.sim_times = np.array(sim_times, dtype="float64")
+
+    def get_window(self, tstart, tstop):
+        """
+        Return the times and lines of the commands between *tstart*
+        and *tstop* in seconds, and the SIM transitions in that window.
+        """
+        i0 = np.searchsorted(self.times, tstart, side="left")
+        i1 = np.searchsorted(self.times, tstop, side="right")
+        idxs = np.flatnonzero(self.valid_from[i0:i1] >= tstart) + i0
+        cmdtimes = self.times[idxs]
+        cmdlines = [self.lines[i] for i in idxs]
+        j0 = np.searchsorted(self.sim_times, tstart, side="left")
+        j1 = np.searchsorted(self.sim_times, tstop, side="right")
+        simtrans = self.simtrans[j0:j1]
+        return cmdtimes, cmdlines, simtrans
 
 
 def find_cti_runs(states):
@@ -312,13 +373,16 @@ def find_cti_runs(states):
         idxs = np.concatenate([[False], where_mode, [False]])
         idxs = np.flatnonzero(idxs[1:] != idxs[:-1]).reshape(-1, 2)
         for ii, jj in idxs:
-            cti_runs += [si_modes.dates[0, ii], si_modes.dates[0, jj-1]]
+            cti_runs += [states["datestart"][ii], states["datestart"][jj-1]]
     return cti_runs
 
 
+Comm = namedtuple("Comm", ["start", "stop", "tstart", "tstop", "start_local",
+                           "stop_local", "duration"])
+
+
 def get_comms(start, stop):
-    comm_times = []
-    durations = []
+    comm_list = []
     comms = dsn_comms.filter(start=start, stop=stop)
     for comm in comms:
         words = comm.start.split(":")
@@ -333,67 +397,687 @@ def get_comms(start, stop):
         comm_stop = CxoTime(":".join(words))
         if comm_stop.secs > comm.tstop:
             comm_stop -= 1 * u.day
-        comm_times.append([comm_start.yday, comm_stop.yday])
-        durations.append((comm_stop - comm_start).to_value("min"))
-    return comm_times, durations
+        start_local = comm_start.datetime.replace(tzinfo=timezone.utc).astimezone(tz=None)
+        stop_local = comm_stop.datetime.replace(tzinfo=timezone.utc).astimezone(tz=None)
+        comm_list.append(Comm(comm_start.yday, comm_stop.yday,
+                              comm_start.secs, comm_stop.secs,
+                              start_local.strftime("%Y:%j:%H:%M:%S"),
+                              stop_local.strftime("%Y:%j:%H:%M:%S"),
+                              (comm_stop - comm_start).to_value("min")))
+    return comm_list
+
+
+def get_comm_rows(comms, tmin, tmax):
+    rows = []
+    for comm in comms:
+        if comm.tstart < tmin or comm.tstop > tmax:
+            continue
+        rows.append((comm.tstart, "<commline>%s   REAL-TIME COMM BEGINS   %s  ET              </commline>\n" % (comm.start, comm.start_local)))
+        rows.append((comm.tstop, "<commline>%s   REAL-TIME COMM ENDS     %s  ET              </commline>\n" % (comm.stop, comm.stop_local)))
+        rows.append((comm.tstop, "==> COMM DURATION:  %.2f mins.\n" % comm.duration))
+    # Comms may overlap, so sort the rows. The sort is stable, so the
+    # duration line stays after the line for the end of its comm.
+    rows.sort(key=itemgetter(0))
+    return rows
 
 
-def insert_comms(cmdtimes, cmdlines, comms, durations, tmin, tmax):
-    for i, comm in enumerate(comms):
-        tbegin = date2secs(comm[0])
-        tend = date2secs(comm[1])
-        if tbegin < tmin or tend > tmax:
-            continue
-        tbegin_loc = datetime.strptime(comm[0], "%Y:%j:%H:%M:%S.%f").replace(tzinfo=timezone.utc).astimezone(tz=None) 
-        tend_loc = datetime.strptime(comm[1], "%Y:%j:%H:%M:%S.%f").replace(tzinfo=timezone.utc).astimezone(tz=None)
-        idx = bisect.bisect_right(cmdtimes, tbegin)
-        cmdtimes.insert(idx, tbegin)
-        cmdlines.insert(idx, "<commline>%s   REAL-TIME COMM BEGINS   %s  ET              </commline>\n" % (comm[0], tbegin_loc.strftime("%Y:%j:%H:%M:%S")))
-        idx = bisect.bisect_right(cmdtimes, tend)
-        cmdtimes.insert(idx, tend)
-        cmdlines.insert(idx, "<commline>%s   REAL-TIME COMM ENDS     %s  ET              </commline>\n" % (comm[1], tend_loc.strftime("%Y:%j:%H:%M:%S")))
-        idx = bisect.bisect_right(cmdtimes, tend)
-        cmdtimes.insert(idx, tend)
-        cmdlines.insert(idx, "==> COMM DURATION:  %.2f mins.\n" % durations[i])
-
-
-def insert_now_time(cmdtimes, cmdlines, now_time_secs, now_time_utc, now_time_local):
+def get_now_row(now_time_secs, now_time_utc, now_time_local):
     new_line = '<a id="now" name="now"></a>NOW: %s (%s ET)' % (now_time_utc.strftime("%Y:%j:%H:%M:%S"),
                                                       now_time_local.strftime("%D %H:%M:%S"))
     new_line += ' ' * (100 - len(new_line))
     new_line = f'<font style="background-color:#5AC831"><b>{new_line}</b></font>\n'
-    idx = bisect.bisect_right(cmdtimes, now_time_secs)
-    cmdtimes.insert(idx, now_time_secs)
-    cmdlines.insert(idx, new_line)
-
-
-def add_annotations(dp, tmin, tmax, simtrans, comms, cti_runs, radzones):
-    for tran in simtrans:
-        dp.add_vline(tran[0], color='brown', ls='-')
-        t = date2secs(tran[0])
-        tdt = CxoTime(t + 1800.0).date
-        if t < tmin or t+3600.0 > tmax:
+    return now_time_secs, new_line
+
+
+def merge_timeline(cmdtimes, cmdlines, comm_rows, now_row):
+    """
+    Merge the command lines, the comm lines and the NOW line, each of
+    which is already sorted by time, into the lines for the page. Where
+    times are equal, command lines come first, then comm lines, and then
+    the NOW line.
+    """
+    # There are only a few comm lines, so merge them with the NOW line
+    # first, and then find where they all go among the commands at once
+    extra_rows = list(heapq.merge(comm_rows, [now_row], key=itemgetter(0)))
+    idxs = np.searchsorted(cmdtimes, [row[0] for row in extra_rows], side="right")
+    lines = []
+    last_idx = 0
+    for idx, (_, line) in zip(idxs, extra_rows):
+        lines += cmdlines[last_idx:idx]
+        lines.append(line)
+        last_idx = idx
+    lines += cmdlines[last_idx:]
+    return lines
+
+
+# Immutable descriptions of the figures on the page, which are built in the
+# main process and rendered in worker processes. All times are plot dates.
+Series = namedtuple("Series", ["times", "values", "color", "ls", "lw", "drawstyle"])
+VLine = namedtuple("VLine", ["x", "color", "ls", "lw"])
+HLine = namedtuple("HLine", ["y", "color", "ls", "lw"])
+Span = namedtuple("Span", ["start", "stop", "color", "alpha"])
+# The y-position of a text annotation is a fraction of the axes height
+Text = namedtuple("Text", ["x", "y", "text", "color", "fontsize", "rotation"])
+ObsidBar = namedtuple("ObsidBar", ["start", "stop", "obsid"])
+FigureSpec = namedtuple("FigureSpec", [
+    "filename", "figsize", "title", "series", "series2", "ylabel", "ylabel2",
+    "ylim", "ylim2", "yscale2", "xlim", "now", "vlines", "hlines", "spans", "texts",
+    "limit_lines", "obsid_bars", "obsid_y", "left", "right"
+])
+
+
+def get_field_data(source, field):
+    """
+    Return the times in seconds, the values and the drawstyle of a field
+    of an ACISpy dataset, a :class:`ModelRun` or a tracelog reader. States are given as
+    steps from the start time of each state to the stop time of the last.
+    """
+    if hasattr(source, "get_data"):
+        return source.get_data(field)
+    v = source[field]
+    times = np.asarray(getattr(v.times, "value", v.times), dtype="float64")
+    values = np.asarray(v.value)
+    drawstyle = "default"
+    if times.ndim == 2:
+        times = np.append(times[0], times[1, -1])
+        values = np.append(values, values[-1])
+        drawstyle = "steps-post"
+    return times, values, drawstyle
+
+
+class ModelRun:
+    """
+    A thermal model dataset, which may have been warm-started part way
+    through the window from an earlier run. In that case the data for the
+    plotted *fields* before the start of the new run is taken from the
+    earlier run, from *tmin* onward. Indexing is passed through to the
+    new dataset.
+    """
+    def __init__(self, ds, previous=None, tmin=None, fields=()):
+        self.ds = ds
+        self.prefix = {}
+        if previous is None:
+            return
+        for field in fields:
+            times, values, _ = get_field_data(ds, field)
+            ptimes, pvalues, _ = previous.get_data(field)
+            keep = (ptimes >= tmin) & (ptimes < times[0])
+            self.prefix[field] = (ptimes[keep], pvalues[keep])
+
+    def get_data(self, field):
+        times, values, drawstyle = get_field_data(self.ds, field)
+        if field in self.prefix:
+            ptimes, pvalues = self.prefix[field]
+            times = np.concatenate([ptimes, times])
+            values = np.concatenate([pvalues, values])
+        return times, values, drawstyle
+
+    def __getitem__(self, item):
+        return self.ds[item]
+
+
+def find_first_change(old_states, new_states):
+    """
+    Return the time at which *new_states* first differ from *old_states*
+    over the span they have in common, or infinity if they do not.
+    """
+    skip = ("datestart", "datestop", "tstart", "tstop", "trans_keys")
+    keys = [k for k in new_states.dtype.names
+            if k in old_states.dtype.names and k not in skip]
+    t0 = max(old_states["tstart"][0], new_states["tstart"][0])
+    t1 = min(old_states["tstop"][-1], new_states["tstop"][-1])
+    i = max(np.searchsorted(old_states["tstart"], t0, side="right") - 1, 0)
+    j = max(np.searchsorted(new_states["tstart"], t0, side="right") - 1, 0)
+    for old, new in zip(old_states[i:], new_states[j:]):
+        if old["tstart"] >= t1 or new["tstart"] >= t1:
+            break
+        if any(old[k] != new[k] for k in keys):
+            return max(t0, min(old["tstart"], new["tstart"]))
+        # A state which runs past the end of the other states is not a change
+        if old["tstop"] != new["tstop"] and min(old["tstop"], new["tstop"]) < t1:
+            return min(old["tstop"], new["tstop"])
+    return np.inf
+
+
+def check_warm_start(ds, previous, temp, t_restart, t_change, tolerance):
+    """
+    Check that a warm-started model run agrees with the previous run to
+    within *tolerance* degrees C, where the states have not changed.
+    """
+    times, values, _ = get_field_data(ds, ("model", temp))
+    ptimes, pvalues, _ = previous.get_data(("model", temp))
+    use = (times >= t_restart) & (times < t_change) & (times <= ptimes[-1])
+    if not use.any():
+        return True
+    diff = np.abs(values[use] - np.interp(times[use], ptimes, pvalues))
+    return diff.max() <= tolerance
+
+
+def get_series(source, field, color, ls="-", lw=2):
+    """
+    Describe a field of an ACISpy dataset or a :class:`ModelRun` as a
+    series.
+    """
+    times, values, drawstyle = get_field_data(source, field)
+    times = cxctime2plotdate(times)
+    times.flags.writeable = False
+    values.flags.writeable = False
+    return Series(times, values, color, ls, lw, drawstyle)
+
+
+def get_obsid_bars(states, tmin, tmax):
+    obsids = states["obsid"]
+    # Find where the obsid changes, so that consecutive states with the
+    # same obsid are covered by one bar
+    change = np.flatnonzero(np.diff(obsids)) + 1
+    starts = np.concatenate([[0], change])
+    stops = np.concatenate([change, [obsids.size]]) - 1
+    bars = []
+    for i, j in zip(starts, stops):
+        tstart = max(states["tstart"][i], tmin)
+        tstop = min(states["tstop"][j], tmax)
+        if tstart >= tstop:
             continue
-        ymin, ymax = dp.ax.get_ylim()
-        y = 0.25*ymin + 0.75*ymax
-        dp.add_text(tdt, y, tran[1], fontsize=15,
-                    rotation='vertical', color="brown", zorder=100)
-    for cti_run in cti_runs:
-        dp.add_vline(cti_run, color='darkgreen', ls='--')
-    ybot, ytop = dp.ax.get_ylim()
-    t = np.linspace(tmin, tmax, 1000)
-    tplot = cxctime2plotdate(t)
-    for radzone in radzones:
-        in_evt = (t >= radzone.tstart) & (t <= radzone.tstop)
-        dp.ax.fill_between(tplot, ybot, ytop, where=in_evt, 
-                           color="mediumpurple", alpha=0.333333)
-        dp.add_vline(radzone.perigee, color='dodgerblue', ls='--')
-    for comm in comms:
-        tc_start = date2secs(comm[0])
-        tc_end = date2secs(comm[1])
-        in_evt = (t >= tc_start) & (t <= tc_end)
-        dp.ax.fill_between(tplot, ybot, ytop,
-                           where=in_evt, color="pink", alpha=0.75)
+        bars.append(ObsidBar(*cxctime2plotdate([tstart, tstop]), int(obsids[i])))
+    return tuple(bars)
+
+
+class AnnotationLayer:
+    """
+    The SIM transitions, CTI runs, radiation zones, perigees and comms
+    which are marked on every figure. The times are converted to plot
+    dates once per reload, and the annotations for a time window are
+    then selected from them for all of the figures.
+    """
+    def __init__(self, timeline, comms, cti_runs, radzones):
+        self.sim_times = timeline.sim_times
+        self.sim_labels = [tran[1] for tran in timeline.simtrans]
+        self.sim_x = cxctime2plotdate(self.sim_times)
+        self.sim_text_x = cxctime2plotdate(self.sim_times+1800.0)
+        self.cti_times = self._get_secs(cti_runs)
+        self.cti_x = cxctime2plotdate(self.cti_times)
+        self.radzone_starts = np.array([radzone.tstart for radzone in radzones], dtype="float64")
+        self.radzone_stops = np.array([radzone.tstop for radzone in radzones], dtype="float64")
+        self.perigee_times = self._get_secs([radzone.perigee for radzone in radzones])
+        self.perigee_x = cxctime2plotdate(self.perigee_times)
+        self.comm_starts = np.array([comm.tstart for comm in comms], dtype="float64")
+        self.comm_stops = np.array([comm.tstop for comm in comms], dtype="float64")
+
+    @staticmethod
+    def _get_secs(dates):
+        if len(dates) == 0:
+            return np.array([], dtype="float64")
+        return np.asarray(CxoTime(dates).secs, dtype="float64")
+
+    @staticmethod
+    def _get_spans(starts, stops, tmin, tmax, color, alpha):
+        starts = np.maximum(starts, tmin)
+        stops = np.minimum(stops, tmax)
+        keep = starts < stops
+        if not keep.any():
+            return []
+        xstarts = cxctime2plotdate(starts[keep])
+        xstops = cxctime2plotdate(stops[keep])
+        return [Span(x0, x1, color, alpha) for x0, x1 in zip(xstarts, xstops)]
+
+    def get_annotations(self, tmin, tmax):
+        vlines = []
+        texts = []
+        in_window = (self.sim_times >= tmin) & (self.sim_times <= tmax)
+        for i in np.flatnonzero(in_window):
+            vlines.append(VLine(self.sim_x[i], "brown", "-", 2))
+            if self.sim_times[i]+3600.0 <= tmax:
+                texts.append(Text(self.sim_text_x[i], 0.75, self.sim_labels[i], "brown",
+                                  15, "vertical"))
+        in_window = (self.cti_times >= tmin) & (self.cti_times <= tmax)
+        vlines += [VLine(x, "darkgreen", "--", 2) for x in self.cti_x[in_window]]
+        in_window = (self.perigee_times >= tmin) & (self.perigee_times <= tmax)
+        vlines += [VLine(x, "dodgerblue", "--", 2) for x in self.perigee_x[in_window]]
+        spans = self._get_spans(self.radzone_starts, self.radzone_stops, tmin, tmax,
+                                "mediumpurple", 0.333333)
+        spans += self._get_spans(self.comm_starts, self.comm_stops, tmin, tmax,
+                                 "pink", 0.75)
+        return tuple(vlines), tuple(texts), tuple(spans)
+
+
+def _plot_series(ax, series):
+    lines = []
+    for s in series:
+        lines += ax.plot(s.times, s.values, color=s.color, ls=s.ls, lw=s.lw,
+                         drawstyle=s.drawstyle)
+    return lines
+
+
+def save_figure(fig, filename):
+    """
+    Save a figure to a temporary file and then move it into place, so
+    that the browser never fetches a partially written image.
+    """
+    tmpfile = f"{filename}.{os.getpid()}.tmp"
+    fig.savefig(tmpfile, format="png")
+    os.replace(tmpfile, filename)
+
+
+DrawnFigure = namedtuple("DrawnFigure", ["fig", "ax", "ax2", "lines", "lines2",
+                                         "now_line", "title"])
+
+
+def draw_figure(spec):
+    fig, ax = plt.subplots(figsize=spec.figsize)
+    lines = _plot_series(ax, spec.series)
+    ax2 = None
+    lines2 = []
+    if spec.series2:
+        ax2 = ax.twinx()
+        lines2 = _plot_series(ax2, spec.series2)
+        if spec.yscale2 is not None:
+            ax2.set_yscale(spec.yscale2)
+        if spec.ylim2 is not None:
+            ax2.set_ylim(*spec.ylim2)
+        ax2.set_ylabel(spec.ylabel2, fontsize=plot_fontsize)
+        ax2.tick_params(labelsize=plot_fontsize)
+        # Keep the primary axes and the annotations in front
+        ax.set_zorder(ax2.get_zorder()+1)
+        ax.patch.set_visible(False)
+    for limit_line in spec.limit_lines:
+        limit_line.plot(
+            fig_ax=(fig, ax),
+            lw=3,
+            zorder=2,
+            use_colors=True,
+            show_changes=False,
+        )
+    for hline in spec.hlines:
+        ax.axhline(hline.y, color=hline.color, ls=hline.ls, lw=hline.lw)
+    now_line = ax.axvline(spec.now.x, color=spec.now.color, ls=spec.now.ls, lw=spec.now.lw)
+    for vline in spec.vlines:
+        ax.axvline(vline.x, color=vline.color, ls=vline.ls, lw=vline.lw)
+    for span in spec.spans:
+        ax.axvspan(span.start, span.stop, color=span.color, alpha=span.alpha, lw=0)
+    for text in spec.texts:
+        ax.text(text.x, text.y, text.text, color=text.color, fontsize=text.fontsize,
+                rotation=text.rotation, transform=ax.get_xaxis_transform(), zorder=100,
+                clip_on=True)
+    for bar in spec.obsid_bars:
+        ax.annotate("", xy=(bar.start, spec.obsid_y), xytext=(bar.stop, spec.obsid_y),
+                    arrowprops=dict(arrowstyle="|-|", color="dodgerblue", mutation_scale=5))
+        ax.text(bar.start+0.1*(bar.stop-bar.start), spec.obsid_y+0.25, str(bar.obsid),
+                color="dodgerblue", fontsize=12, clip_on=True)
+    ax.xaxis_date()
+    ax.xaxis.set_major_formatter(DateFormatter("%Y:%j:%H"))
+    ax.set_xlim(*spec.xlim)
+    if spec.ylim is not None:
+        ax.set_ylim(*spec.ylim)
+    ax.set_ylabel(spec.ylabel, fontsize=plot_fontsize)
+    ax.tick_params(labelsize=plot_fontsize)
+    title = ax.set_title(spec.title, fontsize=plot_fontsize)
+    fig.autofmt_xdate()
+    fig.subplots_adjust(left=spec.left, right=spec.right)
+    return DrawnFigure(fig, ax, ax2, lines, lines2, now_line, title)
+
+
+def render_figure(spec):
+    drawn = draw_figure(spec)
+    save_figure(drawn.fig, spec.filename)
+    plt.close(drawn.fig)
+    return spec.filename
+
+
+class FigureRenderer:
+    """
+    Render figure descriptions to files, in a pool of *workers*
+    processes if it is greater than one. The pool is kept for the life
+    of the renderer. If it breaks, rendering falls back to the main
+    process.
+    """
+    persistent = False
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = min(9, os.cpu_count() or 1)
+        self.workers = workers
+        self.executor = None
+
+    def render(self, specs):
+        if self.workers > 1:
+            try:
+                # Find out here whether the descriptions can be sent to
+                # the pool, so that an error in rendering one is not taken
+                # for a failure of the pool
+                pickle.dumps(specs)
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            except (PicklingError, TypeError, AttributeError, OSError) as e:
+                mylog.warning("The plots cannot be rendered in parallel (%s), "
+                              "rendering them serially instead." % e)
+                self.shutdown()
+                self.workers = 1
+            else:
+                try:
+                    return list(self.executor.map(render_figure, specs))
+                except BrokenProcessPool as e:
+                    mylog.warning("Rendering the plots in parallel failed (%s), "
+                                  "rendering them serially instead." % e)
+                    self.shutdown()
+                    self.workers = 1
+        return [render_figure(spec) for spec in specs]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class PersistentFigureRenderer:
+    """
+    Render figure descriptions in the main process, keeping each figure
+    and its artists between renders. A figure is only drawn from scratch
+    when *version* changes, e.g. after a reload. Otherwise the NOW line,
+    the title, the time limits and the data of the series are updated in
+    place before the figure is saved.
+    """
+    persistent = True
+
+    def __init__(self):
+        self.figures = {}
+
+    def render(self, specs, version):
+        for spec in specs:
+            entry = self.figures.get(spec.filename)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    plt.close(entry[1].fig)
+                drawn = draw_figure(spec)
+                self.figures[spec.filename] = (version, drawn)
+            else:
+                drawn = entry[1]
+                drawn.now_line.set_xdata([spec.now.x, spec.now.x])
+                drawn.title.set_text(spec.title)
+                drawn.ax.set_xlim(*spec.xlim)
+                for line, series in zip(drawn.lines, spec.series):
+                    line.set_data(series.times, series.values)
+                for line, series in zip(drawn.lines2, spec.series2):
+                    line.set_data(series.times, series.values)
+                if drawn.ax2 is not None and spec.ylim2 is None:
+                    drawn.ax2.relim()
+                    drawn.ax2.autoscale_view(scalex=False)
+            save_figure(drawn.fig, spec.filename)
+        return [spec.filename for spec in specs]
+
+    def shutdown(self):
+        for _, drawn in self.figures.values():
+            plt.close(drawn.fig)
+        self.figures = {}
+
+
+class RenderCache:
+    """
+    Remember the fingerprint of the inputs that each figure was last
+    rendered with, so that a figure is only rendered again when
+    something visible on it has changed.
+    """
+    def __init__(self):
+        self.fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_stale(self, fingerprints):
+        stale = [name for name, fingerprint in fingerprints.items()
+                 if self.fingerprints.get(name) != fingerprint]
+        self.misses += len(stale)
+        self.hits += len(fingerprints) - len(stale)
+        return stale
+
+    def update(self, fingerprints):
+        self.fingerprints.update(fingerprints)
+
+    def get_stats(self):
+        return "Render cache: %d hits, %d misses." % (self.hits, self.misses)
+
+
+def get_model_spec(temp):
+    if temp == "fptemp_11":
+        spec_filename = "acisfp_spec_matlab.json"
+    else:
+        spec_filename = f"{short_name[temp]}_spec.json"
+    return chandra_models_path / short_name[temp] / spec_filename
+
+
+model_specs = {temp: get_model_spec(temp) for temp in temps}
+
+
+class LimitCache:
+    """
+    Cache the limit objects and limit lines for each temperature. An
+    entry is reused as long as the model spec file has not been modified
+    and the states are the same object they were computed from, i.e.
+    until the states are fetched again on a reload.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, temp, states):
+        """
+        Return the limit object for *temp* and a tuple of its limit
+        lines for *states*: the upper limit line, followed by the
+        lower limit line for the board temperatures.
+        """
+        model_spec = model_specs[temp]
+        mtime = os.path.getmtime(model_spec)
+        entry = self.entries.get(temp)
+        if entry is not None and entry[0] == mtime and entry[1] is states:
+            return entry[2], entry[3]
+        limit_obj = limit_classes[temp](model_spec=model_spec)
+        if temp == "fptemp_11":
+            obs_list = cl.determine_obsid_info(states)
+            limit_obj.set_obs_info(obs_list)
+        limit_lines = [limit_obj.get_limit_line(states)]
+        if temp.startswith("tmp_"):
+            limit_lines.append(limit_obj.get_limit_line(states, which="low"))
+        limit_lines = tuple(limit_lines)
+        self.entries[temp] = (mtime, states, limit_obj, limit_lines)
+        return limit_obj, limit_lines
+
+    def clear(self):
+        self.entries = {}
+
+
+def run_model(temp, model_start, model_end, T_init, states, other_init=None):
+    return acispy.ThermalModelRunner(temp, model_start, model_end,
+                                     states=states, T_init=T_init, other_init=other_init,
+                                     get_msids=False, model_spec=model_specs[temp])
+
+
+def get_node_state(run, t):
+    """
+    Return the values of all of the nodes and pseudo-nodes of the xija
+    model of a :class:`ModelRun` at the last time step at or before *t*,
+    so that a new run can continue from it exactly, or None if they are
+    not available.
+    """
+    model = getattr(run.ds, "xija_model", None)
+    if model is None:
+        return None
+    i = np.searchsorted(model.times, t, side="right") - 1
+    if i < 0:
+        return None
+    return {comp.name: comp.mvals[i] for comp in model.comps
+            if isinstance(comp, xija.Node)}
+
+
+# The states in a worker process of a ModelPool, loaded from the file
+# which the main process wrote once for each version of them, so that
+# they are not sent with every model
+_worker_states = (None, None)
+
+
+def _run_model_worker(temp, model_start, model_end, T_init, states_file, other_init):
+    global _worker_states
+    if _worker_states[0] != states_file:
+        with open(states_file, "rb") as f:
+            _worker_states = (states_file, pickle.load(f))
+    return run_model(temp, model_start, model_end, T_init, _worker_states[1], other_init)
+
+
+class ModelPool:
+    """
+    Run the thermal models in a pool of *workers* processes if it is
+    greater than one. The pool is kept for the life of the page, so that
+    the processes are only started, and import xija and ACISpy, once.
+    The states are pickled once for each version of them, to a file
+    which each worker reads once. If the work cannot be pickled or the
+    pool breaks, the models are run in the main process.
+    """
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = min(len(temps), os.cpu_count() or 1)
+        self.workers = workers
+        self.executor = None
+        self.tmp_dir = None
+        self.states = None
+        self.states_file = None
+
+    def _get_states_file(self, states):
+        if states is not self.states:
+            if self.tmp_dir is None:
+                self.tmp_dir = tempfile.mkdtemp(prefix="acispy_cmd")
+            payload = pickle.dumps(states, protocol=pickle.HIGHEST_PROTOCOL)
+            # A new name for each version, so that the workers know to
+            # read it again
+            fd, fn = tempfile.mkstemp(dir=self.tmp_dir, suffix=".pkl")
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            if self.states_file is not None:
+                os.remove(self.states_file)
+            self.states, self.states_file = states, fn
+        return self.states_file
+
+    def run(self, model_end, states, inits):
+        """
+        Run the thermal models for all of the temperatures in *inits*,
+        which maps each temperature to its start time, its initial
+        temperature and the initial values of the other nodes of its
+        model (or None), up to *model_end* over the same *states*.
+        """
+        if self.workers > 1:
+            try:
+                # Find out here whether the work can be sent to the pool,
+                # so that an error in running a model is not taken for a
+                # failure of the pool
+                states_file = self._get_states_file(states)
+                pickle.dumps(inits)
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            except (PicklingError, TypeError, AttributeError, OSError) as e:
+                mylog.warning("The thermal models cannot be run in parallel (%s), "
+                              "running them serially instead." % e)
+                self.shutdown()
+                self.workers = 1
+            else:
+                try:
+                    futures = {temp: self.executor.submit(_run_model_worker, temp, tstart,
+                                                          model_end, T_init, states_file,
+                                                          other_init)
+                               for temp, (tstart, T_init, other_init) in inits.items()}
+                    return {temp: future.result() for temp, future in futures.items()}
+                except BrokenProcessPool as e:
+                    mylog.warning("Running the thermal models in parallel failed (%s), "
+                                  "running them serially instead." % e)
+                    self.shutdown()
+                    self.workers = 1
+        return {temp: run_model(temp, tstart, model_end, T_init, states, other_init)
+                for temp, (tstart, T_init, other_init) in inits.items()}
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+        self.states = self.states_file = None
+
+
+def _merge_events(old_events, new_events, tstart, split):
+    """
+    Keep the events from *old_events* which end after *tstart* and begin
+    before *split*, followed by the events from *new_events* which begin
+    at or after *split*.
+    """
+    events = [e for e in old_events if e.tstop >= tstart and e.tstart < split]
+    events += [e for e in new_events if e.tstart >= split]
+    return events
+
+
+class SlidingWindow:
+    """
+    The commands, comms and radiation zones for the page, and the states
+    for the models, kept up to date as their time windows slide forward.
+
+    On a refresh, whatever has scrolled out of the windows is dropped.
+    Everything from *overlap* seconds before now onward is fetched again,
+    since commands which are still in the future can change when loads
+    are approved or interrupted, while everything before that is kept.
+    A full refetch is done the first time, when the windows no longer
+    overlap what was fetched before, or after :meth:`force_full_refetch`
+    is called because the running load has changed.
+    """
+    def __init__(self, overlap=3600.0):
+        self.overlap = overlap
+        self.full_refetch = True
+        self.cmds = None
+        self.comms = None
+        self.radzones = None
+        self.states = None
+        self.cmd_range = None
+        self.state_range = None
+
+    def force_full_refetch(self):
+        self.full_refetch = True
+
+    def _fetch_cmds(self, tstart, tstop):
+        cmds = get_cmds(CxoTime(tstart).date, CxoTime(tstop).date)
+        cmds.fetch_params()
+        return cmds
+
+    def _fetch_states(self, tstart, tstop):
+        return get_states(tstart, tstop, state_keys=state_keys,
+                          merge_identical=True).as_array()
+
+    def refresh(self, now_secs, cmd_tstart, cmd_tstop, state_tstart, state_tstop):
+        split = now_secs - self.overlap
+        full = self.full_refetch or self.cmds is None or \
+            not self.cmd_range[0] <= split <= self.cmd_range[1] or \
+            not self.state_range[0] <= split <= self.state_range[1]
+        if full:
+            self.cmds = self._fetch_cmds(cmd_tstart, cmd_tstop)
+            self.comms = get_comms(CxoTime(cmd_tstart).date, CxoTime(cmd_tstop).date)
+            self.radzones = get_radzones(CxoTime(cmd_tstart).date, CxoTime(cmd_tstop).date)
+            self.states = self._fetch_states(state_tstart, state_tstop)
+            self.full_refetch = False
+        else:
+            split_date = CxoTime(split).date
+            new_cmds = self._fetch_cmds(split, cmd_tstop)
+            cmd_times = CxoTime(self.cmds["date"]).secs
+            keep = (cmd_times >= cmd_tstart) & (cmd_times < split)
+            self.cmds = vstack([self.cmds[keep], new_cmds])
+
+            new_comms = get_comms(split_date, CxoTime(cmd_tstop).date)
+            self.comms = _merge_events(self.comms, new_comms, cmd_tstart, split)
+            new_radzones = get_radzones(split_date, CxoTime(cmd_tstop).date)
+            self.radzones = _merge_events(self.radzones, new_radzones, cmd_tstart, split)
+
+            # Cut the last kept state off where the new states begin
+            keep = (self.states["tstop"] > state_tstart) & (self.states["tstart"] < split)
+            old_states = self.states[keep].copy()
+            if old_states.size > 0:
+                old_states["tstop"][-1] = split
+                old_states["datestop"][-1] = split_date
+            new_states = self._fetch_states(split, state_tstop)
+            self.states = vstack([Table(old_states), Table(new_states)]).as_array()
+        self.cmd_range = (cmd_tstart, cmd_tstop)
+        self.state_range = (state_tstart, state_tstop)
+        return full
 
 
 class NowFinder:
@@ -408,99 +1092,307 @@ class NowFinder:
     def get_now(self):
         return self.start_now + (datetime.utcnow() - self.start_now_real)
 
-        
-def main():
 
-    parser = argparse.ArgumentParser(description='Run script for the "ACIS Current Load Real-Time" page.')
-    parser.add_argument("--page_path", type=str, default="/data/wdocs/jzuhone/current_acis_load.html",
-                        help='The file to write the page to.')
-    parser.add_argument("--start_now")
-    args = parser.parse_args()
-    
-    outfile = os.path.abspath(args.page_path)
-    outdir = os.path.dirname(outfile)
-    cssfile = os.path.join(outdir, "lr_web.css")
-    
-    ds_models = {}
-    ds_tlm = None
-    last_tl_ts = 0.0
-    last_dea_tl_ts = 0.0
-    old_load_name = ""
-    reload = True
-    cmds = None
-    comms = None
-    cti_runs = None
-    radzones = None
-    durations = None
-    
-    now_finder = NowFinder(start_now=args.start_now)
+class TracelogWatcher:
+    """
+    Detect changes to the 10-day tracelog files. Uses inotify on the
+    directories containing the files if ``inotify_simple`` is available,
+    otherwise falls back to polling the modification times.
+    """
+    def __init__(self, paths):
+        self.paths = [Path(p) for p in paths]
+        self.names = {p.name for p in self.paths}
+        self.mtimes = self._get_mtimes()
+        self.changed = True
+        self.inotify = None
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY
+                for dirname in {p.parent for p in self.paths}:
+                    self.inotify.add_watch(str(dirname), mask)
+            except OSError:
+                self.inotify = None
+
+    def _get_mtimes(self):
+        mtimes = []
+        for p in self.paths:
+            try:
+                mtimes.append(os.path.getmtime(p))
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def wait(self, timeout):
+        """
+        Block for up to *timeout* seconds. Returns True if inotify
+        reported a change to one of the tracelogs while waiting.
+        """
+        if self.inotify is None:
+            time.sleep(timeout)
+            return False
+        events = self.inotify.read(timeout=int(timeout*1000.0))
+        if any(event.name in self.names for event in events):
+            self.changed = True
+            return True
+        return False
+
+    def check(self):
+        """
+        Return True if the tracelogs have changed since the last
+        call, and reset the change flag.
+        """
+        if self.inotify is None:
+            mtimes = self._get_mtimes()
+            if mtimes != self.mtimes:
+                self.mtimes = mtimes
+                self.changed = True
+        changed = self.changed
+        self.changed = False
+        return changed
+
+
+class Stage:
+    def __init__(self, name, func, cadence):
+        self.name = name
+        self.func = func
+        self.cadence = cadence
+        self.next_run = -np.inf
+
+    def trigger(self, delay=0.0):
+        self.next_run = min(self.next_run, time.monotonic()+delay)
+
+
+class Scheduler:
+    """
+    Run a sequence of stages, each on its own cadence in seconds. Stages
+    are run in the order they were added, so a stage can trigger a later
+    one to run in the same pass. Between passes the scheduler waits until
+    the next stage is due using *wait*, which defaults to ``time.sleep``.
+    A stage which fails is logged and run again at its next cadence.
+    """
+    def __init__(self, wait=None):
+        self.stages = {}
+        if wait is None:
+            wait = time.sleep
+        self.wait = wait
+
+    def add_stage(self, name, func, cadence):
+        self.stages[name] = Stage(name, func, cadence)
+
+    def trigger(self, name, delay=0.0):
+        self.stages[name].trigger(delay=delay)
+
+    def run(self, duration):
+        run_stop = time.monotonic() + duration
+        while time.monotonic() < run_stop:
+            for stage in self.stages.values():
+                if stage.next_run <= time.monotonic():
+                    try:
+                        stage.func()
+                    except Exception:
+                        mylog.error("The %s stage failed, and will be run again in "
+                                    "%g s:\n%s" % (stage.name, stage.cadence,
+                                                    traceback.format_exc()))
+                    stage.next_run = time.monotonic() + stage.cadence
+            next_run = min(stage.next_run for stage in self.stages.values())
+            timeout = min(next_run, run_stop) - time.monotonic()
+            if timeout > 0.0:
+                self.wait(timeout)
+
+
+class CurrentLoadPage:
+    def __init__(self, outfile, now_finder, scheduler, watcher, renderer,
+                 model_workers=None, plot_granularity=60.0, reload_overlap=3600.0,
+                 warm_start=True, warm_start_tolerance=0.1):
+        self.outfile = outfile
+        self.outdir = os.path.dirname(outfile)
+        self.cssfile = os.path.join(self.outdir, "lr_web.css")
+        self.now_finder = now_finder
+        self.scheduler = scheduler
+        self.watcher = watcher
+        self.renderer = renderer
+        self.model_pool = ModelPool(workers=model_workers)
+        self.warm_start = warm_start
+        self.warm_start_tolerance = warm_start_tolerance
+        self.plot_granularity = plot_granularity
+        self.render_cache = RenderCache()
+        self.limit_cache = LimitCache()
+        self.ds_models = {}
+        # The 10-day tracelogs are read incrementally as they grow, and
+        # are only shown in the plots once they have been read
+        self.tracelogs = TracelogSet(ten_day_tracelog_files)
+        self.ds_tlm = None
+        # Counters of the tracelog loads and model runs, which are used
+        # to tell when the data shown in the plots has changed
+        self.tlm_version = 0
+        self.model_version = 0
+        self.old_load_name = ""
+        self.load_status = None
+        self.window = SlidingWindow(overlap=reload_overlap)
+        self.cmds = None
+        self.timeline = None
+        self.comms = None
+        self.cti_runs = None
+        self.annotations = None
+        self.radzones = None
+        self.states = None
+        # The states the current models were run with
+        self.model_states = None
+        self.model_start = None
+        self.model_end = None
+        self.last_reload_time = None
+
+    def get_now(self, granularity=None):
+        now_time_utc = self.now_finder.get_now()
+        if granularity:
+            # Round down to a multiple of the granularity in seconds
+            secs = (now_time_utc - datetime.min).total_seconds()
+            now_time_utc -= timedelta(seconds=secs % granularity)
+        now_time_str = now_time_utc.strftime("%Y:%j:%H:%M:%S")
+        now_time_secs = date2secs(now_time_str)
+        return now_time_utc, now_time_str, now_time_secs
 
-    run_start_time = now_finder.get_now()
+    def get_window(self, now_time_utc):
+        begin_time = now_time_utc - timedelta(days=2)
+        end_time = begin_time + timedelta(days=3)
+        last_time = begin_time + timedelta(days=4)
+        begin_time_str = begin_time.strftime("%Y:%j:%H:%M:%S")
+        end_time_str = end_time.strftime("%Y:%j:%H:%M:%S")
+        last_time_str = last_time.strftime("%Y:%j:%H:%M:%S")
+        return begin_time_str, end_time_str, last_time_str
+
+    def update_tracelogs(self):
+        if not self.watcher.check() and self.ds_tlm is not None:
+            return
+        _, _, now_time_secs = self.get_now()
+        try:
+            changed = self.tracelogs.update(tbegin=now_time_secs-5.0*86400.0)
+        except:
+            # Try again at the next check
+            self.watcher.changed = True
+            return
+        if not changed and self.ds_tlm is not None:
+            return
+        if len(self.tracelogs) == 0:
+            # Don't run the models and plots on no telemetry
+            return
+        self.ds_tlm = self.tracelogs
+        self.tlm_version += 1
+        if len(self.ds_models) == 0:
+            self.scheduler.trigger("models")
+        self.scheduler.trigger("plots")
+
+    def reload_data(self):
+        now_time_utc, _, now_time_secs = self.get_now()
+        begin_time_str, _, last_time_str = self.get_window(now_time_utc)
+        self.model_start = now_time_secs - 4.0*86400.0
+        self.model_end = now_time_secs + 4.0*86400.0
+        self.window.refresh(now_time_secs, date2secs(begin_time_str), date2secs(last_time_str),
+                            self.model_start, self.model_end)
+        self.cmds = self.window.cmds
+        self.timeline = CommandTimeline(self.cmds)
+        self.comms = self.window.comms
+        self.radzones = self.window.radzones
+        self.states = self.window.states
+        self.limit_cache.clear()
+        self.last_reload_time = now_time_secs
+        self.scheduler.trigger("models")
+        self.scheduler.trigger("page")
+
+    def get_tlm_T_init(self, temp):
+        model_start = self.model_start
+        times, values, _ = get_field_data(self.ds_tlm, ("msids", temp))
+        return values[(times >= model_start-700.0) & (times <= model_start+700.0)].mean()
+
+    def run_models(self):
+        if self.ds_tlm is None or self.states is None:
+            return
+        _, _, now_time_secs = self.get_now()
+        model_start = self.model_start
+
+        # Models can be warm-started from the state of all of the nodes of
+        # the previous run at the last time before the states first
+        # changed, but no later than the refetched part of the window
+        if self.model_states is None:
+            t_change = -np.inf
+        elif self.model_states is self.states:
+            t_change = np.inf
+        else:
+            t_change = find_first_change(self.model_states, self.states)
+        t_bound = min(t_change, now_time_secs - self.window.overlap)
+
+        inits = {}
+        warm_temps = []
+        for temp in temps:
+            if self.warm_start and temp in self.ds_models:
+                times, values, _ = self.ds_models[temp].get_data(("model", temp))
+                i = np.searchsorted(times, t_bound, side="right") - 1
+                if i >= 0 and times[i] >= model_start:
+                    other_init = get_node_state(self.ds_models[temp], times[i])
+                    if other_init is not None:
+                        inits[temp] = (times[i], values[i], other_init)
+                        warm_temps.append(temp)
+                        continue
+            inits[temp] = (model_start, self.get_tlm_T_init(temp), None)
+        ds_models = self.model_pool.run(self.model_end, self.states, inits)
+
+        # Check that the warm-started models agree with the previous runs,
+        # and rerun the ones that do not from telemetry
+        cold_inits = {}
+        for temp in warm_temps:
+            if not check_warm_start(ds_models[temp], self.ds_models[temp], temp,
+                                    inits[temp][0], t_change, self.warm_start_tolerance):
+                cold_inits[temp] = (model_start, self.get_tlm_T_init(temp), None)
+        if len(cold_inits) > 0:
+            ds_models.update(self.model_pool.run(self.model_end, self.states, cold_inits))
+
+        self.ds_models = {
+            temp: ModelRun(ds_models[temp], previous=self.ds_models[temp], tmin=model_start,
+                           fields=model_plot_fields[temp])
+            if temp in warm_temps and temp not in cold_inits else ModelRun(ds_models[temp])
+            for temp in temps
+        }
+        self.model_states = self.states
+        self.model_version += 1
+        self.cti_runs = find_cti_runs(self.states)
+        self.annotations = AnnotationLayer(self.timeline, self.comms, self.cti_runs,
+                                           self.radzones)
+        self.scheduler.trigger("plots")
+
+    def write_page(self):
+        if self.timeline is None:
+            return
 
-    while (now_finder.get_now()-run_start_time).seconds < 21600.0:
-    
         # Find the current time
-        now_time_utc = now_finder.get_now()
-        now_time_str = now_time_utc.strftime("%Y:%j:%H:%M:%S")
-        now_time_secs = date2secs(now_time_str)
+        now_time_utc, _, now_time_secs = self.get_now()
         now_time_local = now_time_utc.replace(tzinfo=timezone.utc).astimezone(tz=None)
-    
+
         load_name, load_time = find_the_load(now_time_secs)
-    
+
         if load_name is None:
-            load_name = old_load_name
+            load_name = self.old_load_name
         elif load_name != "SCS-107":
-            old_load_name = load_name
-    
+            self.old_load_name = load_name
+
+        # Everything needs to be fetched again if a new load has started
+        # running or the load has been stopped
+        if self.load_status is not None and (load_name, load_time) != self.load_status:
+            self.window.force_full_refetch()
+            self.scheduler.trigger("reload")
+        self.load_status = (load_name, load_time)
+
         load_year = "20%s" % load_name[-3:-1]
         lr_link = lr_link_base % (load_year, load_name)
         load_dir = load_name[:-1]
-    
-        begin_time = now_time_utc - timedelta(days=2)
-        end_time = begin_time + timedelta(days=3)
-        last_time = begin_time + timedelta(days=4)
-        begin_time_str = begin_time.strftime("%Y:%j:%H:%M:%S")
-        end_time_str = end_time.strftime("%Y:%j:%H:%M:%S")
-        last_time_str = last_time.strftime("%Y:%j:%H:%M:%S")
+
+        begin_time_str, end_time_str, _ = self.get_window(now_time_utc)
         begin_time_secs = date2secs(begin_time_str)
         end_time_secs = date2secs(end_time_str)
-    
-        tl_ts = os.path.getmtime("/data/acis/eng_plots/acis_eng_10day.tl")
-        dea_tl_ts = os.path.getmtime("/data/acis/eng_plots/acis_dea_10day.tl")
-        if tl_ts != last_tl_ts or dea_tl_ts != last_dea_tl_ts or ds_tlm is None:
-            try:
-                ds_tlm = acispy.TenDayTracelogData(tbegin=now_time_secs-5.0*86400.0)
-                last_tl_ts = tl_ts
-                last_dea_tl_ts = dea_tl_ts
-            except:
-                pass
-    
-        if reload or cmds is None:
-            cmds = get_cmds(begin_time_str, last_time_str)
-            cmds.fetch_params()
-            comms, durations = get_comms(begin_time_str, last_time_str)
-            radzones = get_radzones(begin_time_str, last_time_str)
-            model_start = now_time_secs - 4.0*86400.0
-            model_end = now_time_secs + 4.0*86400.0
-            states = get_states(model_start, model_end, state_keys=state_keys,
-                                merge_identical=True).as_array()
-            for temp in temps:
-                if temp == "fptemp_11":
-                    spec_filename = "acisfp_spec_matlab.json" 
-                else:
-                    spec_filename = f"{short_name[temp]}_spec.json"
-                model_spec = chandra_models_path / short_name[temp] / spec_filename
-                T_init = ds_tlm["msids", temp][model_start-700.0:model_start+700.0].value.mean()
-                ds_models[temp] = acispy.ThermalModelRunner(temp, model_start, model_end,
-                                                            states=states, T_init=T_init,
-                                                            get_msids=False, model_spec=model_spec)
-            cti_runs = find_cti_runs(ds_models["1dpamzt"].states)
-            reload = False
-            last_reload_time = now_time_secs
-    
-        last_reload_date = CxoTime(last_reload_time).date
+
+        last_reload_date = CxoTime(self.last_reload_time).date
         last_reload_loc = datetime.strptime(last_reload_date, "%Y:%j:%H:%M:%S.%f").replace(tzinfo=timezone.utc).astimezone(tz=None).strftime("%D %H:%M:%S")
-    
+
         if load_name == "SCS-107":
             load_string = f"<font color=\"red\">SCS-107 detected at {load_time}.</font>"
         else:
@@ -512,147 +1404,254 @@ def main():
             "<button onclick=\"centerElement()\">Reset to Current Time</button>"
         ]
             
-        cmdtimes, cmdlines, simtrans = process_commands(now_time_utc, cmds)
-        if comms is not None:
-            insert_comms(cmdtimes, cmdlines, comms, durations, begin_time_secs, end_time_secs)
-    
-        insert_now_time(cmdtimes, cmdlines, now_time_secs, now_time_utc, now_time_local)
-    
+        cmdtimes, cmdlines, _ = self.timeline.get_window(now_time_secs-2.0*86400.0,
+                                                        now_time_secs+86400.0)
+        comm_rows = get_comm_rows(self.comms, begin_time_secs, end_time_secs)
+        now_row = get_now_row(now_time_secs, now_time_utc, now_time_local)
+        cmdlines = merge_timeline(cmdtimes, cmdlines, comm_rows, now_row)
+
         outlines.append("<div class=\"scrollable-window\" id=\"scrollableContainer\">")
         outlines += cmdlines
         outlines += ["</div>", "</pre>"]
-    
+
+        tm_link = tm_link_base % (load_year, load_dir)
+        footer = ["<a name=\"plots\"><h2><font face=\"times\">Temperature Models</font></h2></a>"]
+        if load_name != "SCS-107":
+            footer.append("<a href=\"%s\"><font face=\"times\" color=\"blue\">Full thermal models for %s</font></a><p />" % (tm_link, load_name))
+
+        for fig in plot_names:
+            footer.append("<img src=\"current_%s.png\" />" % fig)
+            footer.append("<p />")
+        footer.append("<!-- %s -->" % self.render_cache.get_stats())
+        footer.append(script)
+        footer.append("</body>")
+        
+        with open(self.outfile, "w") as f:
+            f.write(header+"\n".join(outlines+footer))
+
+        if not os.path.exists(self.cssfile):
+            with open(self.cssfile, "w") as f:
+                f.write(lr_web_css)
+
+    def render_plots(self):
+        if len(self.ds_models) < len(temps) or self.ds_tlm is None:
+            return
+
+        # The plots only change when the data changes or the NOW time
+        # moves on by the granularity
+        now_time_utc, now_time_str, now_time_secs = self.get_now(granularity=self.plot_granularity)
+        fingerprints = {}
+        for name in plot_names:
+            if name in temps:
+                fingerprints[name] = (now_time_str, self.tlm_version, self.model_version)
+            else:
+                fingerprints[name] = (now_time_str, self.model_version)
+        stale = self.render_cache.get_stale(fingerprints)
+        mylog.info(self.render_cache.get_stats())
+        if len(stale) == 0:
+            return
+
+        begin_time_str, end_time_str, _ = self.get_window(now_time_utc)
+        begin_time_secs = date2secs(begin_time_str)
+        end_time_secs = date2secs(end_time_str)
+
+        ds_tlm = self.ds_tlm
+        ds_models = self.ds_models
+        states = self.states
+
+        if self.renderer.persistent:
+            # Persistent figures keep their annotations until the next
+            # reload, so mark everything over the span of the models
+            # and let the time limits of the plot clip them
+            ann_tmin, ann_tmax = self.model_start, self.model_end
+        else:
+            ann_tmin, ann_tmax = begin_time_secs, end_time_secs
+        vlines, texts, spans = self.annotations.get_annotations(ann_tmin, ann_tmax)
+        now_vline = VLine(cxctime2plotdate([now_time_secs])[0], "green", "-", 3)
+        xlim = tuple(cxctime2plotdate([begin_time_secs, end_time_secs]))
+
+        # The CCD and roll figures are shorter than the temperature figures,
+        # but are given the same margins so that the time axes line up
+        temp_figsize = (15, 10)
+        figsize = (15, 8)
+        temp_left = plt.rcParams["figure.subplot.left"]
+        temp_right = 0.8
+        left = temp_left*temp_figsize[0]/figsize[0]
+        right = temp_right*temp_figsize[0]/figsize[0]
+
+        specs = []
+
         for temp in temps:
+            if temp not in stale:
+                continue
             ds_m = ds_models[temp]
+            temp_label = r"%s ($\mathrm{^\circ{C}}$)" % temp.upper()
             if temp.startswith("tmp_"):
-                dp = acispy.DatePlot(ds_tlm, ("msids", temp), field2="pitch", color="blue",
-                                     figsize=(15, 10))
+                series = (get_series(ds_tlm, ("msids", temp), "blue"),)
             else:
-                dp = acispy.DatePlot(ds_m, ("model", temp), field2="pitch", color="red",
-                                     figsize=(15, 10))
-                acispy.DatePlot(ds_tlm, ("msids", temp), color="blue", plot=dp)
-            dp.add_vline(now_time_str, lw=3)
+                series = (get_series(ds_m, ("model", temp), "red"),
+                          get_series(ds_tlm, ("msids", temp), "blue"))
             title_str = "%s\nCurrent %s prediction: %.2f $\mathrm{^\circ{C}}$\nCurrent pitch: %.2f degrees"
             title_str %= (now_time_str, temp.upper(), ds_m["model", temp][now_time_str].value,
                           ds_m["pitch"][now_time_str].value)
             title_str += "\nCurrent instrument: %s, Current ObsID: %d" % (ds_m["states", "instrument"][now_time_str],
                                                                           ds_m["states", "obsid"][now_time_str])
 
-            if temp == "fptemp_11":
-                spec_filename = "acisfp_spec_matlab.json"
-            else:
-                spec_filename = f"{short_name[temp]}_spec.json"
-            model_spec = chandra_models_path / short_name[temp] / spec_filename
-            limit_obj = limit_classes[temp](model_spec=model_spec)
-            if temp == "fptemp_11":
-                obs_list = cl.determine_obsid_info(states)
-                limit_obj.set_obs_info(obs_list)
-            upper_limit = limit_obj.get_limit_line(states)
-            
-            upper_limit.plot(
-                fig_ax=(dp.fig, dp.ax),
-                lw=3,
-                zorder=2,
-                use_colors=True,
-                show_changes=False,
-            )
+            limit_obj, limit_lines = self.limit_cache.get(temp, states)
 
+            hlines = []
             if temp == "fptemp_11":
                 pass
             else:
-                dp.add_hline(limit_obj.limits["yellow_hi"]["value"], color='gold')
+                hlines.append(HLine(limit_obj.limits["yellow_hi"]["value"], "gold", "-", 2))
                 if "odb.warning.high" in limit_obj.limits:
-                    dp.add_hline(limit_obj.limits["odb.warning.high"]["value"], color='r')
+                    hlines.append(HLine(limit_obj.limits["odb.warning.high"]["value"], "r", "-", 2))
             if temp.startswith("tmp_"):
-                lower_limit = limit_obj.get_limit_line(states, which="low")
-                lower_limit.plot(
-                    fig_ax=(dp.fig, dp.ax),
-                    lw=3,
-                    zorder=2,
-                    use_colors=True,
-                    show_changes=False,
-                )
-                dp.add_hline(limit_obj.limits["yellow_lo"]["value"], color='gold')
-                dp.add_hline(hi_red_limits[temp], color='r')
-                dp.add_hline(low_red_limits[temp], color='r')
-            dp.set_title(title_str)
-            dp.set_ylim(plot_limits[temp][0], plot_limits[temp][1])
-            add_annotations(dp, begin_time_secs, end_time_secs, simtrans, comms, cti_runs, radzones)
-            dp.set_xlim(begin_time_str, end_time_str)
+                hlines.append(HLine(limit_obj.limits["yellow_lo"]["value"], "gold", "-", 2))
+                hlines.append(HLine(hi_red_limits[temp], "r", "-", 2))
+                hlines.append(HLine(low_red_limits[temp], "r", "-", 2))
+
             if temp == "fptemp_11":
-                dp.annotate_obsids(-111.5, ywidth=1.0, color='dodgerblue',
-                                   datestart=begin_time_str, datestop=end_time_str,
-                                   txtheight=0.25, txtloc=0.1, fontsize=12)
-            dp.fig.subplots_adjust(right=0.8)
-            dp.savefig(os.path.join(outdir, "current_%s.png" % temp))
-    
-        w1, h1 = dp.fig.get_size_inches()
-    
-        ccd = acispy.DatePlot(ds_m, ["ccd_count", "fep_count"], ls=["-", "--"],
-                              field2=("states", "simpos"), color=["blue"]*2, figsize=(15,8))
-        ccd.add_vline(now_time_str, lw=3)
-        title_str = "%s\nCurrent CCD count: %d, Current FEP count: %d\nCurrent SIM-Z: %g" % (now_time_str,
-                                                                                             ds_m["ccd_count"][now_time_str].value,
-                                                                                             ds_m["fep_count"][now_time_str].value, 
-                                                                                             ds_m["states","simpos"][now_time_str].value)
-        ccd.set_title(title_str)
-        ccd.set_ylabel("CCD/FEP Count")
-        add_annotations(ccd, begin_time_secs, end_time_secs, simtrans, comms, cti_runs, radzones)
-        ccd.set_xlim(begin_time_str, end_time_str)
-        ccd.set_ylim(0, 6.5)
-    
-        w2, h2 = ccd.fig.get_size_inches()
-        lm = dp.fig.subplotpars.left*w1/w2
-        rm = dp.fig.subplotpars.right*w1/w2
-        ccd.fig.subplots_adjust(left=lm, right=rm)
-        ccd.savefig(os.path.join(outdir, "current_ccd.png"))
-    
-        roll = acispy.DatePlot(ds_models["fptemp_11"], "off_nom_roll", field2="earth_solid_angle", 
-                               color="blue", figsize=(15, 8))
-        roll.add_vline(now_time_str, lw=3)
-        title_str = "%s\nCurrent Off-nominal roll: %.2f degree\nEarth Solid Angle: %s sr" % (now_time_str,
-            ds_models["fptemp_11"]["off_nom_roll"][now_time_str].value,
-            ds_models["fptemp_11"]["earth_solid_angle"][now_time_str].value)
-        roll.set_title(title_str)
-        roll.set_ylim(-20.0, 20.0)
-        roll.set_ylim2(1.0e-3, 1.0)
-        add_annotations(roll, begin_time_secs, end_time_secs, simtrans, comms, cti_runs, radzones)
-        roll.set_xlim(begin_time_str, end_time_str)
-        roll.ax2.set_yscale("log")
-        roll.set_ylabel2("Earth Solid Angle (sr)")
-    
-        w3, h3 = roll.fig.get_size_inches()
-        lm = dp.fig.subplotpars.left*w1/w2
-        rm = dp.fig.subplotpars.right*w1/w2
-        roll.fig.subplots_adjust(left=lm, right=rm)
-        roll.savefig(os.path.join(outdir, "current_roll.png"))
-    
-        plots = ["fptemp_11", "1dpamzt", "1deamzt", "1pdeaat", "ccd", "roll",
-                 "tmp_fep1_mong", "tmp_fep1_actel", "tmp_bep_pcb"]
-    
-        plt.close("all")
-    
-        tm_link = tm_link_base % (load_year, load_dir)
-        footer = ["<a name=\"plots\"><h2><font face=\"times\">Temperature Models</font></h2></a>"]
-        if load_name != "SCS-107":
-            footer.append("<a href=\"%s\"><font face=\"times\" color=\"blue\">Full thermal models for %s</font></a><p />" % (tm_link, load_name))
-    
-        for fig in plots:
-            footer.append("<img src=\"current_%s.png\" />" % fig)
-            footer.append("<p />")
-        footer.append(script)
-        footer.append("</body>")
-        
-        with open(outfile, "w") as f:
-            f.write(header+"\n".join(outlines+footer))
-    
-        if not os.path.exists(cssfile):
-            with open(cssfile, "w") as f:
-                f.write(lr_web_css)
+                obsid_bars = get_obsid_bars(states, ann_tmin, ann_tmax)
+            else:
+                obsid_bars = ()
+
+            specs.append(FigureSpec(
+                filename=os.path.join(self.outdir, "current_%s.png" % temp),
+                figsize=temp_figsize, title=title_str, series=series,
+                series2=(get_series(ds_m, "pitch", "magenta"),),
+                ylabel=temp_label, ylabel2="Pitch (deg)",
+                ylim=plot_limits[temp], ylim2=None, yscale2=None, xlim=xlim,
+                now=now_vline, vlines=vlines, hlines=tuple(hlines), spans=spans, texts=texts,
+                limit_lines=limit_lines, obsid_bars=obsid_bars, obsid_y=-111.5,
+                left=temp_left, right=temp_right
+            ))
+
+        if "ccd" in stale:
+            ds_m = ds_models[temps[-1]]
+            title_str = "%s\nCurrent CCD count: %d, Current FEP count: %d\nCurrent SIM-Z: %g" % (now_time_str,
+                                                                                                 ds_m["ccd_count"][now_time_str].value,
+                                                                                                 ds_m["fep_count"][now_time_str].value, 
+                                                                                                 ds_m["states","simpos"][now_time_str].value)
+            specs.append(FigureSpec(
+                filename=os.path.join(self.outdir, "current_ccd.png"),
+                figsize=figsize, title=title_str,
+                series=(get_series(ds_m, "ccd_count", "blue"),
+                        get_series(ds_m, "fep_count", "blue", ls="--")),
+                series2=(get_series(ds_m, ("states", "simpos"), "magenta"),),
+                ylabel="CCD/FEP Count", ylabel2="SIM-Z (steps)",
+                ylim=(0, 6.5), ylim2=None, yscale2=None, xlim=xlim,
+                now=now_vline, vlines=vlines, hlines=(), spans=spans, texts=texts,
+                limit_lines=(), obsid_bars=(), obsid_y=None, left=left, right=right
+            ))
+
+        if "roll" in stale:
+            ds_fp = ds_models["fptemp_11"]
+            title_str = "%s\nCurrent Off-nominal roll: %.2f degree\nEarth Solid Angle: %s sr" % (now_time_str,
+                ds_fp["off_nom_roll"][now_time_str].value,
+                ds_fp["earth_solid_angle"][now_time_str].value)
+            specs.append(FigureSpec(
+                filename=os.path.join(self.outdir, "current_roll.png"),
+                figsize=figsize, title=title_str,
+                series=(get_series(ds_fp, "off_nom_roll", "blue"),),
+                series2=(get_series(ds_fp, "earth_solid_angle", "magenta"),),
+                ylabel="Off-Nominal Roll (deg)", ylabel2="Earth Solid Angle (sr)",
+                ylim=(-20.0, 20.0), ylim2=(1.0e-3, 1.0), yscale2="log", xlim=xlim,
+                now=now_vline, vlines=vlines, hlines=(), spans=spans, texts=texts,
+                limit_lines=(), obsid_bars=(), obsid_y=None, left=left, right=right
+            ))
+
+        if self.renderer.persistent:
+            self.renderer.render(specs, self.model_version)
+        else:
+            self.renderer.render(specs)
+        self.render_cache.update({name: fingerprints[name] for name in stale})
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Run script for the "ACIS Current Load Real-Time" page.')
+    parser.add_argument("--page_path", type=str, default="/data/wdocs/jzuhone/current_acis_load.html",
+                        help='The file to write the page to.')
+    parser.add_argument("--start_now")
+    parser.add_argument("--page_cadence", type=float, default=30.0,
+                        help='How often to rewrite the page and its NOW marker, in seconds. Default: 30')
+    parser.add_argument("--tracelog_cadence", type=float, default=60.0,
+                        help='How often to check the 10-day tracelogs for changes, in seconds. Default: 60')
+    parser.add_argument("--reload_cadence", type=float, default=600.0,
+                        help='How often to reload commands and states from kadi, in seconds. Default: 600')
+    parser.add_argument("--reload_overlap", type=float, default=3600.0,
+                        help='On a reload, commands and states from this many seconds before '
+                             'now onward are fetched again, and older ones are kept. Default: 3600')
+    parser.add_argument("--model_cadence", type=float, default=600.0,
+                        help='How often to rerun the thermal models, in seconds. The models '
+                             'are always rerun after a reload. Default: 600')
+    parser.add_argument("--no_warm_start", action="store_true",
+                        help='Always run the thermal models over the whole window from '
+                             'telemetry, instead of continuing them from the previous run.')
+    parser.add_argument("--warm_start_tolerance", type=float, default=0.1,
+                        help='A model continued from the previous run must agree with it to '
+                             'within this many degrees C where the states have not changed, '
+                             'or it is rerun from telemetry. Default: 0.1')
+    parser.add_argument("--plot_cadence", type=float, default=60.0,
+                        help='How often to render the plots, in seconds. Default: 60')
+    parser.add_argument("--model_workers", type=int,
+                        help='The number of processes to run the thermal models in. Use 1 to '
+                             'run them serially. Default: one per model, up to the number of CPUs')
+    parser.add_argument("--plot_workers", type=int,
+                        help='The number of processes to render the plots in. Use 1 to '
+                             'render them in the main process. Default: one per plot, up '
+                             'to the number of CPUs')
+    parser.add_argument("--persistent_figures", action="store_true",
+                        help='Keep the figures between renders in the main process and only '
+                             'update what changes, instead of drawing them from scratch in '
+                             'a pool of processes.')
+    parser.add_argument("--plot_granularity", type=float, default=60.0,
+                        help='The NOW time in the plots is rounded down to this many seconds, '
+                             'and the plots are only rendered again when it or the data '
+                             'changes. Default: 60')
+    parser.add_argument("--verbose", action="store_true",
+                        help='Log how often the plots were rendered and how often they were '
+                             'reused from the render cache.')
+    args = parser.parse_args()
+
+    if args.verbose:
+        mylog.setLevel(logging.INFO)
     
-        if now_time_secs - last_reload_time > 600.0:
-            reload = True
+    outfile = os.path.abspath(args.page_path)
+
+    watcher = TracelogWatcher(ten_day_tracelog_files)
+
+    def wait(timeout):
+        if watcher.wait(timeout):
+            # Give the writer a moment to finish before reading
+            scheduler.trigger("tracelog", delay=tracelog_settle_time)
+
+    scheduler = Scheduler(wait=wait)
+    if args.persistent_figures:
+        renderer = PersistentFigureRenderer()
+    else:
+        renderer = FigureRenderer(workers=args.plot_workers)
+    page = CurrentLoadPage(outfile, NowFinder(start_now=args.start_now),
+                           scheduler, watcher, renderer,
+                           model_workers=args.model_workers,
+                           plot_granularity=args.plot_granularity,
+                           reload_overlap=args.reload_overlap,
+                           warm_start=not args.no_warm_start,
+                           warm_start_tolerance=args.warm_start_tolerance)
+
+    scheduler.add_stage("tracelog", page.update_tracelogs, args.tracelog_cadence)
+    scheduler.add_stage("reload", page.reload_data, args.reload_cadence)
+    scheduler.add_stage("models", page.run_models, args.model_cadence)
+    scheduler.add_stage("plots", page.render_plots, args.plot_cadence)
+    scheduler.add_stage("page", page.write_page, args.page_cadence)
+
+    try:
+        scheduler.run(run_duration)
+    finally:
+        renderer.shutdown()
+        page.model_pool.shutdown()
             
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -6,74 +6,314 @@ matplotlib.rc("font", size=18, family="serif")
 import acispy
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap, LogNorm, to_rgba
+from matplotlib.patches import Patch
+import argparse
 import os
-import sys
+import pickle
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pickle import PicklingError
 from cxotime import CxoTime
+from acispy.utils import mylog
+from acispy_cmd.telemetry import recent_time
+from acispy_cmd.cache import get_cache_dir
 
+board_temps = ["tmp_bep_pcb", "tmp_bep_osc", "tmp_fep0_mong",
+               "tmp_fep0_pcb", "tmp_fep0_actel", "tmp_fep0_ram",
+               "tmp_fep0_fb", "tmp_fep1_mong", "tmp_fep1_pcb",
+               "tmp_fep1_actel", "tmp_fep1_ram", "tmp_fep1_fb"]
 
-def main():
-    
-    board_temps = ["tmp_bep_pcb", "tmp_bep_osc", "tmp_fep0_mong",
-                   "tmp_fep0_pcb", "tmp_fep0_actel", "tmp_fep0_ram",
-                   "tmp_fep0_fb", "tmp_fep1_mong", "tmp_fep1_pcb",
-                   "tmp_fep1_actel", "tmp_fep1_ram", "tmp_fep1_fb"]
-    
-    tstop = CxoTime().secs
-    tstart = tstop - 365.0*24.0*3600.0
-    
-    if len(sys.argv) > 1:
-        outpath = sys.argv[1]
-    else:
-        outpath = os.getcwd()
-    
-    dc = acispy.EngArchiveData(tstart, tstop, ["1dpamzt", "ccsdstmf"]+board_temps, 
+colors = ["red", "orange", "green", "cyan", "blue", "violet", "brown"]
+limits = [44.0, 42.0, 48.0, 45.0, 47.0, 46.0, 43.0,
+          49.0, 46.0, 48.0, 48.0, 43.0]
+
+# The numbers of FEPs on, in the order of the panels
+fep_counts = list(range(6, -1, -1))
+
+# The number of days fetched at once
+chunk_days = 30
+
+# The values kept for the plots, one row of the table for each
+columns = ["times", "fep_count", "1dpamzt"] + board_temps
+
+
+def reduce_chunk(tstart, tstop):
+    """
+    Fetch the telemetry from *tstart* to *tstop* and keep only what the
+    plots need: a table of the times, the number of FEPs, 1DPAMZT and
+    the board temperatures while in FMT2, with a row for each of
+    *columns*.
+    """
+    dc = acispy.EngArchiveData(tstart, tstop, ["1dpamzt", "ccsdstmf"]+board_temps,
                                interpolate="nearest")
-    
-    unit_line = np.linspace(-10, 60, 200)
-    
-    colors = ["red", "orange", "green", "cyan", "blue", "violet", "brown"]
-    limits = [44.0, 42.0, 48.0, 45.0, 47.0, 46.0, 43.0,
-              49.0, 46.0, 48.0, 48.0, 43.0]
-    
     dc.map_state_to_msid("fep_count", "1dpamzt")
-    
-    for j, msid in enumerate(board_temps):
-        xx = dc["msids", "1dpamzt"].value
-        yy = dc["msids", msid].value
-        cc = dc["msids", "fep_count"].value
-        fmt = dc["msids", "ccsdstmf"].value
-        print(xx.size, yy.size, cc.size, fmt.size)
-        print(dc["msids", msid].dates)
-        print(dc["msids", "1dpamzt"].dates)
-        fig = plt.figure(figsize=(36, 20))
-        for i, n in enumerate(range(6, -1, -1)):
-            ax = fig.add_subplot(241+i)
-            fig.subplots_adjust(hspace=0.0, wspace=0.0)
-            use = (cc == n) & (fmt == "FMT2")
-            c = cc[use]
-            x = xx[use]
-            y = yy[use]
-            ax.scatter(x, y, c=colors[i], linewidth=0.0, s=10.0, 
+    times = dc["msids", "1dpamzt"].times
+    use = dc["msids", "ccsdstmf"].value == "FMT2"
+    table = np.empty((len(columns), use.sum()))
+    table[0] = np.asarray(getattr(times, "value", times))[use]
+    for i, name in enumerate(columns[1:]):
+        table[i+1] = dc["msids", name].value[use]
+    return table
+
+
+def select_times(table, tstart, tstop):
+    return table[:, np.searchsorted(table[0], tstart):np.searchsorted(table[0], tstop)]
+
+
+def get_days(tstart, tstop):
+    """
+    Return the start and stop times of the days from the one which
+    contains *tstart* to the one which contains *tstop*.
+    """
+    days = []
+    a = CxoTime(CxoTime(tstart).date[:8]).secs
+    while a < tstop:
+        # A day with a leap second is 86401 seconds long
+        b = CxoTime(CxoTime(a + 86401.0).date[:8]).secs
+        days.append((a, b))
+        a = b
+    return days
+
+
+class DailyCache:
+    """
+    The table of values for the plots from each day, kept on disk so
+    that each run only has to fetch the days which the previous one did
+    not.
+    """
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = get_cache_dir("dpa_temperature_plots")
+        self.cache_dir = cache_dir
+
+    def _path(self, day):
+        return os.path.join(self.cache_dir, "%s.npy" % CxoTime(day).date[:8].replace(":", ""))
+
+    def load(self, day):
+        try:
+            table = np.load(self._path(day), allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        if table.ndim != 2 or table.shape[0] != len(columns):
+            return None
+        return table
+
+    def save(self, day, table):
+        fd, fn = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, table)
+        os.replace(fn, self._path(day))
+
+    def expire(self, tstart):
+        """
+        Remove the days before the day which contains *tstart*.
+        """
+        first = os.path.basename(self._path(tstart))
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith(".npy") and fn < first:
+                os.remove(os.path.join(self.cache_dir, fn))
+
+
+def group_days(days, num_days):
+    """
+    Group *days* into runs of at most *num_days* consecutive days.
+    """
+    groups = []
+    for a, b in days:
+        if len(groups) > 0 and groups[-1][-1][1] == a and len(groups[-1]) < num_days:
+            groups[-1].append((a, b))
+        else:
+            groups.append([(a, b)])
+    return groups
+
+
+def collect_table(tstart, tstop, cache=None):
+    """
+    Collect the table of values for the plots from *tstart* to *tstop*.
+    The days which are not in *cache* are fetched up to a month at a
+    time, so that only one month of the full telemetry is held in memory
+    at once, and the days which are complete are saved to *cache*.
+    """
+    days = get_days(tstart, tstop)
+    tables = {}
+    missing = []
+    for a, b in days:
+        table = None if cache is None else cache.load(a)
+        if table is None:
+            missing.append((a, b))
+        else:
+            tables[a] = table
+    mylog.info("Fetching %d of %d days." % (len(missing), len(days)))
+    # The days which are saved to the cache are only ever fetched once, so
+    # the telemetry is not also kept in the telemetry cache
+    for group in group_days(missing, chunk_days):
+        table = reduce_chunk(group[0][0], min(group[-1][1], tstop))
+        for a, b in group:
+            tables[a] = select_times(table, a, b)
+            # Recent telemetry may still be filled in
+            if cache is not None and b <= tstop - recent_time:
+                cache.save(a, tables[a])
+        del table
+    if cache is not None:
+        cache.expire(tstart)
+    table = np.concatenate([tables.pop(a) for a, _ in days], axis=1)
+    return select_times(table, tstart, tstop)
+
+
+def group_by_fep_count(table):
+    """
+    Sort the columns of *table* by the number of FEPs, keeping them in
+    time order within each number, and return the sorted table with the
+    slice of it for each number of FEPs. The slices are shared by all
+    of the plots.
+    """
+    codes = table[1].astype("int8")
+    table = table[:, np.argsort(codes, kind="stable")]
+    bounds = np.searchsorted(table[1], np.arange(8)-0.5)
+    return table, {n: slice(bounds[n], bounds[n+1]) for n in range(7)}
+
+
+def make_plot(j, msid, table, groups, tstart, tstop, outpath, bin_size=None):
+    """
+    Plot *msid* versus 1DPAMZT for each number of FEPs, as a scatter
+    plot of the samples, or as the number of samples in bins of
+    *bin_size* degrees if it is given.
+    """
+    unit_line = np.linspace(-10, 60, 200)
+    fig = plt.figure(figsize=(36, 20))
+    ymax = max(47, limits[j]+1)
+    for i, n in enumerate(fep_counts):
+        ax = fig.add_subplot(241+i)
+        fig.subplots_adjust(hspace=0.0, wspace=0.0)
+        x = table[2, groups[n]]
+        y = table[columns.index(msid), groups[n]]
+        if bin_size is None:
+            ax.scatter(x, y, c=colors[i], linewidth=0.0, s=10.0,
                        label="%d FEPs" % n)
-            ax.plot(unit_line, unit_line, ls='--', lw=2, color='k')
-            ax.axhline(limits[j], ls='dashed', color='gold', lw=3)
-            ax.axvline(37.5, ls='dashed', color='gold', lw=3)
-            ax.set_xlim(3, 47)
-            ax.set_ylim(3, max(47, limits[j]+1))
-            if i in [1, 2, 3, 5, 6]:
-                ax.set_yticklabels([])
-            if i in [3, 4, 5, 6]:
-                ax.set_xlabel(r"1DPAMZT $\mathrm{(^{\circ}C)}$")
-            if i in [0, 4]:
-                ax.set_ylabel(r"%s $\mathrm{(^{\circ}C)}$" % msid.upper())
+        else:
+            x_edges = np.arange(3, 47+bin_size, bin_size)
+            y_edges = np.arange(3, ymax+bin_size, bin_size)
+            counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges])
+            if counts.any():
+                cmap = LinearSegmentedColormap.from_list(colors[i], [to_rgba(colors[i], 0.2),
+                                                                     colors[i]])
+                ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts, 0).T,
+                              cmap=cmap, norm=LogNorm(vmin=1))
+        ax.plot(unit_line, unit_line, ls='--', lw=2, color='k')
+        ax.axhline(limits[j], ls='dashed', color='gold', lw=3)
+        ax.axvline(37.5, ls='dashed', color='gold', lw=3)
+        ax.set_xlim(3, 47)
+        ax.set_ylim(3, ymax)
+        if i in [1, 2, 3, 5, 6]:
+            ax.set_yticklabels([])
+        if i in [3, 4, 5, 6]:
+            ax.set_xlabel(r"1DPAMZT $\mathrm{(^{\circ}C)}$")
+        if i in [0, 4]:
+            ax.set_ylabel(r"%s $\mathrm{(^{\circ}C)}$" % msid.upper())
+        if bin_size is None:
             ax.legend(loc=2)
-        fig.suptitle("%s vs. 1DPAMZT\n%s - %s" % (msid.upper(),
-                                                  CxoTime(tstart).date,
-                                                  CxoTime(tstop).date),
-                     y=0.94, fontsize=30)
-        filename = os.path.join(outpath, "%s_scatter.png" % msid)
-        fig.savefig(filename, bbox_inches='tight', dpi=50)
+        else:
+            ax.legend(handles=[Patch(color=colors[i], label="%d FEPs" % n)], loc=2)
+    fig.suptitle("%s vs. 1DPAMZT\n%s - %s" % (msid.upper(),
+                                              CxoTime(tstart).date,
+                                              CxoTime(tstop).date),
+                 y=0.94, fontsize=30)
+    filename = os.path.join(outpath, "%s_scatter.png" % msid)
+    fig.savefig(filename, bbox_inches='tight', dpi=50)
+    plt.close(fig)
+
+
+# The table of values in a worker process, memory-mapped from the file
+# which the main process wrote, so that it is not sent to each worker
+_worker_table = None
+
+
+def _init_plot_worker(filename):
+    global _worker_table
+    _worker_table = np.load(filename, mmap_mode="r")
+
+
+def _plot_worker(j, msid, groups, tstart, tstop, outpath, bin_size):
+    t = time.perf_counter()
+    make_plot(j, msid, _worker_table, groups, tstart, tstop, outpath, bin_size=bin_size)
+    return time.perf_counter() - t
+
+
+def make_plots(table, groups, tstart, tstop, outpath, bin_size=None, jobs=1):
+    """
+    Make the plots of all of the board temperatures. If *jobs* is
+    greater than one, they are made in a pool of that many processes,
+    which read *table* from a memory-mapped file, falling back to making
+    them one after another if the pool fails. Returns the time taken to
+    make each plot.
+    """
+    if jobs > 1:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            try:
+                # Find out here whether the work can be sent to the pool,
+                # so that an error in making a plot is not taken for a
+                # failure of the pool
+                pickle.dumps((groups, tstart, tstop, outpath, bin_size))
+                filename = os.path.join(tmp_dir, "table.npy")
+                np.save(filename, table)
+            except (PicklingError, TypeError, AttributeError, OSError) as e:
+                mylog.warning("The plots cannot be made in parallel (%s), "
+                              "making them serially instead." % e)
+            else:
+                try:
+                    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_plot_worker,
+                                             initargs=(filename,)) as executor:
+                        futures = {msid: executor.submit(_plot_worker, j, msid, groups,
+                                                         tstart, tstop, outpath, bin_size)
+                                   for j, msid in enumerate(board_temps)}
+                        return {msid: future.result() for msid, future in futures.items()}
+                except BrokenProcessPool as e:
+                    mylog.warning("Making the plots in parallel failed (%s), "
+                                  "making them serially instead." % e)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    times = {}
+    for j, msid in enumerate(board_temps):
+        t = time.perf_counter()
+        make_plot(j, msid, table, groups, tstart, tstop, outpath, bin_size=bin_size)
+        times[msid] = time.perf_counter() - t
+    return times
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Make plots of the ACIS board temperatures versus 1DPAMZT over the last year.')
+    parser.add_argument("outpath", type=str, nargs="?", default=os.getcwd(), help='The directory to write the plots to. Default: the current directory')
+    parser.add_argument("--density", action="store_true", help="Plot the number of samples in bins of temperature instead of every sample, which is much faster.")
+    parser.add_argument("--bin-size", type=float, default=0.25, help="The size of the bins of temperature for --density, in degrees C. Default: 0.25")
+    parser.add_argument("--jobs", type=int, default=1, help="The number of plots to make at once, each in its own process. Default: 1")
+    parser.add_argument("--timing", action="store_true", help="Report how long fetching the data and making each plot took.")
+    parser.add_argument("--no-cache", action="store_true", help="Fetch the whole year instead of only the days which were not fetched by earlier runs.")
+    args = parser.parse_args()
+
+    tstop = CxoTime().secs
+    tstart = tstop - 365.0*24.0*3600.0
+
+    cache = None if args.no_cache else DailyCache()
+    t = time.perf_counter()
+    table, groups = group_by_fep_count(collect_table(tstart, tstop, cache=cache))
+    if args.timing:
+        mylog.info("Collected %d samples in %.1f s." % (table.shape[1], time.perf_counter()-t))
+    bin_size = args.bin_size if args.density else None
+
+    t = time.perf_counter()
+    plot_times = make_plots(table, groups, tstart, tstop, args.outpath,
+                            bin_size=bin_size, jobs=args.jobs)
+    if args.timing:
+        for msid, plot_time in plot_times.items():
+            mylog.info("Made the plot of %s in %.1f s." % (msid, plot_time))
+        mylog.info("Made all of the plots in %.1f s." % (time.perf_counter()-t))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
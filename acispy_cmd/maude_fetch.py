@@ -0,0 +1,163 @@
+"""
+Concurrent retrieval of MSIDs from the MAUDE web service, in chunks of
+time over a pooled HTTP session.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from cxotime import CxoTime
+
+maude_url = "https://occweb.cfa.harvard.edu/maude/mrest/FLIGHT"
+
+# The length of time fetched in each request
+default_chunk_time = 86400.0
+
+
+def get_maude_auth():
+    """
+    Return the user and password for MAUDE from the MAUDE_USER and
+    MAUDE_PASSWORD environment variables, as the maude package does, or
+    None if they are not set, in which case requests looks in ~/.netrc.
+    """
+    user = os.environ.get("MAUDE_USER")
+    password = os.environ.get("MAUDE_PASSWORD")
+    if user is None or password is None:
+        return None
+    return user, password
+
+
+def to_maude_time(secs):
+    """
+    Convert a time in seconds to the YYYYDDDhhmmssSSS format of MAUDE.
+    """
+    return CxoTime(secs).date.replace(":", "").replace(".", "")
+
+
+def from_maude_times(times):
+    """
+    Convert times in the YYYYDDDhhmmssSSS format of MAUDE to seconds.
+    """
+    times = [str(t).zfill(16) for t in times]
+    if len(times) == 0:
+        return np.empty(0)
+    dates = ["%s:%s:%s:%s:%s.%s" % (t[:4], t[4:7], t[7:9], t[9:11], t[11:13], t[13:16])
+             for t in times]
+    return np.atleast_1d(CxoTime(dates).secs)
+
+
+class MaudeFetcher:
+    """
+    Fetch MSIDs from MAUDE, splitting the time range of each MSID into
+    chunks of *chunk_time* seconds and fetching up to *concurrency*
+    chunks at once over one pooled HTTP session, which uses the same
+    credentials as the maude package. A chunk which fails is tried again
+    up to *retries* times, waiting longer each time, unless the request
+    was refused with a 4xx status. *url* is the base URL of the MAUDE
+    REST service.
+    """
+    def __init__(self, url=maude_url, concurrency=4, chunk_time=default_chunk_time,
+                 retries=3, backoff=1.0, timeout=60.0, session=None):
+        self.url = url.rstrip("/")
+        self.concurrency = max(concurrency, 1)
+        self.chunk_time = chunk_time
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.concurrency,
+                                  pool_maxsize=self.concurrency)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.auth = get_maude_auth()
+        self.session = session
+
+    def get_chunk(self, msid, tstart, tstop):
+        """
+        Fetch the times and values of *msid* from *tstart* to *tstop*.
+        """
+        params = {"m": msid, "ts": to_maude_time(tstart), "tp": to_maude_time(tstop)}
+        for attempt in range(self.retries+1):
+            try:
+                response = self.session.get(self.url + "/msids.json", params=params,
+                                            timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()["data"][0]
+                return from_maude_times(data["times"]), np.asarray(data["values"])
+            except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+                response = getattr(e, "response", None)
+                # Asking again will not help if the request itself is wrong
+                if response is not None and 400 <= response.status_code < 500:
+                    raise
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff*2**attempt)
+
+    def get_msids(self, msids, tstart, tstop):
+        """
+        Fetch *msids* from *tstart* to *tstop*. Returns a dict like that
+        from maude.get_msids, with the times in seconds.
+        """
+        if isinstance(msids, str):
+            msids = [msids]
+        if tstop <= tstart:
+            return {"data": [{"msid": msid, "times": np.empty(0), "values": np.empty(0)}
+                             for msid in msids]}
+        edges = np.append(np.arange(tstart, tstop, self.chunk_time), tstop)
+        chunks = [(msid, a, b) for msid in msids for a, b in zip(edges[:-1], edges[1:])]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(lambda chunk: self.get_chunk(*chunk), chunks))
+        # Put the chunks of each MSID back together in order, leaving out
+        # any samples which were returned by the chunks on both sides of
+        # the time between them
+        data = []
+        for msid in msids:
+            times = []
+            values = []
+            for (chunk_msid, a, b), (t, v) in zip(chunks, results):
+                if chunk_msid != msid:
+                    continue
+                use = (t >= a) & ((t < b) | (b == tstop))
+                times.append(t[use])
+                values.append(v[use])
+            data.append({"msid": msid, "times": np.concatenate(times),
+                         "values": np.concatenate(values)})
+        return {"data": data}
+
+
+@contextmanager
+def concurrent_maude(concurrency=4, chunk_time=default_chunk_time, url=maude_url):
+    """
+    Within this context, MSIDs fetched with maude.get_msids, for example
+    by MaudeData, are fetched with a :class:`MaudeFetcher`. Yields the
+    fetcher.
+    """
+    import maude
+    fetcher = MaudeFetcher(url=url, concurrency=concurrency, chunk_time=chunk_time)
+    get_msids = maude.get_msids
+
+    def concurrent_get_msids(msids, start=None, stop=None, **kwargs):
+        if start is None or stop is None or len(kwargs) > 0:
+            return get_msids(msids, start=start, stop=stop, **kwargs)
+        if isinstance(msids, str):
+            msids = [msids]
+        tstart, tstop = CxoTime([start, stop]).secs
+        # Fetch a moment of data so that the result is set up as usual,
+        # and then fill in its data from the chunks
+        out = get_msids(msids, start=tstart, stop=tstart+1.0)
+        fetched = fetcher.get_msids([data["msid"] for data in out["data"]], tstart, tstop)
+        for data, new_data in zip(out["data"], fetched["data"]):
+            data["times"] = new_data["times"]
+            data["values"] = new_data["values"]
+        return out
+
+    maude.get_msids = concurrent_get_msids
+    try:
+        yield fetcher
+    finally:
+        maude.get_msids = get_msids
+        fetcher.session.close()
@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 import argparse
 import acispy
 from acispy.utils import state_labels
+from acispy_cmd.tracelog import get_tracelog_data
 matplotlib.use("Qt5Agg")
 
 
@@ -15,6 +16,8 @@ def main():
     parser.add_argument("plots", type=str, help='The MSIDs and states to plot, comma-separated')
     parser.add_argument("--one-panel", action='store_true',
                         help="Whether to make a multi-panel plot or a single-panel plot. The latter is only valid if the quantities have the same units.")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Read the tracelog file directly instead of through the cache of parsed tracelogs.")
     args = parser.parse_args()
     
     states = []
@@ -28,7 +31,7 @@ def main():
     
     fields = [("msids", m) for m in msids] + [("states", s) for s in states]
     
-    ds = acispy.TracelogData(args.tracelog)
+    ds = get_tracelog_data(args.tracelog, msids, cache=not args.no_cache)
     if args.one_panel:
         cp = acispy.DatePlot(ds, fields)
     else:
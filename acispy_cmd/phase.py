@@ -0,0 +1,319 @@
+"""
+Phase histograms of one MSID or state versus another, accumulated over
+a long time range a chunk at a time, phase scatter plots drawn as
+images of the samples binned at the resolution of the screen, and the
+values of many fields on common times for making many phase plots from
+one fetch.
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm, Normalize
+from matplotlib.image import AxesImage
+import acispy
+from acispy.utils import state_labels, mylog
+from cxotime import CxoTime
+from acispy_cmd.telemetry import get_missing_intervals, iter_chunks
+
+# The length of time fetched at once when accumulating a histogram
+default_chunk_time = 30.0*86400.0
+
+
+def get_field_values(ds, field):
+    """
+    Return the values of *field* of the dataset *ds* as an array, with
+    its label for an axis. *field* is a (type, name) tuple or the name
+    of an MSID, or of a state which has been mapped to an MSID.
+    """
+    if isinstance(field, str):
+        field = ("msids", field)
+    v = ds[field]
+    return np.asarray(v.value), _get_label(v, field[1])
+
+
+def _get_label(v, name):
+    unit = str(getattr(v, "unit", ""))
+    return name if unit in ["", "dimensionless"] else "%s (%s)" % (name, unit)
+
+
+def _get_times(v):
+    return np.asarray(getattr(v.times, "value", v.times), dtype="float64")
+
+
+def sample_nearest(times, values, new_times):
+    """
+    Return the *values* at *times* which are nearest in time to each of
+    *new_times*.
+    """
+    if times.size == 1:
+        return np.repeat(values, new_times.size)
+    idxs = np.clip(np.searchsorted(times, new_times), 1, times.size-1)
+    idxs -= (new_times - times[idxs-1]) < (times[idxs] - new_times)
+    return values[idxs]
+
+
+def get_common_fields(ds, fields):
+    """
+    Return the times of the first MSID in *fields* and a dict of the
+    values and axis label of each of *fields*, MSIDs or states, at those
+    times. MSIDs with other times are sampled at the nearest time, and
+    the state in effect at each time is looked up once for all of the
+    states.
+    """
+    msids = [field for field in fields if field not in state_labels]
+    states = [field for field in fields if field in state_labels]
+    times = _get_times(ds["msids", msids[0]])
+    data = {}
+    for msid in msids:
+        v = ds["msids", msid]
+        t = _get_times(v)
+        values = np.asarray(v.value)
+        if t.shape != times.shape or not np.array_equal(t, times):
+            values = sample_nearest(t, values, times)
+        data[msid] = values, _get_label(v, msid)
+    if len(states) > 0:
+        # All of the states come from the same table, so they share the
+        # start times of its rows
+        starts = _get_times(ds["states", states[0]])[0]
+        idxs = np.clip(np.searchsorted(starts, times, side="right")-1, 0, starts.size-1)
+        for state in states:
+            v = ds["states", state]
+            data[state] = np.asarray(v.value)[idxs], _get_label(v, state)
+    return times, data
+
+
+class PhaseHistogram:
+    """
+    The counts of the samples of *x_field* and *y_field* in the bins
+    between *x_edges* and *y_edges*, fetched from *source*, "archive" or
+    "maude", as *stat* data, "5min", "daily" or None for full
+    resolution. *intervals* are the intervals of time which have been
+    added to the counts.
+    """
+    def __init__(self, x_field, y_field, x_edges, y_edges, counts=None,
+                 intervals=None, x_label=None, y_label=None, stat="5min",
+                 source="archive"):
+        self.x_field = x_field
+        self.y_field = y_field
+        self.x_edges = np.asarray(x_edges, dtype="float64")
+        self.y_edges = np.asarray(y_edges, dtype="float64")
+        if counts is None:
+            counts = np.zeros((self.x_edges.size-1, self.y_edges.size-1), dtype="int64")
+        self.counts = counts
+        self.intervals = [] if intervals is None else [tuple(i) for i in intervals]
+        self.x_label = x_field if x_label is None else x_label
+        self.y_label = y_field if y_label is None else y_label
+        if source == "maude":
+            # MAUDE only has full resolution data
+            stat = None
+        self.stat = stat
+        self.source = source
+
+    @classmethod
+    def from_range(cls, x_field, y_field, x_range, y_range, x_bins, y_bins,
+                   stat="5min", source="archive"):
+        return cls(x_field, y_field, np.linspace(x_range[0], x_range[1], x_bins+1),
+                   np.linspace(y_range[0], y_range[1], y_bins+1), stat=stat,
+                   source=source)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            if "stat" not in f or "source" not in f:
+                raise ValueError("The histogram in %s does not say which data it was "
+                                 "made from." % filename)
+            return cls(str(f["x_field"]), str(f["y_field"]), f["x_edges"], f["y_edges"],
+                       counts=f["counts"], intervals=f["intervals"],
+                       x_label=str(f["x_label"]), y_label=str(f["y_label"]),
+                       stat=str(f["stat"]) or None, source=str(f["source"]))
+
+    def save(self, filename):
+        np.savez(filename, x_field=self.x_field, y_field=self.y_field,
+                 x_edges=self.x_edges, y_edges=self.y_edges, counts=self.counts,
+                 intervals=np.array(self.intervals, dtype="float64").reshape(-1, 2),
+                 x_label=self.x_label, y_label=self.y_label,
+                 stat="" if self.stat is None else self.stat, source=self.source)
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype="float64")
+        y = np.asarray(y, dtype="float64")
+        good = np.isfinite(x) & np.isfinite(y)
+        counts, _, _ = np.histogram2d(x[good], y[good], bins=[self.x_edges, self.y_edges])
+        self.counts += counts.astype("int64")
+
+    def merge(self, other):
+        """
+        Add the counts of the histogram *other*, which must have the same
+        fields, bins and data, to this one.
+        """
+        if (other.x_field, other.y_field) != (self.x_field, self.y_field) or \
+                not np.array_equal(other.x_edges, self.x_edges) or \
+                not np.array_equal(other.y_edges, self.y_edges):
+            raise ValueError("Only histograms of the same fields with the same bins "
+                             "can be merged.")
+        if (other.stat, other.source) != (self.stat, self.source):
+            raise ValueError("Only histograms made from the same data can be merged.")
+        for a, b in other.intervals:
+            if get_missing_intervals(a, b, self.intervals) != [(a, b)]:
+                raise ValueError("The histograms to be merged have times in common.")
+        self.counts += other.counts
+        for a, b in other.intervals:
+            self.add_interval(a, b)
+
+    def add_interval(self, tstart, tstop):
+        for i, (a, b) in enumerate(self.intervals):
+            if b == tstart:
+                self.intervals[i] = (a, tstop)
+                return
+        self.intervals.append((tstart, tstop))
+
+    def get_missing_intervals(self, tstart, tstop):
+        return get_missing_intervals(tstart, tstop, self.intervals)
+
+    def accumulate(self, tstart, tstop, chunk_time=default_chunk_time):
+        """
+        Add the samples from *tstart* to *tstop* which have not been
+        added already, fetching *chunk_time* seconds of telemetry at a
+        time, so that only one chunk is held in memory at once.
+        """
+        fields = [self.x_field, self.y_field]
+        msids = [field for field in fields if field not in state_labels]
+        for a, b in self.get_missing_intervals(tstart, tstop):
+            for ta, tb in iter_chunks(a, b, chunk_time):
+                mylog.info("Adding %s to %s to the histogram." % (CxoTime(ta).date,
+                                                                  CxoTime(tb).date))
+                if self.source == "maude":
+                    ds = acispy.MaudeData(ta, tb, msids)
+                else:
+                    kwargs = {}
+                    if self.stat is None and len(msids) > 1:
+                        # Put the MSIDs on the same times
+                        kwargs["interpolate"] = "nearest"
+                    ds = acispy.EngArchiveData(ta, tb, msids, stat=self.stat,
+                                               filter_bad=True, **kwargs)
+                # MAUDE gives each MSID its own times, so they are put on
+                # the times of the first one
+                _, data = get_common_fields(ds, fields)
+                del ds
+                x, self.x_label = data[self.x_field]
+                y, self.y_label = data[self.y_field]
+                self.add(x, y)
+                self.add_interval(ta, tb)
+
+    def plot(self, scale="linear", cmap="hot"):
+        fig, ax = plt.subplots(figsize=(10, 8))
+        counts = np.ma.masked_equal(self.counts, 0)
+        norm = LogNorm() if scale == "log" else None
+        im = ax.pcolormesh(self.x_edges, self.y_edges, counts.T, norm=norm, cmap=cmap)
+        fig.colorbar(im, ax=ax, label="Counts")
+        ax.set_xlabel(self.x_label)
+        ax.set_ylabel(self.y_label)
+        return fig, ax
+
+
+def rasterize(x, y, c, xlim, ylim, shape, how="mean"):
+    """
+    Bin the samples *x*, *y* within *xlim* and *ylim* onto a grid of
+    *shape* (nx, ny) pixels. Without colors *c*, returns the number of
+    samples in each pixel. Otherwise returns the "mean", "max" or "last"
+    (in time order) of *c* in each pixel, NaN where there are none. The
+    image is indexed [y, x].
+    """
+    nx, ny = shape
+    inside = (x >= xlim[0]) & (x <= xlim[1]) & (y >= ylim[0]) & (y <= ylim[1])
+    if c is not None:
+        inside &= np.isfinite(c)
+    ix = np.clip(((x[inside]-xlim[0])*nx/(xlim[1]-xlim[0])).astype(int), 0, nx-1)
+    iy = np.clip(((y[inside]-ylim[0])*ny/(ylim[1]-ylim[0])).astype(int), 0, ny-1)
+    idxs = iy*nx + ix
+    counts = np.bincount(idxs, minlength=nx*ny)
+    if c is None:
+        return counts.reshape(ny, nx)
+    c = c[inside]
+    image = np.full(nx*ny, np.nan)
+    if how == "mean":
+        filled = counts > 0
+        image[filled] = np.bincount(idxs, weights=c, minlength=nx*ny)[filled]/counts[filled]
+    elif how == "max":
+        np.fmax.at(image, idxs, c)
+    elif how == "last":
+        # The samples are in time order, so the last one in each pixel is
+        # the one with the largest index
+        last = np.full(nx*ny, -1)
+        np.maximum.at(last, idxs, np.arange(idxs.size))
+        filled = last >= 0
+        image[filled] = c[last[filled]]
+    else:
+        raise ValueError("Unknown aggregation '%s'." % how)
+    return image.reshape(ny, nx)
+
+
+class _RasterImage(AxesImage):
+    """
+    The image of a :class:`RasterPhasePlot`, which has the plot bin the
+    samples again, if the axes have changed, just before it is drawn.
+    """
+    def __init__(self, plot, ax, **kwargs):
+        super().__init__(ax, **kwargs)
+        self.plot = plot
+
+    def draw(self, renderer):
+        self.plot._update()
+        super().draw(renderer)
+
+
+class RasterPhasePlot:
+    """
+    A phase scatter plot of *x* versus *y* drawn as one image with a
+    pixel for each pixel of the axes, colored by the number of samples
+    in it, or by the "mean", "max" or "last" of *c* in it. The samples
+    are binned again whenever the plot is drawn after the axes have been
+    zoomed, panned or resized, so drawing costs the same however many
+    samples there are.
+    """
+    def __init__(self, x, y, c=None, how="mean", cmap=None, x_label=None,
+                 y_label=None, c_label=None, figsize=(10, 8)):
+        good = np.isfinite(x) & np.isfinite(y)
+        if c is not None:
+            good &= np.isfinite(c)
+        if not good.any():
+            raise ValueError("There are no samples with finite values to plot.")
+        self.x = np.asarray(x, dtype="float64")[good]
+        self.y = np.asarray(y, dtype="float64")[good]
+        self.c = None if c is None else np.asarray(c, dtype="float64")[good]
+        self.how = how
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        self.ax.set_xlim(self.x.min(), self.x.max())
+        self.ax.set_ylim(self.y.min(), self.y.max())
+        self._limits = None
+        if self.c is None:
+            norm = LogNorm()
+            c_label = "Counts"
+        else:
+            norm = Normalize(vmin=self.c.min(), vmax=self.c.max())
+        self.image = _RasterImage(self, self.ax, origin="lower", interpolation="nearest",
+                                  cmap=cmap, norm=norm)
+        self.ax.add_image(self.image)
+        self._update()
+        self.fig.colorbar(self.image, ax=self.ax, label=c_label)
+        if x_label is not None:
+            self.ax.set_xlabel(x_label)
+        if y_label is not None:
+            self.ax.set_ylabel(y_label)
+
+    def _update(self):
+        xlim = self.ax.get_xlim()
+        ylim = self.ax.get_ylim()
+        bbox = self.ax.get_window_extent()
+        shape = (max(int(bbox.width), 1), max(int(bbox.height), 1))
+        if (xlim, ylim, shape) == self._limits:
+            return
+        self._limits = (xlim, ylim, shape)
+        image = rasterize(self.x, self.y, self.c, xlim, ylim, shape, how=self.how)
+        if self.c is None:
+            image = np.ma.masked_equal(image, 0)
+        self.image.set_data(image)
+        self.image.set_extent((xlim[0], xlim[1], ylim[0], ylim[1]))
+        # There is nothing to scale the counts to where there are no
+        # samples, so the last scale is kept
+        if self.c is None and image.count() > 0:
+            self.image.autoscale()
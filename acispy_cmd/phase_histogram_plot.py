@@ -5,6 +5,9 @@ import matplotlib.pyplot as plt
 import argparse
 import acispy
 from acispy.utils import state_labels, mylog
+from cxotime import CxoTime
+from acispy_cmd.telemetry import cached_telemetry
+from acispy_cmd.phase import PhaseHistogram
 matplotlib.use("Qt5Agg")
 
 def main():
@@ -19,8 +22,22 @@ def main():
     parser.add_argument("--scale", type=str, default="linear", help="Use linear or log scaling for the histogram, default 'linear'")
     parser.add_argument("--cmap", type=str, default="hot", help="The colormap for the histogram, default 'hot'")
     parser.add_argument("--maude", action="store_true", help="Use MAUDE to get telemetry data.")
+    parser.add_argument("--maude-concurrency", type=int, default=4, help="The number of requests to make to MAUDE at once. Default: 4")
+    parser.add_argument("--stream", action="store_true", help="Fetch the telemetry a chunk of time at a time and add it to the histogram, so that any length of time can be used.")
+    parser.add_argument("--chunk-days", type=float, default=30.0, help="The number of days of telemetry to fetch at a time with --stream. Default: 30")
+    parser.add_argument("--x-range", type=float, nargs=2, metavar=("XMIN", "XMAX"), help="The range of the bins on the x-axis, required with --stream unless --merge is given.")
+    parser.add_argument("--y-range", type=float, nargs=2, metavar=("YMIN", "YMAX"), help="The range of the bins on the y-axis, required with --stream unless --merge is given.")
+    parser.add_argument("--full-res", action="store_true", help="Use full resolution data instead of 5-minute statistics with --stream.")
+    parser.add_argument("--merge", type=str, nargs="+", help="One or more histograms saved with --save to add together and add to with --stream. Their bins are used and the times they already have are not fetched again.")
+    parser.add_argument("--save", type=str, help="Save the histogram made with --stream to this .npz file.")
+    parser.add_argument("--no-cache", action="store_true", help="Fetch all of the telemetry instead of using the cache of telemetry from earlier runs.")
+    parser.add_argument("--verbose", action="store_true", help="Report how much of the telemetry came from the cache.")
     args = parser.parse_args()
     
+    if args.stream:
+        stream_histogram(parser, args)
+        return
+
     msids = []
     
     if args.x_field in state_labels:
@@ -35,13 +52,18 @@ def main():
         msids.append(args.y_field)
         y_field = ("msids", args.y_field)
     
-    if args.maude:
-        mylog.info("Using MAUDE to retrieve MSID data.")
-        ds = acispy.MaudeData(args.tstart, args.tstop, msids)
-    else:
-        ds = acispy.EngArchiveData(args.tstart, args.tstop,
-                                   msids, stat='5min',
-                                   filter_bad=True)
+    maude_concurrency = args.maude_concurrency if args.maude else None
+    with cached_telemetry(enabled=not args.no_cache,
+                          maude_concurrency=maude_concurrency) as cache:
+        if args.maude:
+            mylog.info("Using MAUDE to retrieve MSID data.")
+            ds = acispy.MaudeData(args.tstart, args.tstop, msids)
+        else:
+            ds = acispy.EngArchiveData(args.tstart, args.tstop,
+                                       msids, stat='5min',
+                                       filter_bad=True)
+    if args.verbose and cache is not None:
+        mylog.info(cache.get_stats())
     
     if x_field[0] == "states" and y_field[0] != "states":
         ds.map_state_to_msid(x_field[1], y_field[1])
@@ -55,5 +77,46 @@ def main():
     plt.show()
 
 
+def stream_histogram(parser, args):
+    if args.x_field in state_labels and args.y_field in state_labels:
+        parser.error("--stream requires at least one of the fields to be an MSID.")
+    source = "maude" if args.maude else "archive"
+    stat = None if args.full_res or args.maude else "5min"
+    if args.merge is not None:
+        try:
+            hist = PhaseHistogram.load(args.merge[0])
+            for filename in args.merge[1:]:
+                hist.merge(PhaseHistogram.load(filename))
+        except ValueError as e:
+            parser.error(str(e))
+        if (hist.x_field, hist.y_field) != (args.x_field, args.y_field):
+            parser.error("The histograms in %s are of %s versus %s." % (
+                " ".join(args.merge), hist.y_field, hist.x_field))
+        if (hist.stat, hist.source) != (stat, source):
+            parser.error("The histograms in %s were made from %s data from %s." % (
+                " ".join(args.merge), hist.stat or "full resolution", hist.source))
+    elif args.x_range is None or args.y_range is None:
+        parser.error("--stream requires --x-range and --y-range unless --merge is given.")
+    else:
+        hist = PhaseHistogram.from_range(args.x_field, args.y_field, args.x_range,
+                                         args.y_range, args.x_bins, args.y_bins,
+                                         stat=stat, source=source)
+
+    tstart, tstop = CxoTime([args.tstart, args.tstop]).secs
+    maude_concurrency = args.maude_concurrency if args.maude else None
+    with cached_telemetry(enabled=not args.no_cache,
+                          maude_concurrency=maude_concurrency) as cache:
+        hist.accumulate(tstart, tstop, chunk_time=args.chunk_days*86400.0)
+    if args.verbose and cache is not None:
+        mylog.info(cache.get_stats())
+
+    if args.save is not None:
+        hist.save(args.save)
+        mylog.info("Saved the histogram to %s." % args.save)
+
+    hist.plot(scale=args.scale, cmap=args.cmap)
+    plt.show()
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -5,6 +5,8 @@ import matplotlib.pyplot as plt
 import argparse
 import acispy
 from acispy.utils import state_labels, mylog
+from acispy_cmd.telemetry import cached_telemetry
+from acispy_cmd.phase import RasterPhasePlot, get_field_values
 matplotlib.use("Qt5Agg")
 
 
@@ -18,6 +20,11 @@ def main():
     parser.add_argument("--c_field", type=str, help='The MSID or state to plot using colors')
     parser.add_argument("--cmap", type=str, help='The colormap to use if plotting colors')
     parser.add_argument("--maude", action="store_true", help="Use MAUDE to get telemetry data.")
+    parser.add_argument("--maude-concurrency", type=int, default=4, help="The number of requests to make to MAUDE at once. Default: 4")
+    parser.add_argument("--raster", action="store_true", help="Draw the samples as an image binned at the resolution of the screen, which is binned again on zooming. Much faster for large numbers of samples.")
+    parser.add_argument("--raster-color", type=str, default="mean", choices=["mean", "max", "last"], help="How to combine the colors of the samples in each pixel with --raster. Default: mean")
+    parser.add_argument("--no-cache", action="store_true", help="Fetch all of the telemetry instead of using the cache of telemetry from earlier runs.")
+    parser.add_argument("--verbose", action="store_true", help="Report how much of the telemetry came from the cache.")
     args = parser.parse_args()
     
     msids = []
@@ -41,13 +48,18 @@ def main():
             msids.append(args.c_field)
             c_field = ("msids", args.c_field)
     
-    if args.maude:
-        mylog.info("Using MAUDE to retrieve MSID data.")
-        ds = acispy.MaudeData(args.tstart, args.tstop, msids)
-    else:
-        ds = acispy.EngArchiveData(args.tstart, args.tstop,
-                                   msids, stat='5min',
-                                   filter_bad=True)
+    maude_concurrency = args.maude_concurrency if args.maude else None
+    with cached_telemetry(enabled=not args.no_cache,
+                          maude_concurrency=maude_concurrency) as cache:
+        if args.maude:
+            mylog.info("Using MAUDE to retrieve MSID data.")
+            ds = acispy.MaudeData(args.tstart, args.tstop, msids)
+        else:
+            ds = acispy.EngArchiveData(args.tstart, args.tstop,
+                                       msids, stat='5min',
+                                       filter_bad=True)
+    if args.verbose and cache is not None:
+        mylog.info(cache.get_stats())
     
     if x_field[0] == "states" and y_field[0] != "states":
         ds.map_state_to_msid(x_field[1], y_field[1])
@@ -63,7 +75,17 @@ def main():
     if args.c_field is None:
         c_field = None
     
-    pp = acispy.PhaseScatterPlot(ds, x_field, y_field, c_field=c_field, cmap=args.cmap)
+    if args.raster:
+        x, x_label = get_field_values(ds, x_field)
+        y, y_label = get_field_values(ds, y_field)
+        if c_field is None:
+            c = c_label = None
+        else:
+            c, c_label = get_field_values(ds, c_field)
+        pp = RasterPhasePlot(x, y, c=c, how=args.raster_color, cmap=args.cmap,
+                             x_label=x_label, y_label=y_label, c_label=c_label)
+    else:
+        pp = acispy.PhaseScatterPlot(ds, x_field, y_field, c_field=c_field, cmap=args.cmap)
     plt.show()
 
 
@@ -5,7 +5,9 @@ import matplotlib.pyplot as plt
 import argparse
 import acispy
 from acispy.utils import state_labels, mylog
-from Chandra.Time import date2secs, secs2date
+from Chandra.Time import secs2date
+from acispy_cmd.tracelog import get_tracelog_data, get_tracelog_end, \
+    ten_day_tracelog_files
 matplotlib.use("Qt5Agg")
 
 
@@ -16,6 +18,8 @@ def main():
     parser.add_argument("--days", type=int, default=10, help='The number of days before the end of the log to plot. Default: 10')
     parser.add_argument("--one-panel", action='store_true',
                         help="Whether to make a multi-panel plot or a single-panel plot. The latter is only valid if the quantities have the same units.")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Read the tracelog files directly instead of through the cache of parsed tracelogs.")
     args = parser.parse_args()
     
     states = []
@@ -29,15 +33,17 @@ def main():
     
     fields = [("msids", m) for m in msids] + [("states", s) for s in states]
     
-    ds = acispy.TenDayTracelogData()
-    dates = ds["1dpamzt"].dates
-    
-    datestop = dates[-1]
+    tstop = get_tracelog_end(ten_day_tracelog_files[0])
+    datestop = secs2date(tstop)
     if args.days > 10:
         mylog.warning("Cannot plot more than 10 days from the 10-day tracelog. Plotting data from the full tracelog.")
     days = min(10, args.days)
     secs = days*24*3600.0
-    datestart = secs2date(date2secs(datestop)-secs)
+    datestart = secs2date(tstop-secs)
+
+    # Only read the part of the logs which is plotted
+    ds = get_tracelog_data(ten_day_tracelog_files, msids,
+                           tbegin=tstop-secs, cache=not args.no_cache)
     
     if args.one_panel or len(fields) == 1:
         cp = acispy.DatePlot(ds, fields)
@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 import argparse
 import acispy
 from acispy.utils import state_labels, mylog
+from acispy_cmd.telemetry import cached_telemetry, auto_stat
 matplotlib.use("Qt5Agg")
 
 def main():
@@ -15,6 +16,10 @@ def main():
     parser.add_argument("y_axis", type=str, help='The MSID to be plotted on the left y-axis')
     parser.add_argument("--y2_axis", type=str, help='The MSID or state to be plotted on the right y-axis (default: none)')
     parser.add_argument("--maude", action="store_true", help="Use MAUDE to get telemetry data.")
+    parser.add_argument("--maude-concurrency", type=int, default=4, help="The number of requests to make to MAUDE at once. Default: 4")
+    parser.add_argument("--auto-stat", action="store_true", help="Fetch full resolution data, 5-minute or daily statistics depending on the time span, and reduce the data to its minimum and maximum at each pixel of the plot, plotting the range of the statistics rather than their means.")
+    parser.add_argument("--no-cache", action="store_true", help="Fetch all of the telemetry instead of using the cache of telemetry from earlier runs.")
+    parser.add_argument("--verbose", action="store_true", help="Report how much of the telemetry came from the cache.")
     args = parser.parse_args()
     
     msids = []
@@ -35,12 +40,23 @@ def main():
     else:
         y2_axis = None
     
-    if args.maude:
-        mylog.info("Using MAUDE to retrieve MSID data.")
-        ds = acispy.MaudeData(args.tstart, args.tstop, msids)
-    else:
-        ds = acispy.EngArchiveData(args.tstart, args.tstop, msids,
-                                   filter_bad=True)
+    stat = None
+    decimate = None
+    if args.auto_stat:
+        # DatePlot figures are 10 inches wide
+        stat, decimate = auto_stat(args.tstart, args.tstop, maude=args.maude, width=10.0)
+
+    maude_concurrency = args.maude_concurrency if args.maude else None
+    with cached_telemetry(enabled=not args.no_cache, maude_concurrency=maude_concurrency,
+                          decimate=decimate) as cache:
+        if args.maude:
+            mylog.info("Using MAUDE to retrieve MSID data.")
+            ds = acispy.MaudeData(args.tstart, args.tstop, msids)
+        else:
+            ds = acispy.EngArchiveData(args.tstart, args.tstop, msids,
+                                       stat=stat, filter_bad=True)
+    if args.verbose and cache is not None:
+        mylog.info(cache.get_stats())
     
     cp = acispy.DatePlot(ds, y_axis, field2=y2_axis)
     plt.show()
@@ -0,0 +1,424 @@
+"""
+An on-disk cache of telemetry fetched from the engineering archive and
+MAUDE, shared by the command-line tools.
+"""
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager, ExitStack
+import numpy as np
+import matplotlib
+from cxotime import CxoTime
+from acispy.utils import mylog
+from acispy_cmd.maude_fetch import concurrent_maude
+from acispy_cmd.cache import get_cache_dir, touch_entry, evict_lru, \
+    default_cache_size
+
+# Telemetry from the last few days may still be filled in, so it is
+# always fetched and never cached
+recent_time = 3.0*86400.0
+
+# The columns which the engineering archive gives an MSID at full
+# resolution and as 5-minute or daily statistics. An MSID with any
+# other columns is fetched without the cache.
+archive_columns = {"times", "vals", "bads", "indexes", "samples", "mins", "maxes",
+                   "means", "midvals", "stds", "p01s", "p05s", "p16s", "p50s",
+                   "p84s", "p95s", "p99s"}
+
+
+def get_missing_intervals(tstart, tstop, covered):
+    """
+    Return the parts of the interval from *tstart* to *tstop* which are
+    not in any of the *covered* intervals.
+    """
+    missing = []
+    t = tstart
+    for a, b in sorted(covered):
+        if b <= t:
+            continue
+        if a >= tstop:
+            break
+        if a > t:
+            missing.append((t, a))
+        t = max(t, b)
+    if t < tstop:
+        missing.append((t, tstop))
+    return missing
+
+
+def iter_chunks(tstart, tstop, chunk_time):
+    """
+    Split the interval from *tstart* to *tstop* into intervals no longer
+    than *chunk_time*.
+    """
+    edges = np.append(np.arange(tstart, tstop, chunk_time), tstop)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _select(columns, tstart, tstop):
+    use = (columns["times"] >= tstart) & (columns["times"] < tstop)
+    return {name: values[use] for name, values in columns.items()}
+
+
+def _concatenate(parts):
+    parts = [part for part in parts if part["times"].size > 0] or parts[:1]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+class TelemetryCache:
+    """
+    A cache of telemetry, with an entry for each source, MSID, stat and
+    unit system. The telemetry is cached before bad values are filtered
+    out, so one entry serves both filter_bad settings. Each entry holds
+    chunks of the columns of the telemetry, each over an interval of
+    time. A request fetches only the parts of its interval which are not
+    in the cache, and the chunks it covers are merged into one. The least
+    recently used entries are removed when the cache grows past
+    *max_size* bytes.
+    """
+    def __init__(self, cache_dir=None, max_size=default_cache_size):
+        if cache_dir is None:
+            cache_dir = get_cache_dir("telemetry")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_fetched = 0
+
+    def _get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def _read_index(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, "index.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"chunks": []}
+
+    def _write_index(self, entry_dir, index):
+        fd, fn = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(fn, os.path.join(entry_dir, "index.json"))
+
+    def _read_chunk(self, entry_dir, chunk):
+        with np.load(os.path.join(entry_dir, chunk["file"]), allow_pickle=False) as f:
+            return {name: f[name] for name in f.files}
+
+    def _write_chunk(self, entry_dir, tstart, tstop, columns):
+        fd, fn = tempfile.mkstemp(dir=entry_dir, suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **columns)
+        return {"tstart": tstart, "tstop": tstop, "file": os.path.basename(fn)}
+
+    def get(self, key, tstart, tstop, fetch):
+        """
+        Return the columns of the telemetry for *key* from *tstart* to
+        *tstop*, as a dict of arrays which includes "times". *fetch* is
+        called with the start and stop times of each part which has to
+        be fetched, and returns the columns over that part.
+        """
+        # Only cache the telemetry which is no longer being filled in
+        cache_stop = min(tstop, CxoTime().secs - recent_time)
+        parts = []
+        if cache_stop > tstart:
+            parts.append(self._get_cached(key, tstart, cache_stop, fetch))
+        if tstop > max(tstart, cache_stop):
+            start = max(tstart, cache_stop)
+            columns = fetch(start, tstop)
+            self.misses += 1
+            self.bytes_fetched += sum(values.nbytes for values in columns.values())
+            parts.append(_select(columns, start, tstop))
+        return _concatenate(parts)
+
+    def _get_cached(self, key, tstart, tstop, fetch):
+        entry_dir = self._get_entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        index = self._read_index(entry_dir)
+        chunks = [chunk for chunk in index["chunks"]
+                  if chunk["tstop"] > tstart and chunk["tstart"] < tstop]
+        parts = []
+        for chunk in chunks:
+            try:
+                columns = self._read_chunk(entry_dir, chunk)
+            except (OSError, ValueError, KeyError):
+                # Fetch the chunk again if it is missing or damaged
+                index["chunks"].remove(chunk)
+                continue
+            self.hits += 1
+            self.bytes_saved += sum(values.nbytes for values in
+                                    _select(columns, tstart, tstop).values())
+            parts.append((chunk["tstart"], chunk["tstop"], columns))
+        covered = [(a, b) for a, b, _ in parts]
+        for a, b in get_missing_intervals(tstart, tstop, covered):
+            columns = _select(fetch(a, b), a, b)
+            self.misses += 1
+            self.bytes_fetched += sum(values.nbytes for values in columns.values())
+            parts.append((a, b, columns))
+        parts.sort(key=lambda part: part[0])
+
+        # Merge the chunks which were used into one, which covers all of them
+        merged = _concatenate([columns for _, _, columns in parts])
+        if len(parts) > 1 or len(chunks) == 0:
+            try:
+                new_chunk = self._write_chunk(entry_dir, parts[0][0], parts[-1][1], merged)
+            except OSError:
+                pass
+            else:
+                old_files = [chunk["file"] for chunk in chunks]
+                index["chunks"] = [chunk for chunk in index["chunks"] if chunk not in chunks]
+                index["chunks"].append(new_chunk)
+                self._write_index(entry_dir, index)
+                for fn in old_files:
+                    try:
+                        os.remove(os.path.join(entry_dir, fn))
+                    except OSError:
+                        pass
+                evict_lru(self.cache_dir, self.max_size, keep=entry_dir)
+        touch_entry(entry_dir)
+        return _select(merged, tstart, tstop)
+
+    def get_stats(self):
+        return "Telemetry cache: %d hits, %d misses, %.1f MB read from the cache, " \
+               "%.1f MB fetched." % (self.hits, self.misses, self.bytes_saved/1024**2,
+                                     self.bytes_fetched/1024**2)
+
+
+def _get_unit_system(fetch):
+    try:
+        return fetch.units["system"]
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+
+def choose_stat(tstart, tstop, num_pixels):
+    """
+    Choose the coarsest resolution of archive data which still has at
+    least one sample for each of *num_pixels* across the time range:
+    "daily", "5min" or None for full resolution.
+    """
+    span = tstop - tstart
+    if span/86400.0 >= num_pixels:
+        return "daily"
+    # 5-minute statistics are over intervals of 328 seconds
+    if span/328.0 >= num_pixels:
+        return "5min"
+    return None
+
+
+def auto_stat(tstart, tstop, maude=False, width=10.0):
+    """
+    Choose the resolution of the telemetry from *tstart* to *tstop* for a
+    plot *width* inches wide with :func:`choose_stat`, or full resolution
+    if it comes from MAUDE, which has no statistics. Returns the stat and
+    the number of pixels across the plot, which is the number of
+    intervals to pass as *decimate* to :func:`cached_telemetry`.
+    """
+    num_pixels = int(width*matplotlib.rcParams["figure.dpi"])
+    tstart, tstop = CxoTime([tstart, tstop]).secs
+    stat = None if maude else choose_stat(tstart, tstop, num_pixels)
+    mylog.info("Using %s data." % ("full resolution" if stat is None else stat))
+    return stat, num_pixels
+
+
+def decimate_minmax(times, values, tstart, tstop, num_buckets):
+    """
+    Return the indices of the samples to keep so that *values* are
+    reduced to their minimum and maximum in each of *num_buckets* equal
+    intervals of time, in time order. Spikes and limit violations then
+    remain visible when the samples are plotted at the width of the
+    buckets. Values which are not numbers are not reduced.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in "fiub" or times.size <= 2*num_buckets:
+        return np.arange(times.size)
+    buckets = np.clip(((times-tstart)*num_buckets/(tstop-tstart)).astype(int),
+                      0, num_buckets-1)
+    starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+    counts = np.diff(np.append(starts, times.size))
+    keep = [starts]
+    for reduce in (np.minimum, np.maximum):
+        extremes = np.repeat(reduce.reduceat(values, starts), counts)
+        # The first sample in each bucket which has its extreme value
+        idxs = np.flatnonzero(values == extremes)
+        _, first = np.unique(buckets[idxs], return_index=True)
+        keep.append(idxs[first])
+    return np.unique(np.concatenate(keep))
+
+
+def _envelope(columns):
+    """
+    Replace each sample of statistics by two at the same time, with the
+    minimum and then the maximum over its interval as the value, so that
+    a line through them covers the spikes which the means average away.
+    """
+    if "mins" not in columns or "maxes" not in columns or \
+            columns["mins"].dtype.kind not in "fiub":
+        return columns
+    envelope = {name: np.repeat(values, 2) for name, values in columns.items()}
+    values = np.empty(2*columns["mins"].size,
+                      dtype=np.result_type(columns["mins"], columns["maxes"]))
+    values[0::2] = columns["mins"]
+    values[1::2] = columns["maxes"]
+    # Whichever of these is plotted
+    for name in ("vals", "means", "midvals"):
+        if name in envelope:
+            envelope[name] = values
+    return envelope
+
+
+def _decimate(columns, tstart, tstop, num_buckets, value_name):
+    idxs = decimate_minmax(columns["times"], columns[value_name], tstart, tstop,
+                           num_buckets)
+    if idxs.size == columns["times"].size:
+        return columns
+    return {name: values[idxs] for name, values in columns.items()}
+
+
+def _get_columns(msid):
+    columns = {name: np.asarray(getattr(msid, name)) for name in msid.colnames}
+    columns["times"] = np.asarray(msid.times)
+    return columns
+
+
+def _route_archive(cache, fetch, decimate=None):
+    """
+    Route the engineering archive fetches of MSIDs through *cache*, if
+    it is given, and if *decimate* is given, replace statistics by their
+    minimum and maximum over each interval and reduce the data to the
+    minimum and maximum in each of *decimate* intervals. Returns a
+    function which undoes this.
+    """
+    get_data = fetch.MSID._get_data
+
+    def _get_data(msid):
+        tstart, tstop = msid.tstart, msid.tstop
+        datestart, datestop = msid.datestart, msid.datestop
+
+        def _fetch(a, b):
+            msid.tstart, msid.tstop = a, b
+            msid.datestart, msid.datestop = CxoTime([a, b]).date
+            get_data(msid)
+            return _get_columns(msid)
+
+        if cache is None:
+            get_data(msid)
+            columns = _get_columns(msid) if set(msid.colnames) <= archive_columns else None
+        else:
+            try:
+                # Fetch a moment of data so that the MSID is set up as
+                # usual, and then fill in its columns from the cache
+                _fetch(tstart, tstart+1.0)
+                if set(msid.colnames) <= archive_columns:
+                    key = ("archive", msid.msid.lower(), msid.stat, _get_unit_system(fetch))
+                    columns = cache.get(key, tstart, tstop, _fetch)
+                else:
+                    columns = None
+            finally:
+                msid.tstart, msid.tstop = tstart, tstop
+                msid.datestart, msid.datestop = datestart, datestop
+            if columns is None:
+                # The cache does not know how to fill in this MSID
+                get_data(msid)
+                return
+        if columns is None:
+            return
+        if decimate is not None:
+            if msid.stat is not None:
+                columns = _envelope(columns)
+            columns = _decimate(columns, tstart, tstop, decimate, "vals")
+        for name, values in columns.items():
+            setattr(msid, name, values)
+
+    fetch.MSID._get_data = _get_data
+
+    def undo():
+        fetch.MSID._get_data = get_data
+
+    return undo
+
+
+def _route_maude(cache, maude, decimate=None):
+    """
+    Route the MAUDE fetches of MSIDs through *cache*, if it is given, and
+    reduce the data to the minimum and maximum in each of *decimate*
+    intervals, if it is given. Returns a function which undoes this.
+    """
+    get_msids = maude.get_msids
+
+    def routed_get_msids(msids, start=None, stop=None, **kwargs):
+        if start is None or stop is None or len(kwargs) > 0:
+            return get_msids(msids, start=start, stop=stop, **kwargs)
+        if isinstance(msids, str):
+            msids = [msids]
+        tstart, tstop = CxoTime([start, stop]).secs
+        if cache is None:
+            out = get_msids(msids, start=tstart, stop=tstop)
+        else:
+            # Fetch a moment of data so that the result is set up as
+            # usual, and then fill in its data from the cache
+            out = get_msids(msids, start=tstart, stop=tstart+1.0)
+        for data in out["data"]:
+            if cache is None:
+                columns = {"times": np.asarray(data["times"]),
+                           "values": np.asarray(data["values"])}
+            else:
+                def _fetch(a, b, msid=data["msid"]):
+                    result = get_msids([msid], start=a, stop=b)["data"][0]
+                    return {"times": np.asarray(result["times"]),
+                            "values": np.asarray(result["values"])}
+                columns = cache.get(("maude", data["msid"].lower(), None, None),
+                                    tstart, tstop, _fetch)
+            if decimate is not None:
+                columns = _decimate(columns, tstart, tstop, decimate, "values")
+            data["times"] = columns["times"]
+            data["values"] = columns["values"]
+        return out
+
+    maude.get_msids = routed_get_msids
+
+    def undo():
+        maude.get_msids = get_msids
+
+    return undo
+
+
+@contextmanager
+def cached_telemetry(enabled=True, cache=None, maude_concurrency=None, decimate=None):
+    """
+    Within this context, telemetry fetched from the engineering archive
+    or MAUDE, for example by EngArchiveData or MaudeData, goes through
+    the telemetry cache, unless *enabled* is False. If *decimate* is
+    given, telemetry is reduced to its minimum and maximum in that many
+    intervals of the time range, and statistics are replaced by their
+    minimum and maximum over each of their own intervals, whether or not
+    the cache is enabled. If *maude_concurrency* is given, MAUDE
+    telemetry is fetched in chunks with that many requests at once.
+    Yields the cache, or None if it is not enabled.
+    """
+    with ExitStack() as stack:
+        if maude_concurrency is not None:
+            stack.enter_context(concurrent_maude(concurrency=maude_concurrency))
+        if not enabled:
+            cache = None
+        elif cache is None:
+            cache = TelemetryCache()
+        if cache is None and decimate is None:
+            # Leave cheta and MAUDE as they are
+            yield None
+            return
+        try:
+            from cheta import fetch
+        except ImportError:
+            from Ska.engarchive import fetch
+        stack.callback(_route_archive(cache, fetch, decimate=decimate))
+        try:
+            import maude
+        except ImportError:
+            pass
+        else:
+            stack.callback(_route_maude(cache, maude, decimate=decimate))
+        yield cache
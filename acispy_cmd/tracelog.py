@@ -0,0 +1,663 @@
+"""
+Incremental reading of ACIS tracelog files.
+"""
+import io
+import os
+import json
+import hashlib
+import tempfile
+import shutil
+import numpy as np
+from cxotime import CxoTime
+from acispy_cmd.cache import get_cache_dir, touch_entry, evict_lru, \
+    default_cache_size
+
+
+ten_day_tracelog_files = ["/data/acis/eng_plots/acis_eng_10day.tl",
+                          "/data/acis/eng_plots/acis_dea_10day.tl"]
+
+# Tracelog times are in seconds from 1985.0, which is this many seconds
+# before the Chandra epoch of 1998.0
+tracelog_time_offset = 410227200.0
+
+
+def get_tracelog_times(tokens):
+    """
+    Convert an array of tracelog time strings, which are either seconds
+    from 1985.0 or dates, to Chandra seconds.
+    """
+    try:
+        return tokens.astype("float64") - tracelog_time_offset
+    except ValueError:
+        return CxoTime(tokens).secs
+
+
+def _to_float(tokens):
+    try:
+        return tokens.astype("float64")
+    except ValueError:
+        values = np.full(tokens.size, np.nan)
+        for i, token in enumerate(tokens):
+            try:
+                values[i] = float(token)
+            except ValueError:
+                pass
+        return values
+
+
+def _is_number(token):
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_rows(data, names, time_col, numeric=None):
+    """
+    Parse the complete rows of tracelog text in *data*, skipping any which
+    do not have a value for each of *names*. Returns the times in seconds,
+    a dict of the columns other than the time column, and which of the
+    columns are numeric, which is taken from the first row if *numeric*
+    is not given.
+    """
+    ncols = len(names)
+    rows = [row for row in (line.split() for line in data.decode(errors="replace").splitlines())
+            if len(row) == ncols]
+    if len(rows) == 0:
+        return np.empty(0), {}, numeric
+    tokens = np.array(rows)
+    if numeric is None:
+        numeric = [_is_number(token) for token in tokens[0]]
+    times = get_tracelog_times(tokens[:, time_col])
+    columns = {}
+    for i, name in enumerate(names):
+        if i == time_col:
+            continue
+        columns[name] = _to_float(tokens[:, i]) if numeric[i] else tokens[:, i]
+    return times, columns, numeric
+
+
+class TracelogTail:
+    """
+    Read a tracelog file incrementally. Each call to :meth:`update` parses
+    only the complete rows which have been appended to the file since the
+    last call, into columns which grow as needed. If the file has been
+    truncated or replaced, it is read again from the start. Rows before
+    *tbegin* or more than *retention* seconds before the latest row are
+    dropped.
+    """
+    def __init__(self, filename, retention=None):
+        self.filename = filename
+        self.retention = retention
+        self.full_reads = 0
+        self.reset()
+
+    def reset(self):
+        self.header = None
+        self.names = []
+        self.time_col = 0
+        self.numeric = None
+        self.inode = None
+        self.offset = 0
+        # The last complete line read, which is used to check that the
+        # file has only been appended to since
+        self.last_line = b""
+        self.last_time = -np.inf
+        self._times = np.empty(0)
+        self._columns = {}
+        self._start = 0
+        self._stop = 0
+
+    def _is_appended(self, f, st):
+        if self.header is None:
+            return False
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            return False
+        if f.readline() != self.header:
+            return False
+        f.seek(self.offset-len(self.last_line))
+        return f.read(len(self.last_line)) == self.last_line
+
+    def _set_header(self, header, st):
+        self.reset()
+        self.header = header
+        self.inode = st.st_ino
+        self.offset = len(header)
+        self.names = [name.lower() for name in header.decode().split()]
+        if "time" in self.names:
+            self.time_col = self.names.index("time")
+        self.full_reads += 1
+
+    def update(self, tbegin=None):
+        """
+        Read the rows appended to the file since the last update. Returns
+        True if any rows were added or dropped. While a file which has
+        replaced the one read so far has no complete rows, the rows of
+        the old one are kept and False is returned.
+        """
+        with open(self.filename, "rb") as f:
+            st = os.fstat(f.fileno())
+            reread = not self._is_appended(f, st)
+            if reread:
+                f.seek(0)
+                header = f.readline()
+                if not header.endswith(b"\n"):
+                    # The file is empty or still being written
+                    return False
+            else:
+                f.seek(self.offset)
+            data = f.read()
+        # Only read up to the end of the last complete line
+        end = data.rfind(b"\n") + 1
+        if reread:
+            if end == 0:
+                return False
+            self._set_header(header, st)
+        data = data[:end]
+        if end > 0:
+            self.offset += end
+            self.last_line = data[data.rfind(b"\n", 0, end-1)+1:]
+        added = self._append(data, tbegin)
+        evicted = self._evict(tbegin)
+        return reread or added or evicted
+
+    def _append(self, data, tbegin):
+        times, columns, self.numeric = parse_rows(data, self.names, self.time_col,
+                                                  numeric=self.numeric)
+        keep = times > self.last_time
+        if tbegin is not None:
+            keep &= times >= tbegin
+        if not keep.any():
+            return False
+        times = times[keep]
+        columns = {name: values[keep] for name, values in columns.items()}
+
+        n = times.size
+        if self._stop + n > self._times.size:
+            # Drop the evicted rows and make room for at least as many
+            # rows again as are kept
+            size = self._stop - self._start
+            capacity = max(2*(size+n), 1024)
+            self._times = self._regrow(self._times, capacity)
+            for name in columns:
+                self._columns[name] = self._regrow(self._columns.get(name, columns[name][:0]),
+                                                   capacity)
+            self._start = 0
+            self._stop = size
+        stop = self._stop + n
+        self._times[self._stop:stop] = times
+        for name, values in columns.items():
+            column = self._columns[name]
+            if column.dtype != values.dtype and not np.can_cast(values.dtype, column.dtype):
+                column = column.astype(np.result_type(column.dtype, values.dtype))
+                self._columns[name] = column
+            column[self._stop:stop] = values
+        self._stop = stop
+        self.last_time = times[-1]
+        return True
+
+    def _regrow(self, column, capacity):
+        new_column = np.empty(capacity, dtype=column.dtype)
+        if column.size > 0:
+            size = self._stop - self._start
+            new_column[:size] = column[self._start:self._stop]
+        return new_column
+
+    def _evict(self, tbegin):
+        tmin = -np.inf if tbegin is None else tbegin
+        if self.retention is not None:
+            tmin = max(tmin, self.last_time - self.retention)
+        n = np.searchsorted(self.times, tmin)
+        self._start += n
+        return n > 0
+
+    @property
+    def times(self):
+        return self._times[self._start:self._stop]
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __contains__(self, msid):
+        return msid.lower() in self._columns
+
+    def get_data(self, field):
+        """
+        Return the times, values and drawstyle of an MSID, given either by
+        name or as an ("msids", name) field.
+        """
+        if isinstance(field, tuple):
+            field = field[1]
+        column = self._columns[field.lower()]
+        return self.times, column[self._start:self._stop], "default"
+
+
+class TracelogSet:
+    """
+    A set of :class:`TracelogTail` readers, with each MSID looked up in
+    the first file which has it.
+    """
+    def __init__(self, filenames, retention=None):
+        self.tails = [TracelogTail(filename, retention=retention)
+                      for filename in filenames]
+
+    def update(self, tbegin=None):
+        changed = [tail.update(tbegin=tbegin) for tail in self.tails]
+        return any(changed)
+
+    def __len__(self):
+        return sum(len(tail) for tail in self.tails)
+
+    def __contains__(self, msid):
+        return any(msid in tail for tail in self.tails)
+
+    def get_data(self, field):
+        name = field[1] if isinstance(field, tuple) else field
+        for tail in self.tails:
+            if name in tail:
+                return tail.get_data(name)
+        raise KeyError(name)
+
+
+class TracelogColumns:
+    """
+    The columns of a whole tracelog file, either in memory or
+    memory-mapped from the cache. *names* are the column names in the
+    header, and *columns* maps lowercase names to the columns which have
+    been read so far. Any other column is read with *loader* the first
+    time it is asked for.
+    """
+    def __init__(self, names, times, columns, loader=None):
+        self.names = names
+        self.times = times
+        self.columns = columns
+        self.loader = loader
+        self._lower_names = set(name.lower() for name in names)
+
+    def __contains__(self, msid):
+        return msid.lower() in self._lower_names
+
+    def get_column(self, msid):
+        name = msid.lower()
+        if name not in self.columns:
+            if name not in self._lower_names:
+                raise KeyError(msid)
+            self.columns.update(self.loader([name]))
+        return self.columns[name]
+
+    def get_data(self, field):
+        if isinstance(field, tuple):
+            field = field[1]
+        return self.times, self.get_column(field), "default"
+
+    def window(self, tbegin):
+        """
+        Return the rows from *tbegin* on.
+        """
+        i = np.searchsorted(self.times, tbegin)
+        loader = None
+        if self.loader is not None:
+            loader = lambda msids: {name: values[i:] for name, values in self.loader(msids).items()}
+        return TracelogColumns(self.names, self.times[i:],
+                               {name: values[i:] for name, values in self.columns.items()},
+                               loader=loader)
+
+
+def _count_rows(f, block_size=1024**2):
+    """
+    Count the complete rows from the current position of *f* to the end.
+    """
+    num_rows = 0
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return num_rows
+        num_rows += block.count(b"\n")
+
+
+def _get_row_time(line, time_col):
+    tokens = line.split()
+    if len(tokens) <= time_col or not line.endswith(b"\n"):
+        return None
+    try:
+        return get_tracelog_times(np.array([tokens[time_col].decode()]))[0]
+    except ValueError:
+        return None
+
+
+def find_row_offset(f, tbegin, time_col, data_start):
+    """
+    Return the offset in the open tracelog file *f* of the first row at
+    or after *tbegin*, with a binary search on the times of the rows. The
+    rows must be in time order.
+    """
+    size = os.fstat(f.fileno()).st_size
+    lo = data_start
+    hi = size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # Find the first row which starts at or after mid
+        f.seek(mid-1)
+        f.readline()
+        t = _get_row_time(f.readline(), time_col)
+        if t is not None and t >= tbegin:
+            hi = mid
+        else:
+            lo = mid + 1
+    f.seek(lo-1)
+    f.readline()
+    return f.tell()
+
+
+def get_tracelog_end(filename, block_size=65536):
+    """
+    Return the time in seconds of the last complete row of a tracelog
+    file.
+    """
+    names = [name.lower() for name in read_tracelog_header(filename)]
+    time_col = names.index("time") if "time" in names else 0
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = size
+        while offset > 0:
+            offset = max(offset-block_size, 0)
+            f.seek(offset)
+            lines = f.read(size-offset).splitlines(keepends=True)
+            # The first line is either the header or only part of a row
+            for line in reversed(lines[1:]):
+                t = _get_row_time(line, time_col)
+                if t is not None:
+                    return t
+    raise ValueError("The tracelog file %s has no rows." % filename)
+
+
+def read_tracelog_header(filename):
+    with open(filename, "rb") as f:
+        return f.readline().decode().split()
+
+
+def parse_columns(filename, msids=None, tbegin=None):
+    """
+    Parse the time column and the columns of *msids*, or all of the
+    columns if it is not given, of a tracelog file. The other columns
+    are split into fields but not converted, so the time and memory this
+    takes grow with the number of columns asked for rather than the
+    width of the file. If *tbegin* is given, only the rows from then on
+    are read. Returns the names in the header, the times in seconds and
+    a dict of the columns, including the time column as it is in the
+    file.
+    """
+    with open(filename, "rb") as f:
+        names = f.readline().decode().split()
+        lower_names = [name.lower() for name in names]
+        time_col = lower_names.index("time") if "time" in lower_names else 0
+        data_start = f.tell()
+        if tbegin is not None:
+            data_start = find_row_offset(f, tbegin, time_col, data_start)
+            f.seek(data_start)
+        first_row = f.readline().decode(errors="replace").split()
+        f.seek(data_start)
+        # Leave out a last row which is still being written
+        num_rows = _count_rows(f)
+    if msids is None:
+        cols = list(range(len(names)))
+    else:
+        msids = set(msid.lower() for msid in msids)
+        cols = [i for i, name in enumerate(lower_names)
+                if i == time_col or name in msids]
+    if len(first_row) != len(names):
+        first_row = ["0"]*len(names)
+    numeric = [_is_number(token) for token in first_row]
+    dtype = [(lower_names[i], "f8" if numeric[i] else "U%d" % max(len(first_row[i]), 16))
+             for i in cols]
+    if num_rows == 0:
+        table = np.empty(0, dtype=dtype)
+        columns = {lower_names[i]: table[lower_names[i]] for i in cols}
+    else:
+        try:
+            # Read straight from the file, so that the text is never held
+            # in memory all at once
+            with open(filename, "rb") as f:
+                f.seek(data_start)
+                table = np.loadtxt(io.TextIOWrapper(f, errors="replace"), dtype=dtype,
+                                   usecols=cols, comments=None, ndmin=1, max_rows=num_rows)
+            columns = {lower_names[i]: table[lower_names[i]] for i in cols}
+            del table
+        except ValueError:
+            # Some of the rows are incomplete, so fall back to splitting
+            # each row and skipping the ones which are
+            with open(filename, "rb") as f:
+                f.seek(data_start)
+                data = f.read()
+            data = data[:data.rfind(b"\n")+1]
+            times, columns, _ = parse_rows(data, lower_names, time_col, numeric=numeric)
+            columns = {lower_names[i]: columns[lower_names[i]] for i in cols if i != time_col}
+            columns[lower_names[time_col]] = (times + tracelog_time_offset) \
+                if numeric[time_col] else CxoTime(times).date
+    time_name = lower_names[time_col]
+    if numeric[time_col]:
+        times = columns[time_name] - tracelog_time_offset
+    else:
+        times = CxoTime(columns[time_name]).secs
+    return names, times, columns
+
+
+def parse_tracelog(filename, msids=None, tbegin=None):
+    """
+    Read the columns of *msids* of a tracelog file, or all of them if it
+    is not given, from *tbegin* on if it is given. The other columns are
+    read when they are asked for.
+    """
+    names, times, columns = parse_columns(filename, msids=msids, tbegin=tbegin)
+    return TracelogColumns(names, times, columns,
+                           loader=lambda msids: parse_columns(filename, msids=msids,
+                                                              tbegin=tbegin)[2])
+
+
+def _get_signature(filename, block_size=1024**2):
+    """
+    Identify the contents of a file by its size, modification time and a
+    hash of its first and last *block_size* bytes. Hashing the whole file
+    would cost nearly as much as parsing it.
+    """
+    st = os.stat(filename)
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        h.update(f.read(block_size))
+        if st.st_size > block_size:
+            f.seek(max(st.st_size-block_size, block_size))
+            h.update(f.read())
+    return {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": h.hexdigest()}
+
+
+class TracelogCache:
+    """
+    A cache of parsed tracelog files, with one .npy file for each column
+    and one for the times, which are memory-mapped when a file is read
+    again. Columns are added to an entry as they are first read. Each
+    entry is rebuilt when the size, modification time or hash of its file
+    changes, and the least recently used entries are removed when the
+    cache grows past *max_size* bytes.
+    """
+    def __init__(self, cache_dir=None, max_size=default_cache_size):
+        if cache_dir is None:
+            cache_dir = get_cache_dir("tracelogs")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _get_entry_dir(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def _read_manifest(self, entry_dir, signature, tbegin):
+        try:
+            with open(os.path.join(entry_dir, "manifest.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest["signature"] != signature:
+            return None
+        # The entry may only hold the rows from some time on
+        if manifest["tbegin"] is not None and (tbegin is None or tbegin < manifest["tbegin"]):
+            return None
+        return manifest
+
+    def _write_manifest(self, entry_dir, manifest):
+        fd, fn = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f)
+        os.replace(fn, os.path.join(entry_dir, "manifest.json"))
+
+    def _new_entry(self, entry_dir, filename, signature, tbegin, names, times, columns):
+        # Write the entry next to where it goes and then move it into
+        # place, so that a reader never sees half of it
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp")
+        try:
+            np.save(os.path.join(tmp_dir, "times.npy"), times)
+            manifest = {"source": os.path.abspath(filename), "signature": signature,
+                        "tbegin": tbegin, "names": names, "columns": {}}
+            self._save_columns(tmp_dir, manifest, columns)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return None
+        return manifest
+
+    def _save_columns(self, entry_dir, manifest, columns):
+        # Another process may be adding the same columns to the entry, so
+        # each is written to a file of its own and moved into place
+        for name, values in columns.items():
+            fd, tmp_fn = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, values)
+            fn = "col_%s.npy" % name
+            os.replace(tmp_fn, os.path.join(entry_dir, fn))
+            manifest["columns"][name] = fn
+        self._write_manifest(entry_dir, manifest)
+
+    def _load_columns(self, entry_dir, manifest, names):
+        return {name: np.load(os.path.join(entry_dir, manifest["columns"][name]), mmap_mode="r")
+                for name in names}
+
+    def load(self, filename, msids=None, tbegin=None):
+        """
+        Return the columns of *msids*, or all of them if it is not given,
+        of a tracelog file, from *tbegin* on if it is given. They are read
+        from the cache if they are there and up to date. Any other column
+        is added to the cache when it is first asked for.
+        """
+        signature = _get_signature(filename)
+        entry_dir = self._get_entry_dir(filename)
+        manifest = self._read_manifest(entry_dir, signature, tbegin)
+        if manifest is None:
+            names, times, columns = parse_columns(filename, msids=msids, tbegin=tbegin)
+            manifest = self._new_entry(entry_dir, filename, signature, tbegin, names,
+                                       times, columns)
+            if manifest is None:
+                return TracelogColumns(names, times, columns)
+            evict_lru(self.cache_dir, self.max_size, keep=entry_dir)
+        else:
+            touch_entry(entry_dir)
+        times = np.load(os.path.join(entry_dir, "times.npy"), mmap_mode="r")
+
+        def loader(msids):
+            names, new_times, columns = parse_columns(filename, msids=msids,
+                                                      tbegin=manifest["tbegin"])
+            if new_times.size != times.size:
+                raise RuntimeError("The tracelog file %s changed while it was being read."
+                                   % filename)
+            columns = {name: columns[name] for name in msids}
+            try:
+                self._save_columns(entry_dir, manifest, columns)
+            except OSError:
+                return columns
+            return self._load_columns(entry_dir, manifest, columns)
+
+        tracelog = TracelogColumns(manifest["names"], times,
+                                   self._load_columns(entry_dir, manifest, manifest["columns"]),
+                                   loader=loader)
+        if msids is not None:
+            missing = [msid.lower() for msid in msids
+                       if msid in tracelog and msid.lower() not in tracelog.columns]
+            if len(missing) > 0:
+                tracelog.columns.update(loader(missing))
+        if tbegin is not None and tbegin != manifest["tbegin"]:
+            tracelog = tracelog.window(tbegin)
+        return tracelog
+
+
+def read_tracelog(filename, msids=None, tbegin=None, cache=True):
+    """
+    Read the columns of *msids*, or all of them if it is not given, of a
+    tracelog file, from *tbegin* on if it is given, through the cache
+    unless *cache* is False. The other columns are read when they are
+    asked for.
+    """
+    if cache:
+        return TracelogCache().load(filename, msids=msids, tbegin=tbegin)
+    return parse_tracelog(filename, msids=msids, tbegin=tbegin)
+
+
+def write_tracelog(filename, tracelog, msids, chunk_size=100000):
+    """
+    Write the time column and the columns of *msids* from *tracelog* to
+    a new tracelog file, *chunk_size* rows at a time.
+    """
+    names = [name for name in tracelog.names
+             if name.lower() == "time" or name.lower() in msids]
+    columns = [tracelog.get_column(name) for name in names]
+    # Tracelog values have no more than 15 significant digits
+    row_format = " ".join("%.15g" if column.dtype.kind == "f" else "%s"
+                          for column in columns) + "\n"
+    with open(filename, "w") as f:
+        f.write(" ".join(names) + "\n")
+        for start in range(0, len(tracelog.times), chunk_size):
+            rows = np.empty((min(chunk_size, len(tracelog.times)-start), len(columns)),
+                            dtype=object)
+            for i, column in enumerate(columns):
+                rows[:, i] = column[start:start+rows.shape[0]]
+            f.write((row_format*rows.shape[0]) % tuple(rows.ravel()))
+
+
+def get_tracelog_data(filenames, msids, tbegin=None, cache=True):
+    """
+    Load the MSIDs in *msids* from one or more tracelog files into an
+    ACISpy dataset. Only the columns of *msids*, and only the rows from
+    *tbegin* on if it is given, are read from the files, through the
+    cache unless *cache* is False, and handed to ACISpy. If one of them
+    is not in the files, ACISpy reads the files itself.
+
+    ACISpy only makes a dataset of tracelog data from files, so the
+    columns which were read are written to a temporary tracelog with
+    only those columns for ACISpy to read. ACISpy still parses that
+    file as text, so a cached file is not opened at the speed of the
+    arrays in the cache.
+    """
+    import acispy
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    msids = set(msid.lower() for msid in msids)
+    headers = [set(name.lower() for name in read_tracelog_header(filename))
+               for filename in filenames]
+    # With no MSIDs, for example when only states are plotted, or with an
+    # MSID which is not in the files, there are no columns to hand over
+    if len(msids) == 0 or any(not any(msid in header for header in headers)
+                              for msid in msids):
+        return acispy.TracelogData(filenames if len(filenames) > 1 else filenames[0],
+                                   tbegin=tbegin)
+    tmp_dir = tempfile.mkdtemp(prefix="acispy_cmd")
+    try:
+        tmp_files = []
+        for filename, header in zip(filenames, headers):
+            file_msids = msids & header
+            if len(file_msids) == 0:
+                continue
+            tracelog = read_tracelog(filename, msids=file_msids, tbegin=tbegin, cache=cache)
+            tmp_files.append(os.path.join(tmp_dir, os.path.basename(filename)))
+            write_tracelog(tmp_files[-1], tracelog, file_msids)
+        return acispy.TracelogData(tmp_files if len(tmp_files) > 1 else tmp_files[0])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Micro-benchmark of the timeline assembly in current_load_page, comparing
+# the merge of the command, comm and NOW rows against inserting each comm
+# and NOW row into the command list with bisect.
+
+import bisect
+import timeit
+import numpy as np
+from acispy_cmd.current_load_page import Comm, get_comm_rows, get_now_row, \
+    merge_timeline
+from datetime import datetime, timezone
+
+
+def make_window(num_cmds=5000, num_comms=40, seed=0):
+    rng = np.random.default_rng(seed)
+    tmin = 0.0
+    tmax = 4.0*86400.0
+    cmdtimes = np.sort(rng.uniform(tmin, tmax, num_cmds))
+    cmdlines = [f"command line {i}\n" for i in range(num_cmds)]
+    comm_starts = np.sort(rng.uniform(tmin, tmax-7200.0, num_comms))
+    comms = [Comm(f"{t:.3f}", f"{t+3600.0:.3f}", t, t+3600.0,
+                  "2024:001:00:00:00", "2024:001:01:00:00", 60.0)
+             for t in comm_starts]
+    return cmdtimes, cmdlines, comms, tmin, tmax
+
+
+def insert_rows(cmdtimes, cmdlines, comms, now_row, tmin, tmax):
+    cmdtimes = list(cmdtimes)
+    cmdlines = list(cmdlines)
+    for t, line in get_comm_rows(comms, tmin, tmax) + [now_row]:
+        idx = bisect.bisect_right(cmdtimes, t)
+        cmdtimes.insert(idx, t)
+        cmdlines.insert(idx, line)
+    return cmdlines
+
+
+def main():
+    cmdtimes, cmdlines, comms, tmin, tmax = make_window()
+    now_utc = datetime.utcnow()
+    now_local = now_utc.replace(tzinfo=timezone.utc).astimezone(tz=None)
+    now_row = get_now_row(2.0*86400.0, now_utc, now_local)
+
+    cmdtimes_list = cmdtimes.tolist()
+
+    assert insert_rows(cmdtimes_list, cmdlines, comms, now_row, tmin, tmax) == \
+        merge_timeline(cmdtimes, cmdlines, get_comm_rows(comms, tmin, tmax), now_row)
+
+    number = 200
+    t_insert = timeit.timeit(lambda: insert_rows(cmdtimes_list, cmdlines, comms,
+                                                 now_row, tmin, tmax),
+                             number=number)
+    t_merge = timeit.timeit(lambda: merge_timeline(cmdtimes, cmdlines,
+                                                   get_comm_rows(comms, tmin, tmax),
+                                                   now_row),
+                            number=number)
+    print(f"{len(cmdtimes)} commands, {len(comms)} comms")
+    print(f"bisect/insert: {t_insert/number*1.0e3:.3f} ms per page")
+    print(f"merge:         {t_merge/number*1.0e3:.3f} ms per page")
+
+
+if __name__ == "__main__":
+    main()
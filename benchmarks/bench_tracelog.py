@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Benchmark of reading a few MSIDs from a wide tracelog file, comparing
+# parsing every column against parsing only the requested ones, and
+# reading them again from the cache, and of the whole path the tools
+# take to an ACISpy dataset with get_tracelog_data, with and without the
+# cache.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from acispy_cmd.tracelog import parse_columns, TracelogCache, tracelog_time_offset, \
+    get_tracelog_data
+
+
+def make_tracelog(filename, num_rows, num_cols, seed=0):
+    rng = np.random.default_rng(seed)
+    names = ["TIME"] + ["MSID%03d" % i for i in range(num_cols-1)]
+    t0 = 7.0e8 + tracelog_time_offset
+    chunk = 100000
+    with open(filename, "w") as f:
+        f.write(" ".join(names) + "\n")
+        for start in range(0, num_rows, chunk):
+            n = min(chunk, num_rows-start)
+            times = t0 + 8.2*np.arange(start, start+n)
+            values = np.round(rng.normal(20.0, 5.0, (n, num_cols-1)), 2)
+            np.savetxt(f, np.column_stack([times, values]), fmt="%.2f")
+    return [name.lower() for name in names[1:4]]
+
+
+def measure(func):
+    t = time.perf_counter()
+    func()
+    t = time.perf_counter() - t
+    # Tracing the allocations slows down the code which makes many Python
+    # objects, so the peak memory is measured in a second run
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return t, peak/1024**2
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reading a few MSIDs from a wide tracelog.')
+    parser.add_argument("--rows", type=int, default=2000000, help='The number of rows. Default: 2000000')
+    parser.add_argument("--cols", type=int, default=200, help='The number of columns. Default: 200')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    # Keep the cache which get_tracelog_data uses out of the user's own
+    os.environ["ACISPY_CMD_CACHE"] = os.path.join(tmp_dir, "cache")
+    try:
+        filename = os.path.join(tmp_dir, "bench.tl")
+        msids = make_tracelog(filename, args.rows, args.cols)
+        print(f"{args.rows} rows, {args.cols} columns, "
+              f"{os.path.getsize(filename)/1024**2:.1f} MB, reading {len(msids)} MSIDs")
+        cache = TracelogCache()
+        cache.load(filename, msids=msids)
+        times = {}
+        for label, func in [("all columns", lambda: parse_columns(filename)),
+                            ("selected columns", lambda: parse_columns(filename, msids=msids)),
+                            ("cache", lambda: cache.load(filename, msids=msids)),
+                            ("dataset", lambda: get_tracelog_data(filename, msids, cache=False)),
+                            ("dataset, cache", lambda: get_tracelog_data(filename, msids))]:
+            times[label], peak = measure(func)
+            print(f"{label:17s} {times[label]:8.3f} s {peak:10.1f} MB peak")
+        print(f"The cache makes get_tracelog_data "
+              f"{times['dataset']/times['dataset, cache']:.1f} times faster.")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ entry_points = {
         "make_sop_table = acispy_cmd.make_sop_table:main",
         "multiplot_archive = acispy_cmd.multiplot_archive:main",
         "multiplot_tracelog = acispy_cmd.multiplot_tracelog:main",
+        "batch_phase_plots = acispy_cmd.batch_phase_plots:main",
         "phase_histogram_plot = acispy_cmd.phase_histogram_plot:main",
         "phase_scatter_plot = acispy_cmd.phase_scatter_plot:main",
         "plot_10day_tl = acispy_cmd.plot_10day_tl:main",
@@ -0,0 +1,380 @@
+import os
+import types
+from collections import namedtuple
+import numpy as np
+import pytest
+from astropy.table import Table
+from cxotime import CxoTime
+from acispy_cmd import current_load_page
+from acispy_cmd.current_load_page import Scheduler, RenderCache, LimitCache, \
+    SlidingWindow, merge_timeline, find_first_change, check_warm_start, ModelRun
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A clock which only moves when the scheduler waits.
+    """
+    clock = types.SimpleNamespace(now=0.0)
+
+    def sleep(timeout):
+        clock.now += timeout
+
+    monkeypatch.setattr(current_load_page, "time",
+                        types.SimpleNamespace(monotonic=lambda: clock.now,
+                                              sleep=sleep))
+    return clock
+
+
+def test_scheduler_cadences(clock):
+    calls = []
+    scheduler = Scheduler()
+    scheduler.add_stage("fast", lambda: calls.append(("fast", clock.now)), 10.0)
+    scheduler.add_stage("slow", lambda: calls.append(("slow", clock.now)), 25.0)
+    scheduler.run(100.0)
+    # The same as stepping through every second and running whatever is due
+    expected = []
+    for t in range(100):
+        if t % 10 == 0:
+            expected.append(("fast", t))
+        if t % 25 == 0:
+            expected.append(("slow", t))
+    assert calls == expected
+
+
+def test_scheduler_trigger(clock):
+    calls = []
+    scheduler = Scheduler()
+
+    def reload():
+        calls.append(("reload", clock.now))
+        scheduler.trigger("render")
+
+    scheduler.add_stage("reload", reload, 50.0)
+    scheduler.add_stage("render", lambda: calls.append(("render", clock.now)), 30.0)
+    scheduler.run(100.0)
+    # A triggered stage runs in the same pass, and then on its own cadence
+    assert calls == [("reload", 0.0), ("render", 0.0), ("render", 30.0),
+                     ("reload", 50.0), ("render", 50.0), ("render", 80.0)]
+
+
+def test_scheduler_failure(clock):
+    calls = []
+    scheduler = Scheduler()
+
+    def fail():
+        calls.append(("fail", clock.now))
+        raise RuntimeError
+
+    scheduler.add_stage("fail", fail, 40.0)
+    scheduler.add_stage("ok", lambda: calls.append(("ok", clock.now)), 30.0)
+    scheduler.run(100.0)
+    # A failing stage does not stop the others, and is retried at its cadence
+    assert calls == [("fail", 0.0), ("ok", 0.0), ("ok", 30.0), ("fail", 40.0),
+                     ("ok", 60.0), ("fail", 80.0), ("ok", 90.0)]
+
+
+def test_render_cache():
+    cache = RenderCache()
+    rounds = [
+        {"1dpamzt": (0, 1), "ccd": (0, 1), "roll": (0, 1)},
+        {"1dpamzt": (0, 1), "ccd": (0, 1), "roll": (0, 1)},
+        {"1dpamzt": (1, 1), "ccd": (1, 1), "roll": (0, 1)},
+        {"1dpamzt": (1, 2), "ccd": (1, 1), "roll": (0, 1), "pitch": (1, 2)},
+    ]
+    images = {}
+    for fingerprints in rounds:
+        stale = cache.get_stale(fingerprints)
+        for name in stale:
+            images[name] = fingerprints[name]
+        cache.update({name: fingerprints[name] for name in stale})
+        # The same images as rendering every figure again
+        assert images == fingerprints
+    assert (cache.hits, cache.misses) == (6, 7)
+    assert cache.get_stats() == "Render cache: 6 hits, 7 misses."
+
+
+class FakeLimit:
+    made = 0
+
+    def __init__(self, model_spec=None):
+        FakeLimit.made += 1
+        self.model_spec = model_spec
+
+    def get_limit_line(self, states, which="high"):
+        offset = 0.0 if which == "high" else -20.0
+        return np.asarray(states, dtype="float64") + offset
+
+
+@pytest.fixture
+def limits(monkeypatch, tmp_path):
+    specs = {}
+    for temp in ["1dpamzt", "tmp_bep_pcb"]:
+        specs[temp] = tmp_path / f"{temp}_spec.json"
+        specs[temp].write_text("{}")
+    monkeypatch.setattr(current_load_page, "model_specs", specs)
+    monkeypatch.setattr(current_load_page, "limit_classes",
+                        {temp: FakeLimit for temp in specs})
+    FakeLimit.made = 0
+    return specs
+
+
+def check_limits(cache, temp, states):
+    limit_obj, limit_lines = cache.get(temp, states)
+    # The same limit lines as making the limit object again
+    expected = LimitCache().get(temp, states)[1]
+    assert len(limit_lines) == len(expected)
+    for line, expected_line in zip(limit_lines, expected):
+        np.testing.assert_array_equal(line, expected_line)
+    return limit_obj
+
+
+def test_limit_cache(limits):
+    cache = LimitCache()
+    states = [30.0, 35.0]
+    limit_obj = check_limits(cache, "1dpamzt", states)
+    assert check_limits(cache, "1dpamzt", states) is limit_obj
+    assert len(cache.get("tmp_bep_pcb", states)[1]) == 2
+    # New states, even if equal, are a reload
+    assert check_limits(cache, "1dpamzt", list(states)) is not limit_obj
+    limit_obj = cache.get("1dpamzt", states)[0]
+    # So is a change to the model spec
+    mtime = os.path.getmtime(limits["1dpamzt"])
+    os.utime(limits["1dpamzt"], (mtime + 10.0, mtime + 10.0))
+    assert check_limits(cache, "1dpamzt", states) is not limit_obj
+    made = FakeLimit.made
+    cache.clear()
+    cache.get("1dpamzt", states)
+    assert FakeLimit.made == made + 1
+
+
+def test_merge_timeline():
+    rng = np.random.default_rng(0)
+    cmdtimes = np.sort(rng.integers(0, 50, 40)).astype("float64")
+    cmdlines = ["cmd %d\n" % i for i in range(cmdtimes.size)]
+    comm_rows = sorted(((float(t), "comm %d\n" % i)
+                        for i, t in enumerate(rng.integers(0, 50, 6))),
+                       key=lambda row: row[0])
+    for now in [-1.0, 0.0, 17.0, float(cmdtimes[-1]), 60.0]:
+        now_row = (now, "now\n")
+        lines = merge_timeline(cmdtimes, cmdlines, comm_rows, now_row)
+        # The same as sorting all of the lines, with ties in that order
+        rows = [(t, 0, line) for t, line in zip(cmdtimes, cmdlines)]
+        rows += [(t, 1, line) for t, line in comm_rows]
+        rows.append((now, 2, now_row[1]))
+        rows.sort(key=lambda row: row[:2])
+        assert lines == [row[2] for row in rows]
+
+
+t0 = 1.0e8
+
+Event = namedtuple("Event", ["tstart", "tstop"])
+
+state_dtype = [("datestart", "U21"), ("datestop", "U21"), ("tstart", "f8"),
+               ("tstop", "f8"), ("obsid", "i8")]
+
+
+class FakeKadi:
+    """
+    Commands, states, comms and rad zones which can be changed between
+    refreshes, as kadi's are when loads are approved or interrupted.
+    """
+    def __init__(self):
+        self.cmd_times = list(t0 + np.arange(0.0, 100000.0, 300.0))
+        self.state_times = t0 + np.arange(0.0, 200001.0, 1000.0)
+        self.obsids = np.arange(self.state_times.size - 1)
+        self.comms = [Event(t, t + 1000.0) for t in t0 + np.arange(0.0, 100000.0, 5000.0)]
+        self.radzones = [Event(t, t + 3000.0) for t in t0 + np.arange(0.0, 100000.0, 20000.0)]
+
+    def get_cmds(self, tstart, tstop):
+        times = [t for t in sorted(self.cmd_times) if tstart <= t < tstop]
+        return Table({"date": CxoTime(times).date if times else np.array([], dtype="U21"),
+                      "tlmsid": ["CMD%d" % t for t in times]})
+
+    def get_states(self, tstart, tstop):
+        i0 = np.searchsorted(self.state_times, tstart, side="right") - 1
+        i1 = np.searchsorted(self.state_times, tstop, side="left")
+        states = np.zeros(i1 - i0, dtype=state_dtype)
+        states["tstart"] = self.state_times[i0:i1]
+        states["tstop"] = self.state_times[i0+1:i1+1]
+        states["obsid"] = self.obsids[i0:i1]
+        states["tstart"][0] = tstart
+        states["tstop"][-1] = tstop
+        states["datestart"] = CxoTime(states["tstart"]).date
+        states["datestop"] = CxoTime(states["tstop"]).date
+        return states
+
+    def get_events(self, events, start, stop):
+        tstart, tstop = CxoTime(start).secs, CxoTime(stop).secs
+        return [e for e in events if e.tstop >= tstart and e.tstart <= tstop]
+
+    def get_window(self):
+        window = SlidingWindow(overlap=3600.0)
+        window._fetch_cmds = self.get_cmds
+        window._fetch_states = self.get_states
+        return window
+
+
+@pytest.fixture
+def kadi(monkeypatch):
+    kadi = FakeKadi()
+    monkeypatch.setattr(current_load_page, "get_comms",
+                        lambda start, stop: kadi.get_events(kadi.comms, start, stop))
+    monkeypatch.setattr(current_load_page, "get_radzones",
+                        lambda start, stop: kadi.get_events(kadi.radzones, start, stop))
+    return kadi
+
+
+def get_obsids(states, times):
+    idxs = np.searchsorted(states["tstart"], times, side="right") - 1
+    assert np.all(times < states["tstop"][idxs])
+    return states["obsid"][idxs]
+
+
+def check_window(window, kadi, now, ranges):
+    # The same as fetching everything again
+    full = kadi.get_window()
+    assert full.refresh(now, *ranges)
+    assert list(window.cmds["date"]) == list(full.cmds["date"])
+    assert list(window.cmds["tlmsid"]) == list(full.cmds["tlmsid"])
+    assert window.comms == full.comms
+    assert window.radzones == full.radzones
+    # States may be split where the new ones were fetched from
+    times = np.arange(ranges[2], ranges[3], 50.0)
+    np.testing.assert_array_equal(get_obsids(window.states, times),
+                                  get_obsids(full.states, times))
+    assert window.states["tstart"][0] <= ranges[2]
+    assert window.states["tstop"][-1] == ranges[3]
+    np.testing.assert_array_equal(window.states["tstart"][1:], window.states["tstop"][:-1])
+
+
+def get_ranges(now):
+    return now - 20000.0, now + 20000.0, now - 40000.0, now + 40000.0
+
+
+def test_sliding_window(kadi):
+    window = kadi.get_window()
+    now = t0 + 50000.0
+    assert window.refresh(now, *get_ranges(now))
+    check_window(window, kadi, now, get_ranges(now))
+    for step in range(5):
+        now += 600.0
+        # Commands and states within the overlap change
+        kadi.cmd_times.append(now + 100.0*step - 1000.0)
+        kadi.obsids[np.searchsorted(kadi.state_times, now)] = 1000 + step
+        kadi.comms.append(Event(now - 500.0, now + 100.0))
+        assert not window.refresh(now, *get_ranges(now))
+        check_window(window, kadi, now, get_ranges(now))
+
+
+def test_sliding_window_full_refetch(kadi):
+    window = kadi.get_window()
+    now = t0 + 50000.0
+    assert window.refresh(now, *get_ranges(now))
+    now += 600.0
+    assert not window.refresh(now, *get_ranges(now))
+    window.force_full_refetch()
+    assert window.refresh(now, *get_ranges(now))
+    assert not window.refresh(now, *get_ranges(now))
+    # The windows have moved past what was fetched before
+    now += 30000.0
+    assert window.refresh(now, *get_ranges(now))
+    check_window(window, kadi, now, get_ranges(now))
+
+
+def make_states(times, obsids, pitches):
+    """
+    Make states from *times*, merging those which are the same.
+    """
+    rows = []
+    for tstart, tstop, obsid, pitch in zip(times[:-1], times[1:], obsids, pitches):
+        if rows and rows[-1][2:] == [obsid, pitch]:
+            rows[-1][1] = tstop
+        else:
+            rows.append([tstart, tstop, obsid, pitch])
+    return np.array([tuple(row) for row in rows],
+                    dtype=[("tstart", "f8"), ("tstop", "f8"), ("obsid", "i8"),
+                           ("pitch", "f8")])
+
+
+def get_first_change(old_states, new_states):
+    # Step through every second of the span the states have in common
+    t0 = max(old_states["tstart"][0], new_states["tstart"][0])
+    t1 = min(old_states["tstop"][-1], new_states["tstop"][-1])
+    for t in np.arange(t0, t1):
+        values = []
+        for states in (old_states, new_states):
+            i = np.searchsorted(states["tstart"], t, side="right") - 1
+            values.append((states["obsid"][i], states["pitch"][i]))
+        if values[0] != values[1]:
+            return t
+    return np.inf
+
+
+def test_find_first_change():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        times = np.cumsum(rng.integers(1, 50, 40)).astype("float64")
+        obsids = rng.integers(0, 3, 39)
+        pitches = rng.choice([90.0, 150.0], 39)
+        old_states = make_states(times, obsids, pitches)
+        i0 = rng.integers(0, 10)
+        i1 = rng.integers(30, 40)
+        new_times = times
+        new_obsids = obsids.copy()
+        new_pitches = pitches
+        change = rng.integers(0, 4)
+        if change == 1:
+            # A state changes
+            new_obsids[rng.integers(i0, 39)] += 10
+        elif change == 2:
+            # The states from some time on change
+            new_obsids[rng.integers(i0, 39):] = 10
+        elif change == 3:
+            # The states change part way through a state, as after a
+            # safing action
+            k = rng.integers(i0, 38)
+            new_times = np.insert(times, k + 1, np.floor(0.5*(times[k] + times[k+1])))
+            new_obsids = np.append(np.insert(obsids, k, obsids[k])[:k+1], [10]*(39 - k))
+            new_pitches = np.insert(pitches, k, pitches[k])
+            i1 += 1
+        new_states = make_states(new_times[i0:i1+1], new_obsids[i0:i1], new_pitches[i0:i1])
+        assert find_first_change(old_states, new_states) == \
+            get_first_change(old_states, new_states)
+    assert find_first_change(old_states, old_states) == np.inf
+
+
+class FakeModel:
+    def __init__(self, times, values):
+        self.times = times
+        self.values = values
+
+    def __getitem__(self, field):
+        return types.SimpleNamespace(times=self.times, value=self.values)
+
+
+def model_temp(times):
+    return 20.0 + 5.0*np.sin(times/3000.0)
+
+
+def test_warm_start():
+    field = ("model", "1dpamzt")
+    times = np.arange(0.0, 100000.0, 328.0)
+    cold = ModelRun(FakeModel(times, model_temp(times)))
+    # Warm-start a run part way through, which ends later
+    t_restart = times[100]
+    new_times = np.arange(t_restart, 120000.0, 328.0)
+    values = model_temp(new_times)
+    warm = FakeModel(new_times, values + 0.01)
+    assert check_warm_start(warm, cold, "1dpamzt", t_restart, 80000.0, 0.1)
+    run = ModelRun(warm, previous=cold, tmin=times[50], fields=[field])
+    # The same as a full run from the start of the window
+    full_times = np.arange(times[50], 120000.0, 328.0)
+    run_times, run_values, _ = run.get_data(field)
+    np.testing.assert_array_equal(run_times, full_times)
+    np.testing.assert_allclose(run_values, model_temp(full_times), atol=0.01)
+    # Differences after the states change do not matter
+    warm.values = values + np.where(new_times >= 80000.0, 1.0, 0.0)
+    assert check_warm_start(warm, cold, "1dpamzt", t_restart, 80000.0, 0.1)
+    warm.values = values + np.where(new_times >= 60000.0, 1.0, 0.0)
+    assert not check_warm_start(warm, cold, "1dpamzt", t_restart, 80000.0, 0.1)
@@ -0,0 +1,98 @@
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pytest
+import requests
+from acispy_cmd.maude_fetch import MaudeFetcher, to_maude_time, from_maude_times
+
+t0 = 7.0e8
+
+
+class MaudeHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for the MAUDE REST service, with a sample every 10 s at
+    each whole multiple of 10 s, including both ends of the request.
+    """
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("Authorization"))
+        url = urlparse(self.path)
+        if server.status is not None:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        params = parse_qs(url.query)
+        tstart, tstop = from_maude_times([params["ts"][0], params["tp"][0]])
+        times = np.arange(np.ceil(tstart/10.0)*10.0, tstop+0.5, 10.0)
+        data = {"data": [{"msid": params["m"][0],
+                          "times": [int(to_maude_time(t)) for t in times],
+                          "values": (times - t0).tolist()}]}
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), MaudeHandler)
+    server.requests = []
+    server.status = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_fetcher(server, **kwargs):
+    return MaudeFetcher(url="http://127.0.0.1:%d/" % server.server_port, backoff=0.0,
+                        **kwargs)
+
+
+@pytest.mark.parametrize("chunk_time", [100.0, 95.0, 1000.0])
+def test_get_msids(server, chunk_time):
+    fetcher = get_fetcher(server, concurrency=3, chunk_time=chunk_time)
+    out = fetcher.get_msids(["1dpamzt", "1deamzt"], t0, t0+500.0)
+    # The samples at the edges of the chunks are only kept once
+    assert [data["msid"] for data in out["data"]] == ["1dpamzt", "1deamzt"]
+    for data in out["data"]:
+        np.testing.assert_allclose(data["times"], t0 + np.arange(0.0, 510.0, 10.0))
+        np.testing.assert_allclose(data["values"], np.arange(0.0, 510.0, 10.0))
+    assert len(server.requests) == 2*int(np.ceil(500.0/chunk_time))
+
+
+def test_get_msids_empty(server):
+    out = get_fetcher(server).get_msids("1dpamzt", t0, t0)
+    assert out["data"][0]["times"].size == 0
+    assert out["data"][0]["values"].size == 0
+    assert server.requests == []
+
+
+def test_retries(server):
+    server.status = 503
+    with pytest.raises(requests.HTTPError):
+        get_fetcher(server, retries=2).get_chunk("1dpamzt", t0, t0+100.0)
+    assert len(server.requests) == 3
+
+
+def test_no_retries_4xx(server):
+    server.status = 401
+    with pytest.raises(requests.HTTPError):
+        get_fetcher(server, retries=2).get_chunk("1dpamzt", t0, t0+100.0)
+    assert len(server.requests) == 1
+
+
+def test_auth(server, monkeypatch):
+    monkeypatch.setenv("MAUDE_USER", "user")
+    monkeypatch.setenv("MAUDE_PASSWORD", "password")
+    get_fetcher(server).get_chunk("1dpamzt", t0, t0+100.0)
+    assert server.requests == ["Basic " + base64.b64encode(b"user:password").decode()]
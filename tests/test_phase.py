@@ -0,0 +1,202 @@
+import matplotlib
+matplotlib.use("agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+import acispy
+from acispy_cmd import phase
+from acispy_cmd.phase import PhaseHistogram, RasterPhasePlot, rasterize, sample_nearest
+
+
+def make_hist(**kwargs):
+    return PhaseHistogram.from_range("1deamzt", "1dpamzt", (0.0, 50.0), (0.0, 50.0),
+                                     10, 10, **kwargs)
+
+
+def test_save_load(tmp_path):
+    hist = make_hist(stat=None)
+    hist.add([1.0, 2.0, 27.0, np.nan], [1.0, 6.0, 27.0, 3.0])
+    hist.add_interval(0.0, 100.0)
+    hist.x_label = "1deamzt (deg C)"
+    filename = str(tmp_path / "hist.npz")
+    hist.save(filename)
+    hist2 = PhaseHistogram.load(filename)
+    assert (hist2.x_field, hist2.y_field) == ("1deamzt", "1dpamzt")
+    assert hist2.x_label == "1deamzt (deg C)"
+    assert hist2.stat is None
+    assert hist2.source == "archive"
+    assert hist2.intervals == [(0.0, 100.0)]
+    np.testing.assert_array_equal(hist2.counts, hist.counts)
+    assert hist2.counts.sum() == 3
+    assert hist2.counts[0, 0] == 1
+
+
+def test_save_load_maude(tmp_path):
+    hist = make_hist(source="maude")
+    assert hist.stat is None
+    filename = str(tmp_path / "hist.npz")
+    hist.save(filename)
+    assert PhaseHistogram.load(filename).source == "maude"
+
+
+def test_load_unknown_data(tmp_path):
+    hist = make_hist()
+    filename = str(tmp_path / "hist.npz")
+    np.savez(filename, x_field=hist.x_field, y_field=hist.y_field,
+             x_edges=hist.x_edges, y_edges=hist.y_edges, counts=hist.counts,
+             intervals=np.empty((0, 2)), x_label=hist.x_label, y_label=hist.y_label)
+    with pytest.raises(ValueError):
+        PhaseHistogram.load(filename)
+
+
+def test_merge():
+    hist = make_hist()
+    hist.add([1.0], [1.0])
+    hist.add_interval(0.0, 100.0)
+    other = make_hist()
+    other.add([1.0, 45.0], [1.0, 45.0])
+    other.add_interval(100.0, 200.0)
+    other.add_interval(300.0, 400.0)
+    hist.merge(other)
+    assert hist.counts[0, 0] == 2
+    assert hist.counts[9, 9] == 1
+    assert hist.intervals == [(0.0, 200.0), (300.0, 400.0)]
+    assert hist.get_missing_intervals(0.0, 500.0) == [(200.0, 300.0), (400.0, 500.0)]
+
+
+@pytest.mark.parametrize("other", [
+    PhaseHistogram.from_range("1deamzt", "1dpamzt", (0.0, 50.0), (0.0, 50.0), 20, 10),
+    PhaseHistogram.from_range("1dpamzt", "1deamzt", (0.0, 50.0), (0.0, 50.0), 10, 10),
+    make_hist(stat=None),
+    make_hist(source="maude"),
+])
+def test_merge_mismatch(other):
+    hist = make_hist()
+    with pytest.raises(ValueError):
+        hist.merge(other)
+
+
+def test_merge_overlap():
+    hist = make_hist()
+    hist.add_interval(0.0, 100.0)
+    other = make_hist()
+    other.add_interval(50.0, 150.0)
+    with pytest.raises(ValueError):
+        hist.merge(other)
+    assert hist.intervals == [(0.0, 100.0)]
+
+
+class FakeField:
+    def __init__(self, times, value):
+        self.times = times
+        self.value = value
+        self.unit = ""
+
+
+class FakeMaudeData:
+    """
+    MAUDE data with a sample of 1DEAMZT every 10 s and of 1DPAMZT every
+    32.8 s.
+    """
+    def __init__(self, tstart, tstop, msids):
+        dea_times = np.arange(tstart, tstop, 10.0)
+        dpa_times = np.arange(tstart, tstop, 32.8)
+        self.fields = {"1deamzt": FakeField(dea_times, np.full(dea_times.size, 5.0)),
+                       "1dpamzt": FakeField(dpa_times, np.full(dpa_times.size, 25.0))}
+
+    def __getitem__(self, field):
+        return self.fields[field[1]]
+
+
+def test_accumulate_maude(monkeypatch):
+    monkeypatch.setattr(acispy, "MaudeData", FakeMaudeData, raising=False)
+    hist = make_hist(source="maude")
+    hist.accumulate(0.0, 1000.0, chunk_time=400.0)
+    # Each sample of 1DEAMZT is paired with the nearest one of 1DPAMZT
+    assert hist.counts.sum() == 100
+    assert hist.counts[1, 5] == 100
+    assert hist.intervals == [(0.0, 1000.0)]
+    hist.accumulate(0.0, 1000.0)
+    assert hist.counts.sum() == 100
+
+
+def test_sample_nearest():
+    times = np.array([0.0, 10.0, 20.0])
+    values = np.array([1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(sample_nearest(times, values,
+                                                 np.array([-5.0, 4.0, 6.0, 16.0, 30.0])),
+                                  [1.0, 1.0, 2.0, 3.0, 3.0])
+    np.testing.assert_array_equal(sample_nearest(times[:1], values[:1], np.arange(3.0)),
+                                  [1.0, 1.0, 1.0])
+
+
+def test_rasterize_counts():
+    x = np.array([0.0, 0.5, 1.0, 9.99, 10.0, 11.0, 5.0])
+    y = np.array([0.0, 0.5, 1.0, 9.99, 10.0, 5.0, -1.0])
+    image = rasterize(x, y, None, (0.0, 10.0), (0.0, 10.0), (10, 5))
+    assert image.shape == (5, 10)
+    # The samples outside the limits are left out, and those on the upper
+    # limits go in the last pixels
+    assert image.sum() == 5
+    assert image[0, 0] == 2
+    assert image[0, 1] == 1
+    assert image[4, 9] == 2
+
+
+@pytest.mark.parametrize("how, expected", [("mean", 2.0), ("max", 3.0), ("last", 1.0)])
+def test_rasterize_colors(how, expected):
+    x = np.array([0.1, 0.2, 0.3, 0.4, 5.0])
+    y = np.array([0.1, 0.2, 0.3, 0.4, 5.0])
+    c = np.array([2.0, 3.0, np.nan, 1.0, 7.0])
+    image = rasterize(x, y, c, (0.0, 10.0), (0.0, 10.0), (10, 10), how=how)
+    assert image[0, 0] == expected
+    assert image[5, 5] == 7.0
+    assert np.isnan(image).sum() == 98
+
+
+def test_rasterize_unknown():
+    with pytest.raises(ValueError):
+        rasterize(np.zeros(1), np.zeros(1), np.zeros(1), (0.0, 1.0), (0.0, 1.0), (2, 2),
+                  how="median")
+
+
+def test_raster_plot(monkeypatch):
+    calls = []
+
+    def counting_rasterize(*args, **kwargs):
+        calls.append(args[3:5])
+        return rasterize(*args, **kwargs)
+    monkeypatch.setattr(phase, "rasterize", counting_rasterize)
+    rng = np.random.default_rng(0)
+    pp = RasterPhasePlot(rng.uniform(0.0, 10.0, 1000), rng.uniform(0.0, 10.0, 1000))
+    pp.fig.canvas.draw()
+    num_calls = len(calls)
+    # Zooming changes both limits but bins the samples once
+    pp.ax.set_xlim(2.0, 4.0)
+    pp.ax.set_ylim(2.0, 4.0)
+    pp.fig.canvas.draw()
+    assert calls[-1] == ((2.0, 4.0), (2.0, 4.0))
+    assert len(calls) == num_calls + 1
+    pp.fig.canvas.draw()
+    assert len(calls) == num_calls + 1
+    # A view with no samples in it keeps the last scale
+    pp.ax.set_xlim(20.0, 30.0)
+    pp.fig.canvas.draw()
+    assert pp.image.get_array().count() == 0
+    plt.close(pp.fig)
+
+
+def test_raster_plot_colors():
+    pp = RasterPhasePlot(np.arange(10.0), np.arange(10.0), c=np.arange(10.0), how="max")
+    pp.fig.canvas.draw()
+    assert pp.image.norm.vmin == 0.0
+    assert pp.image.norm.vmax == 9.0
+    plt.close(pp.fig)
+
+
+def test_raster_plot_empty():
+    with pytest.raises(ValueError):
+        RasterPhasePlot(np.array([np.nan, 1.0, 2.0]), np.array([1.0, np.nan, np.inf]))
+    # Samples without a color are left out too
+    with pytest.raises(ValueError):
+        RasterPhasePlot(np.arange(3.0), np.arange(3.0), c=np.full(3, np.nan))
@@ -0,0 +1,224 @@
+import os
+import sys
+import types
+import numpy as np
+import pytest
+from cxotime import CxoTime
+from acispy_cmd import telemetry
+from acispy_cmd.telemetry import cached_telemetry, get_missing_intervals, \
+    TelemetryCache
+
+# Times long enough ago for the telemetry to be cached
+t0 = 1.0e8
+
+
+class FakeMSID:
+    colnames = ["vals", "times", "bads"]
+
+    def __init__(self, msid, tstart, tstop, stat=None):
+        self.msid = msid
+        self.stat = stat
+        self.tstart = tstart
+        self.tstop = tstop
+        self.datestart = self.datestop = None
+        self._get_data()
+
+    def _get_data(self):
+        self.times = np.arange(np.ceil(self.tstart), self.tstop, 1.0)
+        self.vals = 3.0*self.times
+        self.bads = np.zeros(self.times.size, dtype=bool)
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch):
+    fetch = types.SimpleNamespace(MSID=type("MSID", (FakeMSID,), {}))
+    cheta = types.ModuleType("cheta")
+    cheta.fetch = fetch
+    monkeypatch.setitem(sys.modules, "cheta", cheta)
+    monkeypatch.setitem(sys.modules, "cheta.fetch", fetch)
+    # Leave MAUDE out of these tests
+    monkeypatch.setitem(sys.modules, "maude", None)
+    return fetch
+
+
+def test_disabled(fake_fetch, tmp_path):
+    get_data = fake_fetch.MSID._get_data
+    with cached_telemetry(enabled=False) as cache:
+        assert cache is None
+        assert fake_fetch.MSID._get_data is get_data
+    assert fake_fetch.MSID._get_data is get_data
+
+
+def test_disabled_decimate(fake_fetch, tmp_path, monkeypatch):
+    # --no-cache --auto-stat still reduces full resolution data
+    monkeypatch.setenv("ACISPY_CMD_CACHE", str(tmp_path))
+    stat, decimate = telemetry.auto_stat(t0, t0+20000.0)
+    assert stat is None
+    with cached_telemetry(enabled=False, decimate=decimate) as cache:
+        assert cache is None
+        msid = fake_fetch.MSID("1dpamzt", t0, t0+20000.0)
+    assert msid.times.size <= 3*decimate
+    assert msid.times[0] == t0
+    assert msid.times[-1] == t0+19999.0
+    np.testing.assert_array_equal(msid.vals, 3.0*msid.times)
+    assert msid.bads.size == msid.times.size
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_enabled(fake_fetch, tmp_path):
+    get_data = fake_fetch.MSID._get_data
+    cache = telemetry.TelemetryCache(cache_dir=str(tmp_path))
+    with cached_telemetry(cache=cache) as c:
+        assert c is cache
+        assert fake_fetch.MSID._get_data is not get_data
+    assert fake_fetch.MSID._get_data is get_data
+
+
+@pytest.mark.parametrize("covered, missing", [
+    ([], [(0.0, 10.0)]),
+    ([(0.0, 10.0)], []),
+    ([(-5.0, 3.0), (6.0, 8.0)], [(3.0, 6.0), (8.0, 10.0)]),
+    ([(6.0, 8.0), (2.0, 4.0)], [(0.0, 2.0), (4.0, 6.0), (8.0, 10.0)]),
+    ([(2.0, 5.0), (4.0, 7.0)], [(0.0, 2.0), (7.0, 10.0)]),
+    ([(-5.0, 0.0), (10.0, 15.0)], [(0.0, 10.0)]),
+])
+def test_get_missing_intervals(covered, missing):
+    assert get_missing_intervals(0.0, 10.0, covered) == missing
+
+
+class Fetcher:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, tstart, tstop):
+        self.calls.append((tstart, tstop))
+        times = np.arange(np.ceil(tstart/10.0)*10.0, tstop, 10.0)
+        return {"times": times, "vals": 2.0*times}
+
+
+def test_telemetry_cache(tmp_path):
+    cache = TelemetryCache(cache_dir=str(tmp_path))
+    fetch = Fetcher()
+    key = ("archive", "1dpamzt", "5min", None)
+    columns = cache.get(key, t0+100.0, t0+1000.0, fetch)
+    np.testing.assert_array_equal(columns["times"], np.arange(t0+100.0, t0+1000.0, 10.0))
+    np.testing.assert_array_equal(columns["vals"], 2.0*columns["times"])
+    assert fetch.calls == [(t0+100.0, t0+1000.0)]
+    # Only the parts which are not in the cache are fetched
+    columns = cache.get(key, t0, t0+2000.0, fetch)
+    np.testing.assert_array_equal(columns["times"], np.arange(t0, t0+2000.0, 10.0))
+    assert fetch.calls[1:] == [(t0, t0+100.0), (t0+1000.0, t0+2000.0)]
+    # The chunks were merged into one
+    entry_dir = cache._get_entry_dir(key)
+    assert len(cache._read_index(entry_dir)["chunks"]) == 1
+    assert len([fn for fn in os.listdir(entry_dir) if fn.endswith(".npz")]) == 1
+    columns = cache.get(key, t0+500.0, t0+600.0, fetch)
+    np.testing.assert_array_equal(columns["times"], np.arange(t0+500.0, t0+600.0, 10.0))
+    assert len(fetch.calls) == 3
+    # Other keys have their own entries
+    cache.get(("archive", "1dpamzt", "daily", None), t0+500.0, t0+600.0, fetch)
+    assert len(fetch.calls) == 4
+
+
+def test_telemetry_cache_recent(tmp_path):
+    cache = TelemetryCache(cache_dir=str(tmp_path))
+    fetch = Fetcher()
+    key = ("maude", "1dpamzt", None, None)
+    tstop = np.ceil(CxoTime().secs/10.0)*10.0
+    tstart = tstop - telemetry.recent_time - 1000.0
+    columns = cache.get(key, tstart, tstop, fetch)
+    np.testing.assert_array_equal(columns["times"], np.arange(tstart, tstop, 10.0))
+    cache.get(key, tstart, tstop, fetch)
+    # The recent telemetry is fetched every time
+    assert [b for _, b in fetch.calls].count(tstop) == 2
+    assert fetch.calls[0] == (tstart, fetch.calls[1][0])
+
+
+def test_telemetry_cache_damaged(tmp_path):
+    cache = TelemetryCache(cache_dir=str(tmp_path))
+    fetch = Fetcher()
+    key = ("archive", "1dpamzt", None, None)
+    cache.get(key, t0, t0+100.0, fetch)
+    entry_dir = cache._get_entry_dir(key)
+    for fn in os.listdir(entry_dir):
+        if fn.endswith(".npz"):
+            os.remove(os.path.join(entry_dir, fn))
+    columns = cache.get(key, t0, t0+100.0, fetch)
+    assert columns["times"].size == 10
+    assert len(fetch.calls) == 2
+
+
+def test_route_archive(fake_fetch, tmp_path):
+    cache = TelemetryCache(cache_dir=str(tmp_path))
+    with cached_telemetry(cache=cache):
+        msid = fake_fetch.MSID("1dpamzt", t0+10.0, t0+100.0)
+        np.testing.assert_array_equal(msid.times, np.arange(t0+10.0, t0+100.0))
+        np.testing.assert_array_equal(msid.vals, 3.0*msid.times)
+        assert (msid.tstart, msid.tstop) == (t0+10.0, t0+100.0)
+        msid = fake_fetch.MSID("1dpamzt", t0+50.0, t0+150.0)
+        np.testing.assert_array_equal(msid.times, np.arange(t0+50.0, t0+150.0))
+    assert cache.hits == 1
+    assert cache.misses == 2
+
+
+def test_route_archive_unknown_columns(fake_fetch, tmp_path):
+    fake_fetch.MSID.colnames = ["vals", "times", "bads", "raw_vals"]
+    fake_fetch.MSID.raw_vals = None
+    cache = TelemetryCache(cache_dir=str(tmp_path))
+    with cached_telemetry(cache=cache):
+        msid = fake_fetch.MSID("1dpamzt", t0+10.0, t0+100.0)
+    np.testing.assert_array_equal(msid.times, np.arange(t0+10.0, t0+100.0))
+    assert cache.hits == cache.misses == 0
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_decimate_minmax():
+    rng = np.random.default_rng(0)
+    times = np.sort(rng.uniform(0.0, 1000.0, 10000))
+    values = rng.normal(size=times.size)
+    values[1234] = 100.0
+    values[5678] = -100.0
+    idxs = telemetry.decimate_minmax(times, values, 0.0, 1000.0, 50)
+    assert np.all(np.diff(idxs) > 0)
+    assert idxs.size <= 3*50
+    assert 1234 in idxs and 5678 in idxs
+    # The minimum and maximum of each bucket are kept
+    buckets = (times/20.0).astype(int)
+    for b in range(50):
+        kept = values[idxs][buckets[idxs] == b]
+        assert kept.min() == values[buckets == b].min()
+        assert kept.max() == values[buckets == b].max()
+
+
+def test_decimate_minmax_unreduced():
+    times = np.arange(100.0)
+    assert telemetry.decimate_minmax(times, times, 0.0, 100.0, 50).size == 100
+    values = np.array(["NSUN"]*1000)
+    times = np.arange(1000.0)
+    assert telemetry.decimate_minmax(times, values, 0.0, 1000.0, 50).size == 1000
+
+
+def test_envelope():
+    columns = {"times": np.array([0.0, 328.0]), "vals": np.array([1.0, 2.0]),
+               "means": np.array([1.0, 2.0]), "mins": np.array([0.5, 1.5]),
+               "maxes": np.array([3.0, 4.0]), "samples": np.array([10, 10])}
+    envelope = telemetry._envelope(columns)
+    np.testing.assert_array_equal(envelope["times"], [0.0, 0.0, 328.0, 328.0])
+    np.testing.assert_array_equal(envelope["vals"], [0.5, 3.0, 1.5, 4.0])
+    np.testing.assert_array_equal(envelope["means"], [0.5, 3.0, 1.5, 4.0])
+    np.testing.assert_array_equal(envelope["samples"], [10, 10, 10, 10])
+
+
+def test_route_archive_stat(fake_fetch, tmp_path):
+    def _get_data(self):
+        self.times = np.arange(np.ceil(self.tstart/328.0)*328.0, self.tstop, 328.0)
+        self.vals = np.ones(self.times.size)
+        self.mins = np.zeros(self.times.size)
+        self.maxes = np.full(self.times.size, 2.0)
+    fake_fetch.MSID._get_data = _get_data
+    fake_fetch.MSID.colnames = ["times", "vals", "mins", "maxes"]
+    cache = TelemetryCache(cache_dir=str(tmp_path))
+    with cached_telemetry(cache=cache, decimate=1000):
+        msid = fake_fetch.MSID("1dpamzt", t0, t0+100*328.0, stat="5min")
+    assert msid.times.size == 200
+    np.testing.assert_array_equal(msid.vals[:4], [0.0, 2.0, 0.0, 2.0])
@@ -0,0 +1,195 @@
+import os
+import numpy as np
+import pytest
+from acispy_cmd.tracelog import TracelogTail, TracelogSet, TracelogCache, \
+    parse_tracelog, write_tracelog, get_tracelog_data, tracelog_time_offset
+
+header = "TIME 1DPAMZT STATE\n"
+
+
+def make_rows(times):
+    return "".join("%.1f %.2f NSUN\n" % (t + tracelog_time_offset, 0.01*t)
+                   for t in times)
+
+
+def write(filename, text, mode="w"):
+    with open(filename, mode) as f:
+        f.write(text)
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / "test.tl")
+
+
+def test_append(filename):
+    write(filename, header + make_rows(range(0, 100, 10)))
+    tail = TracelogTail(filename)
+    assert tail.update()
+    assert len(tail) == 10
+    # A partial row is not read until it is complete
+    row = make_rows([130])
+    write(filename, make_rows(range(100, 130, 10)) + row[:-8], mode="a")
+    assert tail.update()
+    np.testing.assert_array_equal(tail.times, np.arange(0.0, 130.0, 10.0))
+    assert not tail.update()
+    write(filename, row[-8:], mode="a")
+    assert tail.update()
+    assert tail.times[-1] == 130.0
+    assert tail.get_data("1dpamzt")[1][-1] == 1.3
+    assert tail.get_data(("msids", "state"))[1][-1] == "NSUN"
+    assert tail.full_reads == 1
+
+
+def test_retention(filename):
+    write(filename, header + make_rows(range(0, 1000, 10)))
+    tail = TracelogTail(filename, retention=500.0)
+    tail.update()
+    assert tail.times[0] == 490.0
+    write(filename, make_rows(range(1000, 1100, 10)), mode="a")
+    tail.update()
+    assert tail.times[0] == 590.0
+    assert tail.times[-1] == 1090.0
+
+
+def test_rotate(filename):
+    write(filename, header + make_rows(range(0, 100, 10)))
+    tail = TracelogTail(filename)
+    tail.update()
+    os.remove(filename)
+    write(filename, header + make_rows(range(200, 250, 10)))
+    assert tail.update()
+    np.testing.assert_array_equal(tail.times, np.arange(200.0, 250.0, 10.0))
+    assert tail.full_reads == 2
+
+
+def test_truncate(filename):
+    write(filename, header + make_rows(range(0, 100, 10)))
+    tail = TracelogTail(filename)
+    tail.update()
+    write(filename, header + make_rows(range(0, 30, 10)))
+    assert tail.update()
+    np.testing.assert_array_equal(tail.times, [0.0, 10.0, 20.0])
+    assert tail.full_reads == 2
+
+
+@pytest.mark.parametrize("text", ["", "TIME 1DP", header, header + "5.0 0.0"])
+def test_partial_rewrite(filename, text):
+    write(filename, header + make_rows(range(0, 100, 10)))
+    tail = TracelogTail(filename)
+    tail.update()
+    # The old rows are kept while the new file is being written
+    write(filename, text)
+    assert not tail.update()
+    assert len(tail) == 10
+    assert tail.get_data("1dpamzt")[1][-1] == 0.9
+    write(filename, header + make_rows(range(500, 520, 10)))
+    assert tail.update()
+    np.testing.assert_array_equal(tail.times, [500.0, 510.0])
+
+
+def test_set(tmp_path):
+    filenames = [str(tmp_path / "a.tl"), str(tmp_path / "b.tl")]
+    write(filenames[0], header + make_rows(range(0, 50, 10)))
+    write(filenames[1], "TIME 1DEAMZT\n")
+    tracelogs = TracelogSet(filenames)
+    assert tracelogs.update()
+    assert len(tracelogs) == 5
+    assert "1dpamzt" in tracelogs
+    assert "1deamzt" not in tracelogs
+    with pytest.raises(KeyError):
+        tracelogs.get_data("1deamzt")
+
+
+wide_header = "TIME 1DPAMZT 1DEAMZT STATE\n"
+
+
+def make_wide_rows(times):
+    return "".join("%.1f %.2f %.2f NSUN\n" % (t + tracelog_time_offset, 0.01*t, 0.02*t)
+                   for t in times)
+
+
+def test_cache(tmp_path, filename):
+    write(filename, wide_header + make_wide_rows(range(0, 100, 10)))
+    cache = TracelogCache(cache_dir=str(tmp_path / "cache"))
+    tracelog = cache.load(filename, msids=["1dpamzt"])
+    assert set(tracelog.columns) == {"time", "1dpamzt"}
+    tracelog = cache.load(filename, msids=["1dpamzt"])
+    assert isinstance(tracelog.times, np.memmap)
+    np.testing.assert_array_equal(tracelog.times, np.arange(0.0, 100.0, 10.0))
+    # The other columns are added to the entry as they are asked for
+    np.testing.assert_allclose(tracelog.get_column("1deamzt"), 0.02*np.arange(0, 100, 10))
+    tracelog = cache.load(filename)
+    assert set(tracelog.columns) == {"time", "1dpamzt", "1deamzt"}
+    assert tracelog.get_column("state")[0] == "NSUN"
+    entry_dir = cache._get_entry_dir(filename)
+    assert sorted(fn for fn in os.listdir(entry_dir) if fn.endswith(".npy")) == \
+        ["col_1deamzt.npy", "col_1dpamzt.npy", "col_state.npy", "col_time.npy", "times.npy"]
+
+
+def test_cache_invalidation(tmp_path, filename):
+    write(filename, wide_header + make_wide_rows(range(0, 100, 10)))
+    cache = TracelogCache(cache_dir=str(tmp_path / "cache"))
+    cache.load(filename, msids=["1dpamzt"])
+    write(filename, make_wide_rows(range(100, 120, 10)), mode="a")
+    tracelog = cache.load(filename, msids=["1dpamzt"])
+    assert tracelog.times[-1] == 110.0
+    assert tracelog.get_column("1dpamzt")[-1] == 1.1
+    # A file of the same size with other values
+    write(filename, wide_header + make_wide_rows(range(0, 120, 10)).replace("NSUN", "NMAN"))
+    assert cache.load(filename).get_column("state")[0] == "NMAN"
+
+
+def test_cache_tbegin(tmp_path, filename):
+    write(filename, wide_header + make_wide_rows(range(0, 100, 10)))
+    cache = TracelogCache(cache_dir=str(tmp_path / "cache"))
+    np.testing.assert_array_equal(cache.load(filename, tbegin=50.0).times,
+                                  [50.0, 60.0, 70.0, 80.0, 90.0])
+    # A later window is cut from the entry, and an earlier one rebuilds it
+    np.testing.assert_array_equal(cache.load(filename, tbegin=75.0).times, [80.0, 90.0])
+    assert cache.load(filename, tbegin=20.0).times[0] == 20.0
+    assert cache.load(filename).times.size == 10
+
+
+def test_write_tracelog(tmp_path, filename):
+    write(filename, wide_header + make_wide_rows(range(0, 100, 10)))
+    tracelog = parse_tracelog(filename)
+    out = str(tmp_path / "out.tl")
+    write_tracelog(out, tracelog, {"1dpamzt", "state"}, chunk_size=3)
+    tracelog2 = parse_tracelog(out)
+    assert tracelog2.names == ["TIME", "1DPAMZT", "STATE"]
+    np.testing.assert_array_equal(tracelog2.times, tracelog.times)
+    np.testing.assert_array_equal(tracelog2.get_column("1dpamzt"),
+                                  tracelog.get_column("1dpamzt"))
+    np.testing.assert_array_equal(tracelog2.get_column("state"), tracelog.get_column("state"))
+
+
+class FakeTracelogData:
+    def __init__(self, filenames, tbegin=None):
+        self.filenames = filenames
+        self.tbegin = tbegin
+        names = filenames if isinstance(filenames, list) else [filenames]
+        self.tracelogs = [parse_tracelog(filename) for filename in names]
+
+
+def test_get_tracelog_data(tmp_path, filename, monkeypatch):
+    acispy = pytest.importorskip("acispy")
+    monkeypatch.setattr(acispy, "TracelogData", FakeTracelogData, raising=False)
+    write(filename, wide_header + make_wide_rows(range(0, 100, 10)))
+    ds = get_tracelog_data(filename, ["1DPAMZT"], tbegin=50.0, cache=False)
+    # Only the column asked for is handed to ACISpy, from tbegin on
+    assert ds.filenames != filename
+    assert ds.tracelogs[0].names == ["TIME", "1DPAMZT"]
+    np.testing.assert_array_equal(ds.tracelogs[0].times, [50.0, 60.0, 70.0, 80.0, 90.0])
+
+
+@pytest.mark.parametrize("msids", [[], ["1pdeaat"]])
+def test_get_tracelog_data_fallback(tmp_path, filename, monkeypatch, msids):
+    acispy = pytest.importorskip("acispy")
+    monkeypatch.setattr(acispy, "TracelogData", FakeTracelogData, raising=False)
+    write(filename, wide_header + make_wide_rows(range(0, 100, 10)))
+    # With only states to plot, or an MSID which is not in the file,
+    # ACISpy reads the file itself
+    ds = get_tracelog_data([filename], msids, tbegin=50.0, cache=False)
+    assert ds.filenames == filename
+    assert ds.tbegin == 50.0